@@ -1,15 +1,230 @@
-from PyInquirer import prompt       # !! needs to be installed with pip !!
+import argparse
+import bisect
+import concurrent.futures
+import http.server
+import json
 import socket
 import queue
 import math
+import collections
 import os
 import libscrc._crc16               # !! needs to be installed with pip !!
+import struct
 import threading
+import time
+import ctypes
+import errno
+import fcntl
+import multiprocessing
+import select
+import selectors
+import sys
+import random
+import tempfile
+import hashlib
+import hmac
+import zlib
+import lzma
+try:
+    import zstandard                # optional, zstd compression is offered only when it's installed
+except ImportError:
+    zstandard = None
+try:
+    import crc32c                   # optional, crc32c checksum is offered only when it's installed
+except ImportError:
+    crc32c = None
+try:
+    import numpy                    # optional, parity fragments are computed with python integers without it
+                                    # and receiver does not offer delta mode
+except ImportError:
+    numpy = None
+try:
+    # optional, secure sessions are offered only when it's installed
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+except ImportError:
+    ChaCha20Poly1305 = InvalidTag = None
 
 # turns on alteration of fragments, so that they are handled as corrupted on receiving end
-ALTERED = True
+ALTERED = False
 # doesn't send some of the fragments, so that they are handled as missing on receiving end
 MISSING = False
+# LossSimulator that decides fate of every data fragment of version 5, None to send all of them
+SIMULATOR = None
+
+# version 1 is the original protocol with batches of 10 fragments, version 5 uses selective repeat,
+# wide header that allows transfers of any size, session id, so that server can receive from many clients,
+# and stream id, so that client can send many files at once
+LEGACY_VERSION = 1
+PROTOCOL_VERSION = 5
+
+# header of version 1: type, data length, number of fragments, index (at most 65535 fragments)
+LEGACY_FRAGMENT_HEADER = struct.Struct("!BHHH")
+# header of version 5: type, flags, data length, session id, stream id, number of fragments, index,
+# offset of data in file
+FRAGMENT_HEADER = struct.Struct("!BBHIIIIQ")
+# crc16 stored behind data of fragment, version 5 fragments can carry crc32 instead
+CRC = struct.Struct("!H")
+CRC32 = struct.Struct("!I")
+# largest datagram that fits into ethernet frame without being fragmented (1500 - 20 for IP - 8 for UDP)
+MAX_DATAGRAM = 1472
+# largest data of UDP datagram over IPv4, fragment size entered by user is limited by it
+MAX_PAYLOAD = 65507
+# sizes of datagrams tried by path MTU discovery from the largest: jumbo frame (9000), FDDI (4352),
+# ethernet (1500), PPPoE (1492) and minimal IPv6 MTU (1280), all without 28 bytes of IP and UDP header
+PROBE_SIZES = (8972, 4324, 1472, 1464, 1252)
+# receiver confirms probe that arrived within this many seconds
+PROBE_TIMEOUT = 0.3
+# options of Linux sockets for path MTU discovery that are not exported by socket module
+IP_MTU_DISCOVER = 10
+IP_MTU = 14
+IP_PMTUDISC_WANT = 1
+IP_PMTUDISC_PROBE = 3
+# option of Linux sockets that lets privileged process set receive buffer above net.core.rmem_max
+SO_RCVBUFFORCE = 33
+
+# types of fragments
+INIT = 1
+DATA = 2
+NACK = 3
+KEEP_ALIVE = 4
+ACK = 5
+SACK = 6
+HEADER = 7
+PROBE = 8
+PARITY = 9
+DIGEST = 10
+SIGNATURES = 11
+MESSAGES = 12
+
+# number of fragments that can be in flight at the start of transfer, window grows and shrinks with loss
+WINDOW_SIZE = 32
+MIN_WINDOW = 2
+# receiver reports at most this many fragments above cumulative ack, so sender never gets further ahead
+MAX_WINDOW = 1024
+# LEDBAT controller keeps queuing delay of path around this many seconds and grows window by at most
+# LEDBAT_GAIN fragments per round trip
+LEDBAT_TARGET = 0.025
+LEDBAT_GAIN = 1.0
+# pacer sends datagrams at this multiple of window per round trip in slow start and afterwards
+PACING_GAIN = (2.0, 1.25)
+# pacer lets at most PACING_BURST datagrams or datagrams of PACING_INTERVAL seconds go out back to back
+PACING_BURST = 16
+PACING_INTERVAL = 0.002
+# retransmission timeout is computed from round trip time like in RFC 6298, it's INITIAL_RTO seconds until
+# round trip time is measured and stays between MIN_RTO and MAX_RTO, timer that expires is backed off twice as long
+INITIAL_RTO = 1.0
+MIN_RTO = 0.02
+MAX_RTO = 60.0
+# retransmission timeout exceeds smoothed round trip time at least by granularity of clock
+CLOCK_GRANULARITY = 0.001
+# fragment is considered lost when this many fragments sent after it were already acknowledged
+REORDER_THRESHOLD = 3
+# receiver acknowledges after every ACK_EVERY fragments or immediately when fragment arrives out of order
+ACK_EVERY = 8
+# flag of the last data fragment of burst, receiver acknowledges it right away, so that sender with window
+# smaller than ACK_EVERY does not wait for retransmission timeout
+ACK_NOW = 0x01
+# transfer is abandoned when nothing is acknowledged for this many seconds
+GIVE_UP_TIMEOUT = 10
+# server forgets client that sent nothing, not even keep alive fragment, for this many seconds
+SESSION_TIMEOUT = 30
+# client that has nothing to send, because its message stream is idle or it is still compressing file,
+# keeps its session alive every this many seconds
+KEEP_ALIVE_INTERVAL = SESSION_TIMEOUT / 3
+# reply of receiver of version 5 to initial fragment ends with crc32 of the whole reply, client whose initial
+# fragment or reply got lost or corrupted sends initial fragment again, at most this many times
+HANDSHAKE_ATTEMPTS = 3
+# server checks timers of sessions every SERVER_TICK seconds, that is finer than MIN_RTO
+SERVER_TICK = 0.01
+# metrics are written to their log every METRICS_INTERVAL seconds, progress line is redrawn every PROGRESS_INTERVAL
+METRICS_INTERVAL = 5.0
+PROGRESS_INTERVAL = 0.25
+# upper bounds of buckets of histograms of round trip time and batch latency in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+# sends and receives up to BATCH_SIZE datagrams with one system call where system supports it
+BULK_IO = True
+BATCH_SIZE = 32
+# number of files of directory that are sent at once over one connection
+PARALLEL_STREAMS = 16
+# in message-stream mode small messages are framed by their length and coalesced into datagrams of type 12,
+# that store number of messages in number of fragments and sequence number of datagram in index.
+# Receiver acknowledges them cumulatively by datagram of the same type, whose index is number of datagrams
+# delivered in order. Datagram that is not full is sent once its oldest message waited MESSAGE_FLUSH_DELAY seconds.
+MESSAGE_LENGTH = struct.Struct("!H")
+MESSAGE_FLUSH_DELAY = 0.005
+# checksums of version 5 fragments, client offers them as bits of its initial fragment and receiver picks
+# the strongest one both of them have, clients that offer nothing get crc16 of version 1
+CHECKSUMS = {'crc16': 0, 'crc32': 1, 'crc32c': 2}
+# compressions of data announced in flags of filename fragment, receiver offers them as bits of its handshake
+COMPRESSIONS = {'zlib': 1, 'lzma': 2, 'zstd': 3}
+COMPRESSION_MASK = 0x0f
+# data are compressed in chunks of this size, auto compression tries to compress the first one
+COMPRESSION_CHUNK = 1 << 16
+# auto compression skips data that do not shrink below this ratio of their size, they are already compressed
+COMPRESSION_RATIO = 0.9
+# parity fragments are added to groups of FEC_GROUP data fragments, every one of FEC_PARITY parity fragments
+# is xor of every FEC_PARITY-th fragment of group, so that each of them can rebuild one fragment of burst of losses
+FEC_GROUP = 16
+FEC_PARITY = 2
+# flag of filename fragment that announces parity fragments, its data start with size of group and number of parities
+FEC_FLAG = 0x80
+FEC_PARAMETERS = struct.Struct("!HB")
+# digests of whole message or file computed while it's sent and received, client announces digest in flags
+# of filename fragment and sends it in fragment of type 10 once all fragments were sent,
+# receiver answers with fragment of the same type that has DIGEST_MATCH in flags when digests are equal
+DIGESTS = {'blake2b': 1, 'sha256': 2}
+DIGEST_ALGORITHM = 'blake2b'
+DIGEST_MASK = 0x30
+DIGEST_SHIFT = 4
+DIGEST_MATCH = 1
+# client asks receiver which fragments of file of at least RESUME_SIZE bytes it already has from interrupted transfer
+# by flag of filename fragment, its data start with modification time of file, receiver confirms filename fragment
+# with ranges of missing fragments (index of first one and index behind the last one) and client sends only those
+RESUME_SIZE = 1 << 22
+RESUME_FLAG = 0x40
+RESUME_IDENTITY = struct.Struct("!Q")
+RANGE = struct.Struct("!II")
+# journal of partial file starts with size of file, fragment size, number of fragments and modification time
+# of file on client, that are followed by bitmap of fragments that were written
+JOURNAL_HEADER = struct.Struct("!QIIQ")
+# in delta mode client first sends signatures of blocks of file, that are as large as data of its fragments,
+# as stream whose filename fragment is of type 11 and has size of block and size of file in front of filename.
+# Receiver finds the blocks in file of the same name it already has, even those that moved, and copies them
+# into the new file. Filename fragment of file is then confirmed with ranges of missing fragments like that
+# of resumed transfer. Receiver offers delta mode by DELTA_FEATURE in features byte of its handshake,
+# only when numpy is installed, because blocks that moved are not found without it. Blocks are searched for
+# in thread of receiver, filename fragment of file that arrives meanwhile is answered by confirmation
+# with SEARCH_FLAG, that tells client to wait, and it's confirmed once the search is done.
+DELTA_PARAMETERS = struct.Struct("!IQ")
+DELTA_FEATURE = 0x01
+SEARCH_FLAG = 0x20
+# weak checksum (adler32, that can be rolled over file byte by byte) and the first 8 bytes of blake2b of block
+BLOCK_SIGNATURE = struct.Struct("!I8s")
+# file of receiver is searched for blocks that moved in chunks of this size
+DELTA_CHUNK = 1 << 20
+# size of table that offsets of file of receiver are filtered by before their weak checksums are looked up
+DELTA_TABLE = 1 << 22
+# in secure mode client and receiver share key (pre-shared key), client offers SECURE_SUITE behind checksums
+# in data of initial fragment together with its random nonce and receiver answers with SECURE_FEATURE
+# and its random nonce, both fragments are authenticated by MAC keyed with the shared key.
+# Keys of session are derived from the shared key and both nonces, every fragment is then encrypted
+# by ChaCha20-Poly1305 with its header as associated data and tag of AEAD takes place of checksum.
+SECURE_SUITE = 1
+SECURE_FEATURE = 0x02
+SECURE_NONCE = 16
+HANDSHAKE_MAC = 16
+AEAD_TAG = 16
+# nonce of fragment of client is made of its type, flags, 2 zero bytes, stream id and index, whose data
+# never change, so retransmitted fragment is the same fragment encrypted again, nonce of fragment of receiver
+# is made of 4 zero bytes and counter stored in offset of its header
+NONCE_PADDING = bytes(4)
+# shared key given as passphrase is stretched into key of this size
+PSK_ITERATIONS = 200000
+PSK_SIZE = 32
+# errors of writing or decompressing received data, that abort only the stream they belong to
+SINK_ERRORS = (OSError, zlib.error, lzma.LZMAError) + ((zstandard.ZstdError,) if zstandard is not None else ())
 
 # initial fragment is of type 1, has 0 bytes stored in data, has 0 index and total
 initial_fragment = (1).to_bytes(1, "big") + (0).to_bytes(2, "big") + (0).to_bytes(2, "big") + (0).to_bytes(2,"big")
@@ -29,15 +244,16 @@ default_client_menu = [
         },
         {
             'type': 'input',
-            'message': 'Enter maximum fragment size (1-1463, 0 for auto):',
+            'message': f'Enter maximum fragment size (1-{MAX_PAYLOAD}, 0 for auto):',
             'name': 'fragment_size',
-            'validate': lambda val: (check_if_integer(val) and 0 <= int(val) <= 1463) or "Please, enter number in range 1-1463"
+            'validate': lambda val: (check_if_integer(val) and 0 <= int(val) <= MAX_PAYLOAD) or
+                                    f"Please, enter number in range 1-{MAX_PAYLOAD}"
         },
         {
             'type': 'list',
-            'message': 'Do you want to send file or message?',
+            'message': 'Do you want to send file, directory or message?',
             'name': 'fm',
-            'choices': ['File', 'Message']
+            'choices': ['File', 'Directory', 'Message']
         },
         {
             'type': 'input',
@@ -46,12 +262,37 @@ default_client_menu = [
             'name': 'file_path',
             'validate': lambda val: os.path.isfile(val) or "File you've entered does not exist"
         },
+        {
+            'type': 'input',
+            'message': 'Enter directory path:',
+            'when': lambda answers: answers['fm'] == 'Directory',
+            'name': 'file_path',
+            'validate': lambda val: os.path.isdir(val) or "Directory you've entered does not exist"
+        },
         {
             'type': 'input',
             'message': 'Enter message:',
             'when': lambda answers: answers['fm'] == 'Message',
             'name': 'message',
         },
+        {
+            'type': 'list',
+            'message': 'Do you want data to be compressed?',
+            'name': 'compression',
+            'choices': ['Auto'] + [name for name in COMPRESSIONS if name != 'zstd' or zstandard is not None] + ['No']
+        },
+        {
+            'type': 'list',
+            'message': f'Do you want to add {FEC_PARITY} parity fragments to every {FEC_GROUP} fragments?',
+            'name': 'fec',
+            'choices': ['No', 'Yes']
+        },
+        {
+            'type': 'input',
+            'message': 'Enter rate limit in kB/s (0 for no limit):',
+            'name': 'rate_limit',
+            'validate': lambda val: (check_if_integer(val) and int(val) >= 0) or "Please, enter number 0 or greater"
+        },
         {
             'type': 'list',
             'message': 'Do you want some fragments to be corrupted?',
@@ -71,15 +312,16 @@ default_server_menu = {
 same_server_menu = [
         {
             'type': 'input',
-            'message': 'Enter maximum fragment size (1-1463, 0 for auto):',
+            'message': f'Enter maximum fragment size (1-{MAX_PAYLOAD}, 0 for auto):',
             'name': 'fragment_size',
-            'validate': lambda val: (check_if_integer(val) and 0 <= int(val) <= 1463) or "Please, enter number in range 1-1463"
+            'validate': lambda val: (check_if_integer(val) and 0 <= int(val) <= MAX_PAYLOAD) or
+                                    f"Please, enter number in range 1-{MAX_PAYLOAD}"
         },
         {
             'type': 'list',
-            'message': 'Do you want to send file or message?',
+            'message': 'Do you want to send file, directory or message?',
             'name': 'fm',
-            'choices': ['File', 'Message']
+            'choices': ['File', 'Directory', 'Message']
         },
         {
             'type': 'input',
@@ -88,11 +330,36 @@ same_server_menu = [
             'name': 'file_path',
             'validate': lambda val: os.path.isfile(val) or "File you've entered does not exist"
         },
+        {
+            'type': 'input',
+            'message': 'Enter directory path:',
+            'when': lambda answers: answers['fm'] == 'Directory',
+            'name': 'file_path',
+            'validate': lambda val: os.path.isdir(val) or "Directory you've entered does not exist"
+        },
         {
             'type': 'input',
             'message': 'Enter message:',
             'when': lambda answers: answers['fm'] == 'Message',
             'name': 'message',
+        },
+        {
+            'type': 'list',
+            'message': 'Do you want data to be compressed?',
+            'name': 'compression',
+            'choices': ['Auto'] + [name for name in COMPRESSIONS if name != 'zstd' or zstandard is not None] + ['No']
+        },
+        {
+            'type': 'list',
+            'message': f'Do you want to add {FEC_PARITY} parity fragments to every {FEC_GROUP} fragments?',
+            'name': 'fec',
+            'choices': ['No', 'Yes']
+        },
+        {
+            'type': 'input',
+            'message': 'Enter rate limit in kB/s (0 for no limit):',
+            'name': 'rate_limit',
+            'validate': lambda val: (check_if_integer(val) and int(val) >= 0) or "Please, enter number 0 or greater"
         }
 ]
 
@@ -110,6 +377,34 @@ server_end_menu = {
         'choices': ['Receive more data', 'Change to client', 'Quit']
 }
 
+def prompt(questions):
+    """
+    Asks questions of menu, PyInquirer is imported only for interactive menus,
+    so that command line and Sender and Receiver work without it
+
+    :param questions: question or list of questions of PyInquirer
+    :return: answers by names of questions
+    """
+    from PyInquirer import prompt as ask    # !! needs to be installed with pip for interactive menus !!
+    return ask(questions)
+
+
+def compression_of(answer):
+    """
+    :param answer: compression selected in menu
+    :return: 'auto', one of COMPRESSIONS or None if data should not be compressed
+    """
+    return {'Auto': 'auto', 'No': None}.get(answer, answer)
+
+
+def rate_limit_of(answer):
+    """
+    :param answer: rate limit in kB/s entered in menu
+    :return: rate limit in bytes per second or None if rate is not limited
+    """
+    return int(answer) * 1000 or None
+
+
 def check_if_integer(val):
     """
     Checks whether value is convertible to integer
@@ -123,435 +418,4851 @@ def check_if_integer(val):
         return False
     return True
 
-def parser(data):
+def parser(data, version=LEGACY_VERSION):
     """
     Parses data fragment into dictionary
     :param data: data to be parsed
+    :param version: protocol version of fragment
     :return: dictionary of information from data
     """
-    fragment = {'type': int.from_bytes(data[0:1], "big"), 'data_length': int.from_bytes(data[1:3], "big"),
-                'total_n': int.from_bytes(data[3:5], "big"), 'order': int.from_bytes(data[5:7], "big"),
-                'data': data[7:]}
-    return fragment
+    if version == LEGACY_VERSION:
+        typ, data_length, total_n, order = LEGACY_FRAGMENT_HEADER.unpack_from(data)
+        return {'type': typ, 'data_length': data_length, 'total_n': total_n, 'order': order,
+                'data': data[LEGACY_FRAGMENT_HEADER.size:]}
+    typ, flags, data_length, session, stream, total_n, order, offset = FRAGMENT_HEADER.unpack_from(data)
+    return {'type': typ, 'flags': flags, 'data_length': data_length, 'session': session, 'stream': stream,
+            'total_n': total_n, 'order': order, 'offset': offset, 'data': data[FRAGMENT_HEADER.size:]}
 
-def make_fragments(message, fragment_size):
+class Checksum:
     """
-    Makes fragments from byte message of certain size
-
-    :param message: message represented as bytearray
-    :param fragment_size: size of fragments to be made
-    :return: queue of created fragments
+    Checksum of fragment stored behind its data
     """
-    fragment_queue = queue.Queue()
-    start = 0
-    index = 0
 
-    # if maximum fragment size is not set, set maximum possible fragment size
-    if fragment_size == 0:
-        if len(message) >= 1463:
-            fragment_size = 1463
+    def __init__(self, flag):
+        """
+        :param flag: one of CHECKSUMS
+        """
+        self.flag = flag
+        if flag == CHECKSUMS['crc16']:
+            self.function, self.struct = libscrc.ibm, CRC
+        elif flag == CHECKSUMS['crc32']:
+            self.function, self.struct = zlib.crc32, CRC32
+        elif flag == CHECKSUMS['crc32c'] and crc32c is not None:
+            self.function, self.struct = crc32c.crc32c, CRC32
         else:
-            fragment_size = len(message)
+            raise ValueError(f"Unsupported checksum {flag}")
+        self.size = self.struct.size
 
-    n_of_fragments = int(math.ceil(float(len(message)) / float(fragment_size)))
+    # data of fragments are sent as they are
+    sealed = False
 
-    # if fragment size is larger than actual size of fragment, change it to size of fragment
-    if fragment_size > len(message):
-        fragment_size = len(message)
+    def compute(self, payload, header=b""):
+        """
+        :param payload: data of fragment
+        :param header: header of fragment, checksum continues from its checksum, so data are not copied behind it
+        :return: checksum of header and data
+        """
+        return self.function(payload, self.function(header))
 
-    end = fragment_size
+    def pack(self, payload, header=b""):
+        return self.struct.pack(self.compute(payload, header))
 
-    print(f"Fragments of maximum size of {fragment_size} are going to be sent.")
-    # slices message from start til end
-    while True:
+    def pack_into(self, buffer, payload, header=b""):
+        self.struct.pack_into(buffer, 0, self.compute(payload, header))
 
-        if start + fragment_size >= len(message):
-            end = len(message)
-            fragment = message[start:end]
-            # fragment is created with 2 as a type, set fragment size, number of fragments, index, data and generated crc
-            fragment = (2).to_bytes(1, "big") + (fragment_size).to_bytes(2, "big") + (n_of_fragments).to_bytes(2,
-                                                                                                                     "big") + (
-                           index).to_bytes(2, "big") + fragment
-            fragment += libscrc.ibm(fragment[7:]).to_bytes(2, "big")
-            fragment_queue.put(fragment)
-            break
-        else:
-            fragment = message[start:end]
-            # fragment is created with 2 as a type, set fragment size, number of fragments, index, data and generated crc
-            fragment = (2).to_bytes(1, "big") + (fragment_size).to_bytes(2, "big") + (n_of_fragments).to_bytes(2,
-                                                                                                                     "big") + (
-                           index).to_bytes(2, "big") + fragment
-            fragment += libscrc.ibm(fragment[7:]).to_bytes(2, "big")
-            index += 1
-            start += fragment_size
-            end += fragment_size
-            fragment_queue.put(fragment)
+    def check(self, view, payload, header=b""):
+        """
+        :param view: received fragment that ends with checksum
+        :param payload: data of fragment
+        :param header: header of fragment covered by checksum
+        :return: True if checksum stored in fragment matches its header and data
+        """
+        return self.struct.unpack_from(view, len(view) - self.size)[0] == self.compute(payload, header)
 
-    return fragment_queue
+    def seal_datagram(self, datagram):
+        """
+        :param datagram: packed header and data of filename fragment or reply of receiver
+        :return: datagram with checksum of both its header and data behind them, header holds what matters
+        """
+        return datagram + self.pack(datagram)
 
+    def open_datagram(self, view):
+        """
+        :param view: datagram sealed by seal_datagram
+        :return: header and data of datagram as bytes, None when datagram got corrupted on its way
+        """
+        datagram = view[:len(view) - self.size]
+        if len(datagram) < FRAGMENT_HEADER.size or not self.check(view, datagram) or \
+                FRAGMENT_HEADER.unpack_from(datagram)[2] != len(datagram) - FRAGMENT_HEADER.size:
+            return None
+        return bytes(datagram)
 
-def keep_alive(e, sock, ip, port):
+    def seal(self, header, payload):
+        """
+        :param header: packed header of fragment
+        :param payload: data of fragment
+        :return: fragment with checksum of header and data behind them
+        """
+        return header + payload + self.pack(payload, header)
+
+
+# checksum of version 1 fragments and of version 5 fragments when client does not offer any other
+CRC16 = Checksum(CHECKSUMS['crc16'])
+
+
+def supported_checksums():
     """
-    Sends keep alive messages til it's stopped
-    :param e: Event that is set when keep_alive needs to stop
-    :param sock: socket for sending keep alive messages
-    :param ip: ip address of receiver
-    :param port: port of receiver
+    :return: checksums available on this system as bits of their flags
     """
-    while not e.isSet():
-        is_set = e.wait(25)
-        if not is_set:
-            keep_alive_fragment = (4).to_bytes(1, "big") + (0).to_bytes(2, "big") + (0).to_bytes(2, "big") + (0).to_bytes(2,"big")
-            sock.sendto(keep_alive_fragment, (ip, port))
+    bits = 0
+    for name, flag in CHECKSUMS.items():
+        if name != 'crc32c' or crc32c is not None:
+            bits |= 1 << flag
+    return bits
 
 
-def display_end_menu(ip, port, sock):
+def psk_key(psk):
     """
-    Displays end menu after all fragments have been sent
-    :param ip: IP of former receiver
-    :param port: PORT of former receiver
-    :param sock: socket to be recycled if user continues to send data
+    Stretches pre-shared key given as passphrase, so that it can't be guessed from recorded handshake quickly
+
+    :param psk: pre-shared key as text or bytes
+    :return: key of PSK_SIZE bytes
     """
-    e = threading.Event()
-    thread = threading.Thread(target=keep_alive, daemon=True, args=(e, sock, ip, port))
-    thread.start()
+    if isinstance(psk, str):
+        psk = psk.encode()
+    return hashlib.pbkdf2_hmac('sha256', psk, b"udp-komunikator", PSK_ITERATIONS, PSK_SIZE)
 
-    answer = prompt(end_menu)['selection']
 
-    if answer == 'Send data to different server':
-        e.set()
-        start_client()
-    elif answer == 'Send data to the same server':
-        answers = prompt(same_server_menu)
-        message = open(answers['file_path'], "rb").read() if answers['fm'] == 'File' else bytearray(
-            answers['message'], "ascii")
-        message_type = 1 if answers['fm'] == 'Message' else 2
-        if message_type == 1:
-            file_path = 0
-        else:
-            file_path = answers['file_path']
-        e.set()
-        send(ip, int(answers['fragment_size']), port, message, file_path, sock)
-    elif answer == 'Change to server':
-        e.set()
-        start_server()
+def handshake_mac(key, data):
+    """
+    :param key: stretched pre-shared key
+    :param data: initial fragment or initial fragments of client and receiver
+    :return: MAC that proves the fragment was made by someone who has the key
+    """
+    return hashlib.blake2b(data, digest_size=HANDSHAKE_MAC, key=key, person=b"handshake").digest()
 
-def send(ip, fragment_size, port, message, path, sock_et=0):
+
+def session_keys(key, client_nonce, receiver_nonce, session_id):
     """
-    Sends message to chosen receiver
+    Derives keys of both directions of session, so that no two sessions encrypt with the same key
 
-    :param ip: IP address of receiver
-    :param fragment_size: maximum size of fragments to be sent
-    :param port: port of receiver
-    :param message: message to be sent (either file or text message, both being bytearrays)
-    :param path: path to file to be sent, it's 0 if message is just text message
-    :param sock_et: socket that is passed on if it was already created (in last iteration)
+    :param key: stretched pre-shared key
+    :param client_nonce: random nonce of initial fragment of client
+    :param receiver_nonce: random nonce of initial fragment of receiver
+    :param session_id: session id assigned by receiver
+    :return: key of fragments of client and key of fragments of receiver
     """
-    # create socket if it wasn't already created (e.g. in last iteration)
-    if sock_et == 0:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        # send fragment for initialization and wait for response for max. two seconds
-        sock.settimeout(2)
-        sock.sendto(initial_fragment, (ip, port))
+    keys = hashlib.blake2b(client_nonce + receiver_nonce + session_id.to_bytes(4, "big"), key=key,
+                           person=b"session keys").digest()
+    return keys[:32], keys[32:]
+
+
+class Aead:
+    """
+    ChaCha20-Poly1305 of secure session that is used in place of checksum. Data of fragment are encrypted
+    and authenticated together with its header, tag of AEAD is stored behind encrypted data.
+    Ciphers are made once per session with keys of both directions, nonce is never sent but taken from header.
+    """
+
+    size = AEAD_TAG
+    # data of fragments are encrypted
+    sealed = True
+
+    def __init__(self, send_key, receive_key, client=True):
+        """
+        :param send_key: key of fragments sent by this side
+        :param receive_key: key of fragments received from the other side
+        :param client: True on client, that derives nonce from fragment, False on receiver, that counts its fragments
+        """
+        self.sender = ChaCha20Poly1305(send_key)
+        self.receiver = ChaCha20Poly1305(receive_key)
+        self.client = client
+        # number of fragments sent by receiver
+        self.counter = 0
+        # buffer that received fragments are decrypted into, the largest probe fits into it
+        self.plain = memoryview(bytearray(PROBE_SIZES[0]))
+
+    @staticmethod
+    def client_nonce(header):
+        # nonce is sliced out of header (type, flags, stream id and index), that is faster than unpacking
+        # and packing its fields, fragment with the same fields always carries the same data
+        return header[:2] + NONCE_PADDING[:2] + header[8:12] + header[16:20]
+
+    @staticmethod
+    def receiver_nonce(header):
+        return NONCE_PADDING + header[20:28]
+
+    def seal_into(self, header, payload, buffer):
+        """
+        Encrypts data of fragment of client into buffer of the same fragment, no new object is created for data
+
+        :param header: packed header of fragment
+        :param payload: data of fragment
+        :param buffer: buffer at least AEAD_TAG bytes larger than data
+        :return: memoryview of encrypted data and tag in buffer
+        """
+        sealed = buffer[:len(payload) + AEAD_TAG]
+        self.sender.encrypt_into(self.client_nonce(header), payload, header, sealed)
+        return sealed
+
+    def seal(self, header, payload):
+        """
+        :param header: packed header of fragment, receiver stores its counter into offset of its own fragments
+        :param payload: data of fragment
+        :return: fragment with encrypted data and tag
+        """
+        if self.client:
+            header = bytes(header)
+            return header + self.sender.encrypt(self.client_nonce(header), bytes(payload), header)
+        self.counter += 1
+        header = bytes(header[:20]) + self.counter.to_bytes(8, "big")
+        return header + self.sender.encrypt(self.receiver_nonce(header), bytes(payload), header)
+
+    def open(self, view):
+        """
+        Decrypts fragment sent by the other side
+
+        :param view: received fragment
+        :return: memoryview of its data valid until the next call, None when fragment is not authentic
+        """
+        if not FRAGMENT_HEADER.size + AEAD_TAG <= len(view) <= FRAGMENT_HEADER.size + AEAD_TAG + len(self.plain):
+            return None
+        header = bytes(view[:FRAGMENT_HEADER.size])
+        nonce = self.receiver_nonce(header) if self.client else self.client_nonce(header)
+        plain = self.plain[:len(view) - FRAGMENT_HEADER.size - AEAD_TAG]
         try:
-            data, address = sock.recvfrom(2048)
-            if (int.from_bytes(data[0:1], "big") == 1):
-                print("Connection was initialized successfully.")
-        except:
-            # if connection was unsuccessful, start again
-            print("Error occurred while connecting to the server. Please try again.")
-            start_client()
-            return
-    else:
-        sock = sock_et
+            self.receiver.decrypt_into(nonce, view[FRAGMENT_HEADER.size:], header, plain)
+        except InvalidTag:
+            return None
+        return plain
 
-    fragments_queue = make_fragments(message, fragment_size)
+    def seal_datagram(self, datagram):
+        return self.seal(datagram[:FRAGMENT_HEADER.size], datagram[FRAGMENT_HEADER.size:])
 
-    if path != 0:
-        print(f"File {os.path.abspath(path)} is going to be transfered.")
+    def open_datagram(self, view):
+        """
+        :param view: received datagram
+        :return: header and decrypted data of datagram as bytes, None when datagram is not authentic
+        """
+        plain = self.open(view)
+        if plain is None or FRAGMENT_HEADER.unpack_from(view)[2] != len(plain):
+            return None
+        return bytes(view[:FRAGMENT_HEADER.size]) + bytes(plain)
 
-    print(f"{fragments_queue.qsize()} fragments are going to be sent.")
 
-    # filename fragment, if only a simple text message is being sent, it creates just header without data
-    if path == 0:
-        # data fragment with empty data is created - that means a message is being sent
-        fragment = (2).to_bytes(1, "big") + (0).to_bytes(2, "big") + (fragments_queue.qsize()).to_bytes(2, "big") + (0).to_bytes(2,
-                                                                                                                    "big")
-    else:
-        filename = os.path.basename(path)
-        # data fragment with filename in data is created
-        fragment = (2).to_bytes(1, "big") + (len(filename)).to_bytes(2, "big") + (fragments_queue.qsize()).to_bytes(2, "big") + (
-            0).to_bytes(2, "big") + bytes(filename, "ascii")
+def make_fragment(payload, fragment_size, n_of_fragments, index, version=PROTOCOL_VERSION, session=0, stream=0,
+                  checksum=CRC16):
+    """
+    Makes data fragment from piece of message
 
-    sock.sendto(fragment, (ip, port))
+    :param payload: piece of message stored in fragment
+    :param fragment_size: maximum size of fragments
+    :param n_of_fragments: number of fragments in transfer
+    :param index: index of fragment
+    :param version: protocol version of fragment
+    :param session: session id assigned by receiver
+    :param stream: stream id of message or file
+    :param checksum: checksum of version 5 fragment, version 1 always uses crc16
+    :return: created fragment
+    """
+    # fragment is created with 2 as a type, set fragment size, number of fragments, index, data and generated crc
+    if version == LEGACY_VERSION:
+        return LEGACY_FRAGMENT_HEADER.pack(DATA, fragment_size, n_of_fragments, index) + payload + CRC16.pack(payload)
+    # version 5 stores actual size of data and its offset in file instead of maximum fragment size,
+    # corrupted index or offset would write data to wrong place, so checksum covers header as well
+    return checksum.seal(FRAGMENT_HEADER.pack(DATA, 0, len(payload), session, stream, n_of_fragments, index,
+                                              index * fragment_size), payload)
 
-    # copies all fragments in case of unsuccessful delivery
-    all_fragments = list(fragments_queue.queue)
 
-    global ALTERED
-    global MISSING
-    failed_count = 0
-    batch_count = 0
-    # sends data fragments while queue is not empty
-    while not fragments_queue.empty():
-        count = 0
-        while count != 10 and not fragments_queue.empty():
-            fragment = fragments_queue.get()
-            # if some fragments need to be altered in case of testing of error detection
-            if ALTERED and count%2 == 0 :
-                fragment = bytearray(fragment)
-                failed_count += 1
-                try:
-                    fragment[7] = fragment[7]+1
-                except ValueError:
-                    fragment[7] = fragment[7]-1
-                fragment = bytes(fragment)
-                if failed_count > 10:
-                    ALTERED = False
-            # if MISSING is true, first fragment is not sent for error detection
-            if not MISSING:
-                sock.sendto(fragment, (ip, port))
-            else:
-                MISSING = False
-            count += 1
-        while True:
-            # waits for confirmation message - if all fragments arrived as they should, nothing much happens
-            # otherwise fragments that arrived corrupted are put into queue again
-            data, address = sock.recvfrom(1024)
-            if int.from_bytes(data[0:1], "big") == 5:
-                print(f"Batch {batch_count} delivered successfully.")
-                batch_count += 1
-                break
-            elif int.from_bytes(data[0:1], "big") == 3:
-                n_of_failed = int(int.from_bytes(data[3:5], "big"))
-                for i in range(n_of_failed):
-                    fragments_queue.put(all_fragments[int.from_bytes(data[7+i*2:7+i*2+2], "big")])
-                print(f"Batch {batch_count} delivered unsuccessfully.")
-                failed = ""
-                for i in range(n_of_failed):
-                    failed += str(int.from_bytes(data[7+i*2:7+i*2+2], "big")) + " "
-                print(f"Fragments [ {failed}] were unsuccessful in their delivery.")
-                batch_count += 1
-                break
+class PacketCodec:
+    """
+    Packs and parses version 5 fragments without creating new bytes objects for every fragment.
+    Header and checksum are packed into buffers that are reused for every fragment and sent together
+    with data by sendmsg, data are never copied into one fragment.
+    """
 
-    display_end_menu(ip, port, sock)
+    def __init__(self, fragment_size, session=0, stream=0, checksum=CRC16):
+        """
+        :param fragment_size: maximum size of data in fragment
+        :param session: session id assigned by receiver
+        :param stream: stream id of message or file
+        :param checksum: checksum agreed with receiver in handshake
+        """
+        self.session = session
+        self.stream = stream
+        self.checksum = checksum
+        self.header = bytearray(FRAGMENT_HEADER.size)
+        self.trailer = bytearray(checksum.size)
+        # buffer that data read from file are stored in
+        self.payload = memoryview(bytearray(fragment_size))
+        # data of secure session are encrypted into buffer of their own, that is sent in place of data and checksum
+        self.sealed = memoryview(bytearray(fragment_size + checksum.size)) if checksum.sealed else None
+        self.empty = self.trailer[:0]
 
+    def encode(self, typ, total_n, index, offset, payload, flags=0):
+        """
+        Packs header and checksum of fragment, returned buffers are valid until the next call
 
-def check_ip(IP):
+        :param typ: type of fragment
+        :param total_n: number of fragments in transfer
+        :param index: index of fragment
+        :param offset: offset of data in file
+        :param payload: memoryview of data
+        :param flags: flags of fragment
+        :return: list of buffers that make up the fragment
+        """
+        FRAGMENT_HEADER.pack_into(self.header, 0, typ, flags, len(payload), self.session, self.stream, total_n,
+                                  index, offset)
+        if self.sealed is not None:
+            return [self.header, self.checksum.seal_into(self.header, payload, self.sealed), self.empty]
+        self.checksum.pack_into(self.trailer, payload, self.header)
+        return [self.header, payload, self.trailer]
+
+    @staticmethod
+    def decode(view, checksum=CRC16):
+        """
+        Parses received fragment without copying it
+
+        :param view: memoryview of received datagram
+        :param checksum: checksum agreed with client in handshake or Aead of secure session
+        :return: tuple of type, flags, stream id, number of fragments, index, offset, memoryview of data
+                 and checksum check result, data of secure session are decrypted into buffer valid until the next call
+        """
+        typ, flags, data_length, _, stream, total_n, index, offset = FRAGMENT_HEADER.unpack_from(view)
+        if checksum.sealed:
+            payload = checksum.open(view)
+            if payload is None:
+                return typ, flags, stream, total_n, index, offset, view[:0], False
+            return typ, flags, stream, total_n, index, offset, payload, len(payload) == data_length
+        payload = view[FRAGMENT_HEADER.size:len(view) - checksum.size]
+        valid = len(payload) == data_length and checksum.check(view, payload, view[:FRAGMENT_HEADER.size])
+        return typ, flags, stream, total_n, index, offset, payload, valid
+
+
+class BufferPool:
     """
-    Checks if IP is valid or not
-    :param IP: IP to be checked
-    :return: Boolean
+    Preallocated buffers that datagrams are received into with recvfrom_into
     """
-    try:
-        socket.inet_aton(IP)
-    except:
-        return False
-    return True
 
+    def __init__(self, count, size=2048):
+        """
+        :param count: number of buffers
+        :param size: size of every buffer
+        """
+        self.size = size
+        self.buffers = [bytearray(size) for _ in range(count)]
 
-def start_client():
+    def get(self):
+        return self.buffers.pop() if self.buffers else bytearray(self.size)
+
+    def put(self, buffer):
+        self.buffers.append(buffer)
+
+
+class FragmentSource:
     """
-    Starts client, opens menu and calls send function with arguments entered by user in menu
+    Makes fragments of message or file lazily, only when they are sent or sent again.
+    File is read by offsets, so it is never loaded into memory as a whole.
+    Fragments are sent for the first time in order, so digest of data is computed while they are sent.
     """
 
-    answers = prompt(default_client_menu)
-    message = open(answers['file_path'], "rb").read() if answers['fm'] == 'File' else bytearray(answers['message'], "ascii")
+    def __init__(self, fragment_size, message=None, path=None, version=PROTOCOL_VERSION, session=0, stream=0,
+                 file=None, checksum=CRC16):
+        """
+        :param fragment_size: maximum size of fragments to be made, 0 for auto
+        :param message: message represented as bytearray, used when path is not set
+        :param path: path to file to be sent
+        :param version: protocol version of fragments
+        :param session: session id assigned by receiver
+        :param stream: stream id of message or file
+        :param file: file opened for binary reading that is sent instead of path, it's closed with source
+        :param checksum: checksum of version 5 fragments agreed with receiver
+        """
+        self.version = version
+        self.session = session
+        self.stream = stream
+        self.checksum = checksum
+        # hash object digest of data is computed by, None when no digest is sent, and number of fragments hashed
+        self.digest = None
+        self.hashed = 0
+        self.file = file if file is not None else open(path, "rb") if path else None
+        self.message = message
+        self.size = os.fstat(self.file.fileno()).st_size if self.file else len(message)
 
-    message_type = 1 if answers['fm'] == 'Message' else 2
-    if message_type == 1:
-        file_path = 0
-    else:
-        file_path = answers['file_path']
+        # if maximum fragment size is not set, set maximum possible fragment size (1463 for version 1)
+        if fragment_size == 0:
+            header = LEGACY_FRAGMENT_HEADER if version == LEGACY_VERSION else FRAGMENT_HEADER
+            fragment_size = MAX_DATAGRAM - header.size - checksum.size
 
-    global ALTERED
+        # if fragment size is larger than actual size of fragment, change it to size of fragment
+        self.fragment_size = min(fragment_size, self.size)
+        self.n_of_fragments = int(math.ceil(self.size / self.fragment_size)) if self.size else 0
+        self.view = memoryview(message) if message is not None else None
+        self.codec = PacketCodec(self.fragment_size, session, stream, checksum)
 
-    if answers['corr'] == 'Yes':
-        ALTERED = True
-    else:
-        ALTERED = False
+    def __len__(self):
+        return self.n_of_fragments
 
-    send(answers['ip'], int(answers['fragment_size']), int(answers['port']), message, file_path)
+    def payload_size(self, index):
+        """
+        :param index: index of fragment
+        :return: number of bytes of data in fragment, the last one can be shorter
+        """
+        return min(self.fragment_size, self.size - index * self.fragment_size)
 
+    def read(self, index):
+        """
+        Reads piece of message stored in fragment
 
-def start_server():
+        :param index: index of fragment
+        :return: bytes of message
+        """
+        start = index * self.fragment_size
+        if self.file:
+            data = os.pread(self.file.fileno(), self.fragment_size, start)
+        else:
+            data = bytes(self.message[start:start + self.fragment_size])
+        self.update_digest(index, data)
+        return data
+
+    def __getitem__(self, index):
+        return make_fragment(self.read(index), self.fragment_size, self.n_of_fragments, index, self.version,
+                             self.session, self.stream, self.checksum)
+
+    def update_digest(self, index, payload):
+        """
+        Hashes data of fragment when all fragments in front of it were already hashed
+        """
+        if self.digest is not None and index == self.hashed:
+            self.digest.update(payload)
+            self.hashed += 1
+
+    def finish_digest(self):
+        """
+        Hashes fragments that were not sent in order (those skipped for testing) and returns digest of data
+
+        :return: digest as bytes
+        """
+        while self.hashed < self.n_of_fragments:
+            self.read(self.hashed)
+        return self.digest.digest()
+
+    def buffers(self, index, codec=None, flags=0):
+        """
+        Makes version 5 fragment as list of buffers for sendmsg. Data of message are not copied,
+        data of file are read into buffer of codec. Buffers are valid until the next call.
+
+        :param index: index of fragment
+        :param codec: codec with buffers the fragment is packed into, data of message are copied
+                      into its buffer as well, so that they are always at the same address
+        :param flags: flags of fragment
+        :return: list of buffers that make up the fragment
+        """
+        start = index * self.fragment_size
+        if self.file:
+            codec = codec or self.codec
+            payload = codec.payload[:os.preadv(self.file.fileno(), [codec.payload[:self.fragment_size]], start)]
+        elif codec and codec.sealed is None:
+            payload = self.view[start:start + self.fragment_size]
+            codec.payload[:len(payload)] = payload
+            payload = codec.payload[:len(payload)]
+        else:
+            # data of secure session are encrypted into buffer of codec anyway
+            codec = codec or self.codec
+            payload = self.view[start:start + self.fragment_size]
+        self.update_digest(index, payload)
+        return codec.encode(DATA, self.n_of_fragments, index, start, payload, flags)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+def supported_compressions():
     """
-    Starts server, listens until connection is initialised and file or message is received
+    :return: compressions available on this system as bits of their flags
     """
-    ip_addr = "0.0.0.0"
+    bits = 0
+    for name, flag in COMPRESSIONS.items():
+        if name != 'zstd' or zstandard is not None:
+            bits |= 1 << flag
+    return bits
 
-    answers = prompt(default_server_menu)
-    port = int(answers['port'])
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.bind((ip_addr, port))
+def make_compressor(flag):
+    """
+    :param flag: flag of compression
+    :return: streaming compressor with compress and flush methods
+    """
+    if flag == COMPRESSIONS['zlib']:
+        return zlib.compressobj(6)
+    if flag == COMPRESSIONS['lzma']:
+        return lzma.LZMACompressor()
+    return zstandard.ZstdCompressor().compressobj()
 
-    # listens until connection is initialised by client
-    print(f"Listening on port {port}")
-    while True:
-        sock.settimeout(None)
-        while True:
-            # checks whether it is first iteration or not. If it is, it waits for initialisation
-            # otherwise it skips that part
-            try:
-                data
-            except:
-                data, address = sock.recvfrom(2048)
-                parsed_data = parser(data)
-                if parsed_data['type'] == 1:
-                    print("Connection initialized by client")
-                    sock.sendto(data, address)
-                data, address = sock.recvfrom(2048)
-
-            parsed_data = parser(data)
-            total_fragments = parsed_data['total_n']
-            print(f"{total_fragments} fragments are going to be received.")
-
-            # when data length of first fragment is 0, no filename was sent. That means that message is incoming.
-            if parsed_data['data_length'] == 0:
-                print("Message is to be received.")
-                typ = 1
-                break
-            else:
-                print("File is to be received")
-                typ = 2
-                filename = data[7:].decode("ascii")
-                break
 
-        # Starts to receive fragments until all are not received
-        counter = total_counter = 0
-        to_be_reviewed = []
-        reviewed = {}
-        failed = []
-        end_data = bytearray()
-        sock.settimeout(1)
+def make_decompressor(flag):
+    """
+    :param flag: flag of compression announced by client
+    :return: streaming decompressor with decompress method
+    """
+    if flag == COMPRESSIONS['zlib']:
+        return zlib.decompressobj()
+    if flag == COMPRESSIONS['lzma']:
+        return lzma.LZMADecompressor()
+    if flag == COMPRESSIONS['zstd'] and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unsupported compression {flag}")
 
-        while total_counter != total_fragments:
-            # when no fragment is received when it should, it sends info. to client about missing fragment/s
-            try:
-                data, address = sock.recvfrom(2048)
-            except:
-                print(f"Batch no. {int(total_counter / 2)} was corrupted.")
 
-                if total_counter - counter + 10 > total_fragments:
-                    for i in range(total_fragments-total_counter+counter):
-                        failed.append(total_counter-counter+i)
-                else:
-                    for i in range(10):
-                        failed.append(total_counter-counter+i)
+def choose_compression(connection, sample):
+    """
+    Picks compression for message or file, auto compression tries to compress its first chunk
+    and skips data that are already compressed
+
+    :param connection: connection with receiver
+    :param sample: first chunk of message or file
+    :return: flag of compression, 0 if data are sent as they are
+    """
+    usable = connection.compressions & supported_compressions()
+    if connection.compression is None or not sample:
+        return 0
+    if connection.compression != 'auto':
+        flag = COMPRESSIONS[connection.compression]
+        return flag if usable & (1 << flag) else 0
+    # fastest level of zlib is enough to find out that data do not shrink
+    if len(zlib.compress(sample, 1)) > len(sample) * COMPRESSION_RATIO:
+        return 0
+    for name in ('zstd', 'zlib'):
+        if usable & (1 << COMPRESSIONS[name]):
+            return COMPRESSIONS[name]
+    return 0
 
-                ack = (3).to_bytes(1, "big") + (len(failed) * 2).to_bytes(2, "big") + (len(failed)).to_bytes(2,
-                                                                                                             "big") + (
-                          0).to_bytes(2, "big")
 
-                for i in failed:
-                    ack += i.to_bytes(2, "big")
-                sock.sendto(ack, address)
-                failed = []
-                to_be_reviewed = []
-                total_counter -= counter
-                counter = 0
-                continue
+def xor_payloads(payloads, size):
+    """
+    Computes parity of payloads of fragments, shorter payloads are padded with zeros.
+    Whole payloads are xored at once, as arrays of NumPy or as python integers when NumPy is not installed.
 
-            counter += 1
-            total_counter += 1
-            fragment = data[:]
-            to_be_reviewed.append(fragment)
+    :param payloads: bytes-like payloads
+    :param size: size of parity, at least size of the largest payload
+    :return: parity as bytes
+    """
+    if numpy is not None:
+        parity = numpy.zeros(size, numpy.uint8)
+        for payload in payloads:
+            parity[:len(payload)] ^= numpy.frombuffer(payload, numpy.uint8)
+        return parity.tobytes()
+    parity = 0
+    for payload in payloads:
+        parity ^= int.from_bytes(payload, "little")
+    return parity.to_bytes(size, "little")
 
-            if total_counter == 1:
-                print(f"Maximum fragment size was set to {int.from_bytes(fragment[1:3], 'big')} by client.")
 
-            # when full batch or last batch is received, it is checked
-            if counter % 10 == 0 or total_counter == total_fragments:
+def compress_file(path, flag, digest=None):
+    """
+    Compresses file chunk by chunk into temporary file, so that fragments can be read from it by offsets
+    when they are sent again
 
-                for i in to_be_reviewed:
-                    if int.from_bytes(i[len(i) - 2:], "big") == libscrc.ibm(i[7:len(i) - 2]):
-                        reviewed[int.from_bytes(i[5:7], "big")] = i[7:len(i) - 2]
-                    else:
-                        total_counter -= 1
-                        failed.append(int.from_bytes(i[5:7], "big"))
-
-                if len(failed) == 0:
-                    print(f"Received batch no.{int(total_counter / 10)} without any error [fragments {total_counter - counter}-{total_counter}]")
-                    # positive ack fragment is created (type 5, size, index and total set to 0)
-                    ack = (5).to_bytes(1, "big") + (0).to_bytes(2, "big") + (0).to_bytes(2, "big") + (
-                        0).to_bytes(2, "big")
-                    sock.sendto(ack, address)
-                else:
-                    # when there are corrupted fragments, send their ids to client so they are sent again
-                    print(f"Batch no. {int(total_counter/10)} was corrupted.")
-                    # negative ack is created (type 3, size that includes indexes stored in data...)
-                    ack = (3).to_bytes(1, "big") + (len(failed) * 2).to_bytes(2, "big") + (len(failed)).to_bytes(2, "big") + (0).to_bytes(2,"big")
-                    corrupted = ""
-                    for i in failed:
-                        ack += i.to_bytes(2, "big")
-                        corrupted += str(i) + " "
-                    print(f"Fragments [ {corrupted}] where corrupted or missing.")
-                    sock.sendto(ack, address)
-                failed = []
-                to_be_reviewed = []
-                counter = 0
-
-        for i in range(len(reviewed)):
+    :param path: path to file
+    :param flag: flag of compression
+    :param digest: hash object that is updated with data of file, so that file is not read again to be hashed
+    :return: temporary file with compressed data, it's deleted when closed
+    """
+    compressor = make_compressor(flag)
+    spool = tempfile.TemporaryFile()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(COMPRESSION_CHUNK), b""):
+            if digest is not None:
+                digest.update(chunk)
+            spool.write(compressor.compress(chunk))
+    spool.write(compressor.flush())
+    spool.flush()
+    return spool
+
+
+class DatagramIO:
+    """
+    Sends and receives one datagram per system call
+    """
+
+    def __init__(self, sock, batch_size=BATCH_SIZE, buffer_size=2048):
+        """
+        :param sock: socket used for the transfer
+        :param batch_size: maximum number of datagrams handled by one call of receive
+        :param buffer_size: size of the largest datagram that can be received
+        """
+        self.sock = sock
+        self.batch_size = batch_size
+        pool = BufferPool(batch_size, buffer_size)
+        self.buffers = [pool.get() for _ in range(batch_size)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+
+    def send_fragments(self, fragments, indexes, address):
+        """
+        Sends data fragments
+
+        :param fragments: fragment source
+        :param indexes: indexes of fragments to be sent
+        :param address: address of receiver
+        """
+        for k, index in enumerate(indexes):
+            # receiver acknowledges the last fragment of burst right away
+            flags = ACK_NOW if k == len(indexes) - 1 else 0
+            self.sock.sendmsg(fragments.buffers(index, flags=flags), (), 0, address)
+
+    def receive(self):
+        """
+        Waits for datagrams as long as timeout of socket allows, raises socket.timeout otherwise
+
+        :return: list of tuples of memoryview of datagram and address of sender, valid until the next call
+        """
+        size, address = self.sock.recvfrom_into(self.buffers[0])
+        return [(self.views[0][:size], address)]
+
+
+# structures of sendmmsg and recvmmsg system calls
+class IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.c_void_p), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+class SockAddrIn(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_uint8 * 4), ("sin_zero", ctypes.c_uint8 * 8)]
+
+
+class MultiDatagramIO(DatagramIO):
+    """
+    Sends and receives up to batch_size datagrams with one system call (sendmmsg and recvmmsg on Linux).
+    Vectors of messages point to buffers that are allocated once, fragments are packed straight into them.
+    """
+
+    MSG_DONTWAIT = 0x40
+
+    libc = None
+
+    @classmethod
+    def available(cls, sock):
+        """
+        :param sock: socket used for the transfer
+        :return: True if sendmmsg and recvmmsg can be used with socket
+        """
+        if not sys.platform.startswith("linux") or sock.family != socket.AF_INET:
+            return False
+        if cls.libc is None:
             try:
-                end_data += reviewed[i]
-            except:
-                pass
+                libc = ctypes.CDLL(None, use_errno=True)
+                libc.sendmmsg, libc.recvmmsg
+            except (OSError, AttributeError):
+                return False
+            cls.libc = libc
+        return True
 
-        # print out message if it was a message, otherwise save file and print path
-        if typ == 1:
-            message = end_data.decode("ascii")
-            print(f"Message: {message}")
-        else:
-            file = open(filename, "wb")
-            file.write(end_data)
-            print(f"File path to the file: {os.path.dirname(os.path.realpath(__file__))}/{filename}")
-            file.close()
+    def __init__(self, sock, batch_size=BATCH_SIZE, buffer_size=2048):
+        super().__init__(sock, batch_size, buffer_size)
+        self.fd = sock.fileno()
 
-        # wait for keep alive messages or for new incoming file for up to 30 seconds
-        sock.settimeout(30)
-        try:
-            while True:
-                data, address = sock.recvfrom(1024)
-                if int.from_bytes(data[:1], 'little') == 4:
-                    print("Connection is kept alive by client.")
-                    sock.settimeout(30)
-                elif int.from_bytes(data[:1], 'little') == 2:
-                    break
+        # every received datagram has its own buffer and address
+        self.recv_names = (SockAddrIn * batch_size)()
+        self.recv_iov = (IoVec * batch_size)()
+        self.recv_msgs = (MMsgHdr * batch_size)()
+        for k in range(batch_size):
+            self.recv_iov[k].iov_base = ctypes.addressof(ctypes.c_char.from_buffer(self.buffers[k]))
+            self.recv_iov[k].iov_len = len(self.buffers[k])
+            header = self.recv_msgs[k].msg_hdr
+            header.msg_name = ctypes.addressof(self.recv_names[k])
+            header.msg_iov = ctypes.addressof(self.recv_iov[k])
+            header.msg_iovlen = 1
+        self.addresses = {}
 
-        except:
-            # when 30 seconds pass without any message show menu
-            print("Time has elapsed. Client has been disconnected.")
-            answer = prompt(server_end_menu)['selection']
-            if answer == 'Change to client':
-                start_client()
-                sock.close()
-                break
-            elif answer == 'Quit':
-                break
-            elif answer == 'Receive more data':
-                del data
+        # every sent fragment consists of header, data and checksum stored in buffers of its own codec
+        self.codecs = []
+        self.send_name = SockAddrIn()
+        self.send_address = None
+        self.send_iov = (IoVec * (3 * batch_size))()
+        self.send_msgs = (MMsgHdr * batch_size)()
+
+    def prepare_codecs(self, fragment_size, checksum=CRC16):
+        """
+        Allocates buffers for fragments of given size and points vectors of sent messages to them
+
+        :param fragment_size: maximum size of data in fragment
+        :param checksum: checksum of fragments, it decides size of their last buffer
+        """
+        self.codecs = [PacketCodec(fragment_size, checksum=checksum) for _ in range(self.batch_size)]
+        for k, codec in enumerate(self.codecs):
+            # encrypted data of secure session are sent with their tag, so no checksum is sent behind them
+            buffers = (codec.header, codec.payload if codec.sealed is None else codec.sealed, codec.trailer)
+            for i, buffer in enumerate(buffers):
+                self.send_iov[3 * k + i].iov_base = ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+                self.send_iov[3 * k + i].iov_len = len(buffer) if i < 2 or codec.sealed is None else 0
+            header = self.send_msgs[k].msg_hdr
+            header.msg_name = ctypes.addressof(self.send_name)
+            header.msg_namelen = ctypes.sizeof(self.send_name)
+            header.msg_iov = ctypes.addressof(self.send_iov) + 3 * k * ctypes.sizeof(IoVec)
+            header.msg_iovlen = 3
+
+    def send_fragments(self, fragments, indexes, address):
+        if not self.codecs or len(self.codecs[0].payload) < fragments.fragment_size or \
+                self.codecs[0].checksum is not fragments.checksum:
+            # fragments of small files are smaller, buffers are not allocated again for every one of them
+            self.prepare_codecs(max(fragments.fragment_size, MAX_DATAGRAM), fragments.checksum)
+        for codec in self.codecs:
+            codec.session = fragments.session
+            codec.stream = fragments.stream
+        if address != self.send_address:
+            self.send_name.sin_family = socket.AF_INET
+            self.send_name.sin_port = socket.htons(address[1])
+            self.send_name.sin_addr[:] = socket.inet_aton(socket.gethostbyname(address[0]))
+            self.send_address = address
+
+        for start in range(0, len(indexes), self.batch_size):
+            count = 0
+            for index in indexes[start:start + self.batch_size]:
+                # receiver acknowledges the last fragment of burst right away
+                flags = ACK_NOW if start + count == len(indexes) - 1 else 0
+                payload = fragments.buffers(index, self.codecs[count], flags)[1]
+                self.send_iov[3 * count + 1].iov_len = len(payload)
+                count += 1
+            self.send_messages(count)
+
+    def send_messages(self, count):
+        """
+        Sends first count prepared messages, waits when buffer of socket is full
+
+        :param count: number of messages
+        """
+        sent = 0
+        size = ctypes.sizeof(MMsgHdr)
+        while sent < count:
+            n = self.libc.sendmmsg(self.fd, ctypes.c_void_p(ctypes.addressof(self.send_msgs) + sent * size),
+                                   count - sent, 0)
+            if n < 0:
+                error = ctypes.get_errno()
+                if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    select.select([], [self.fd], [], 1)
+                elif error != errno.EINTR:
+                    raise OSError(error, os.strerror(error))
                 continue
+            sent += n
 
+    def receive(self):
+        # first datagram is awaited by socket itself, so that its timeout applies, the rest is read without waiting
+        received = super().receive()
+        if self.batch_size == 1:
+            return received
+        size = ctypes.sizeof(MMsgHdr)
+        for k in range(1, self.batch_size):
+            self.recv_msgs[k].msg_hdr.msg_namelen = ctypes.sizeof(SockAddrIn)
+        n = self.libc.recvmmsg(self.fd, ctypes.c_void_p(ctypes.addressof(self.recv_msgs) + size),
+                               self.batch_size - 1, self.MSG_DONTWAIT, None)
+        for k in range(1, n + 1):
+            name = self.recv_names[k]
+            key = (name.sin_port, bytes(name.sin_addr))
+            address = self.addresses.get(key)
+            if address is None:
+                address = self.addresses[key] = (socket.inet_ntoa(key[1]), socket.ntohs(name.sin_port))
+            received.append((self.views[k][:self.recv_msgs[k].msg_len], address))
+        return received
 
-def main():
+
+def datagram_io(sock, batch_size=BATCH_SIZE, buffer_size=2048):
     """
-    Starts the whole application, let's user choose between client and server.
+    Picks the fastest way of sending and receiving datagrams available for socket
+
+    :param sock: socket used for the transfer
+    :param batch_size: maximum number of datagrams sent or received by one system call
+    :param buffer_size: size of the largest datagram that can be received
+    :return: MultiDatagramIO if BULK_IO is set and system supports it, DatagramIO otherwise
     """
-    client_or_server = {
-        'type': 'list',
-        'message': 'Select if you want to act as client or server',
-        'name': 'cs',
-        'choices': ['Client', 'Server']
-    }
+    if BULK_IO and MultiDatagramIO.available(sock):
+        return MultiDatagramIO(sock, batch_size, buffer_size)
+    return DatagramIO(sock, batch_size, buffer_size)
 
-    answer = prompt(client_or_server)['cs']
-    if answer == 'Client':
-        start_client()
-    else:
-        start_server()
+
+def keep_alive(e, sock, ip, port):
+    """
+    Sends keep alive messages til it's stopped
+    :param e: Event that is set when keep_alive needs to stop
+    :param sock: socket for sending keep alive messages
+    :param ip: ip address of receiver
+    :param port: port of receiver
+    """
+    while not e.isSet():
+        is_set = e.wait(25)
+        if not is_set:
+            keep_alive_fragment = (4).to_bytes(1, "big") + (0).to_bytes(2, "big") + (0).to_bytes(2, "big") + (0).to_bytes(2,"big")
+            sock.sendto(keep_alive_fragment, (ip, port))
+
+
+class Histogram:
+    """
+    Counts observed values in buckets of fixed upper bounds, like histogram of Prometheus
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: sorted upper bounds of buckets, values above the last one are counted in bucket of their own
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        :return: list of tuples of upper bound of bucket and number of values that are not greater
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """
+        :param q: quantile between 0 and 1
+        :return: upper bound of bucket that holds the quantile, None when nothing was observed
+        """
+        if self.count == 0:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+
+
+class Metrics:
+    """
+    Counters and histograms of all transfers of process. Counters are plain attributes incremented once
+    per burst or per batch of received datagrams, so that they cost next to nothing.
+    Worker processes of receiver publish their metrics into array shared by them, that is added up on export.
+    """
+
+    # names of counters and their descriptions
+    COUNTERS = (("packets_sent", "Datagrams with data or parity fragments sent"),
+                ("bytes_sent", "Bytes of datagrams with data or parity fragments sent"),
+                ("packets_received", "Datagrams received by server"),
+                ("bytes_received", "Bytes of datagrams received by server"),
+                ("retransmits", "Data fragments sent again"),
+                ("crc_failures", "Fragments received with checksum that does not match"),
+                ("fragments_rebuilt", "Lost or corrupted fragments rebuilt from parity fragments"),
+                ("keep_alives_received", "Keep alive fragments received by server"),
+                ("nacks_sent", "Negative acks sent by server"),
+                ("nacks_received", "Negative acks received by client"),
+                ("transfers_completed", "Messages and files received completely"),
+                ("transfers_failed", "Messages and files whose transfer was not completed"),
+                ("messages_sent", "Messages of message streams sent by client"),
+                ("messages_received", "Messages of message streams delivered by server"))
+
+    def __init__(self):
+        self.reset()
+        # values of all worker processes by rows, one row of values per worker, None when process works alone
+        self.shared = None
+        self.worker = 0
+
+    def reset(self):
+        for name, _ in self.COUNTERS:
+            setattr(self, name, 0)
+        self.rtt = Histogram()
+        self.batch_latency = Histogram()
+        # bytes per second of the last transfer delivered by client
+        self.goodput = 0.0
+        self.started = time.monotonic()
+
+    def values(self):
+        """
+        :return: list of counters and buckets, counts and sums of histograms, that worker publishes
+        """
+        values = [getattr(self, name) for name, _ in self.COUNTERS]
+        for histogram in (self.rtt, self.batch_latency):
+            values += histogram.counts + [histogram.count, histogram.sum]
+        return values
+
+    def add(self, values):
+        """
+        :param values: values published by another worker, they are added to these metrics
+        """
+        for i, (name, _) in enumerate(self.COUNTERS):
+            setattr(self, name, getattr(self, name) + int(values[i]))
+        position = len(self.COUNTERS)
+        for histogram in (self.rtt, self.batch_latency):
+            for i in range(len(histogram.counts)):
+                histogram.counts[i] += int(values[position + i])
+            position += len(histogram.counts)
+            histogram.count += int(values[position])
+            histogram.sum += values[position + 1]
+            position += 2
+
+    def size(self):
+        """
+        :return: number of values of one worker in shared array
+        """
+        return len(self.values())
+
+    def share(self, shared, worker):
+        """
+        :param shared: multiprocessing array of size() values for every worker
+        :param worker: index of this worker
+        """
+        self.shared = shared
+        self.worker = worker
+
+    def publish(self):
+        """
+        Stores values of this worker into its row of shared array
+        """
+        if self.shared is not None:
+            size = self.size()
+            self.shared[self.worker * size:(self.worker + 1) * size] = self.values()
+
+    def rows(self):
+        """
+        :return: values published by other workers
+        """
+        size = self.size()
+        shared = self.shared[:]
+        return [shared[worker * size:(worker + 1) * size] for worker in range(len(shared) // size)
+                if worker != self.worker]
+
+    def combined(self):
+        """
+        :return: metrics of this process added up with metrics published by other workers
+        """
+        if self.shared is None:
+            return self
+        total = Metrics()
+        total.started = self.started
+        total.goodput = self.goodput
+        total.add(self.values())
+        for row in self.rows():
+            total.add(row)
+        return total
+
+    def unshare(self):
+        """
+        Adds the last values published by other workers to metrics of this process once workers stopped
+        """
+        for row in self.rows():
+            self.add(row)
+        self.shared = None
+        self.worker = 0
+
+    def snapshot(self):
+        """
+        :return: dictionary of current values, that can be serialized to JSON
+        """
+        result = {"time": time.time(), "uptime": time.monotonic() - self.started}
+        for name, _ in self.COUNTERS:
+            result[name] = getattr(self, name)
+        result["goodput_bytes_per_second"] = self.goodput
+        for name, histogram in (("rtt_seconds", self.rtt), ("batch_latency_seconds", self.batch_latency)):
+            result[name] = {"count": histogram.count, "sum": histogram.sum,
+                            "p50": histogram.quantile(0.5), "p99": histogram.quantile(0.99)}
+        return result
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        """
+        :return: metrics in text exposition format of Prometheus
+        """
+        lines = []
+        for name, text in self.COUNTERS:
+            lines += [f"# HELP komunikator_{name}_total {text}", f"# TYPE komunikator_{name}_total counter",
+                      f"komunikator_{name}_total {getattr(self, name)}"]
+        lines += ["# HELP komunikator_goodput_bytes_per_second Goodput of the last transfer delivered by client",
+                  "# TYPE komunikator_goodput_bytes_per_second gauge",
+                  f"komunikator_goodput_bytes_per_second {self.goodput}"]
+        for name, text, histogram in (("rtt_seconds", "Round trip time", self.rtt),
+                                      ("batch_latency_seconds", "Time from batch of fragments being sent to its ack",
+                                       self.batch_latency)):
+            lines += [f"# HELP komunikator_{name} {text}", f"# TYPE komunikator_{name} histogram"]
+            for bound, total in histogram.cumulative():
+                lines.append(f'komunikator_{name}_bucket{{le="{"+Inf" if bound == math.inf else bound}"}} {total}')
+            lines += [f"komunikator_{name}_sum {histogram.sum}", f"komunikator_{name}_count {histogram.count}"]
+        return "\n".join(lines) + "\n"
+
+
+# metrics of this process, they are exported by MetricsLog and MetricsEndpoint
+METRICS = Metrics()
+
+
+class MetricsLog:
+    """
+    Appends metrics to file as JSON line every interval seconds in thread of its own
+    """
+
+    def __init__(self, path, interval=METRICS_INTERVAL):
+        """
+        :param path: path to file, '-' for standard output
+        :param interval: seconds between two lines
+        """
+        self.file = sys.stdout if path == "-" else open(path, "a")
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        self.file.write(METRICS.combined().to_json() + "\n")
+        self.file.flush()
+
+    def close(self):
+        # the last line holds metrics of the whole run
+        self.stopped.set()
+        self.thread.join()
+        self.write()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.combined().to_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are not logged among transfers
+        pass
+
+
+class MetricsEndpoint:
+    """
+    HTTP endpoint /metrics with metrics in text format of Prometheus, served by thread of its own
+    """
+
+    def __init__(self, port, host="0.0.0.0"):
+        """
+        :param port: port of endpoint
+        :param host: address of interface endpoint listens on
+        """
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        self.address = self.server.server_address
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Progress:
+    """
+    Line with delivered data, rate and number of fragments sent again, that is redrawn while data are sent.
+    It's shown only when output is terminal, so that logs and redirected output are not filled with it.
+    """
+
+    def __init__(self, total=None):
+        """
+        :param total: number of bytes that are going to be delivered, None when it's not known
+        """
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        self.drawn = None
+        self.enabled = sys.stdout.isatty()
+
+    def add(self, size):
+        """
+        :param size: number of bytes that were delivered
+        """
+        self.done += size
+        if self.enabled:
+            now = time.monotonic()
+            if self.drawn is None or now - self.drawn >= PROGRESS_INTERVAL:
+                self.draw(now)
+
+    def message(self, text):
+        """
+        Prints line of text above progress line
+        """
+        if self.drawn is not None:
+            sys.stdout.write("\r\x1b[K")
+            self.drawn = None
+        print(text)
+
+    def draw(self, now):
+        self.drawn = now
+        rate = self.done / max(now - self.started, 1e-9)
+        text = f"{self.done / 1e6:.1f} MB"
+        if self.total:
+            text += f" of {self.total / 1e6:.1f} MB ({100 * self.done / self.total:.0f} %)"
+        sys.stdout.write(f"\r{text}, {rate / 1e6:.2f} MB/s, {METRICS.retransmits} fragments sent again  ")
+        sys.stdout.flush()
+
+    def close(self, delivered=True):
+        """
+        Draws the final line, goodput of transfer is recorded if it was delivered
+
+        :param delivered: whether all data were delivered
+        """
+        now = time.monotonic()
+        if self.drawn is not None:
+            self.draw(now)
+            sys.stdout.write("\n")
+        if delivered:
+            METRICS.goodput = self.done / max(now - self.started, 1e-9)
+
+
+def batch_number(count):
+    """
+    :param count: number of batches of version 1 acknowledged before the batch
+    :return: number of batch stored in total of its ack, it's never 0, that is stored by receivers that don't number batches
+    """
+    return count % 65535 + 1
+
+
+class RttEstimator:
+    """
+    Estimates round trip time of path and retransmission timeout from smoothed round trip time and its variance
+    (RFC 6298). Owners of timers count how many times their timer expired in a row and back it off,
+    so that one estimator is shared by all streams of connection.
+    """
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+
+    def on_rtt(self, sample):
+        """
+        :param sample: round trip time in seconds measured on datagram that was sent just once
+        """
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar += (abs(self.srtt - sample) - self.rttvar) / 4
+            self.srtt += (sample - self.srtt) / 8
+        METRICS.rtt.observe(sample)
+        self.rto = min(max(self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar), MIN_RTO), MAX_RTO)
+
+    def timeout(self, backoff=0):
+        """
+        :param backoff: number of times timer expired in a row
+        :return: seconds until timer expires
+        """
+        return min(self.rto * 2 ** min(backoff, 16), MAX_RTO)
+
+
+class Connection:
+    """
+    Connection of client with receiver. Receiver assigns session id to every connection of version 5,
+    so that fragments of clients it serves at the same time are not mixed together.
+    """
+
+    def __init__(self, sock, address, version=LEGACY_VERSION, session=0):
+        """
+        :param sock: socket used for the transfer
+        :param address: address of receiver
+        :param version: protocol version agreed with receiver
+        :param session: session id assigned by receiver, 0 for version 1
+        """
+        self.sock = sock
+        self.address = address
+        self.version = version
+        self.session = session
+        # size of the largest datagram found by path MTU discovery, None until path is probed
+        self.datagram_size = None
+        # compressions receiver can decompress as bits of their flags
+        self.compressions = 0
+        # features receiver supports as bits, like DELTA_FEATURE
+        self.features = 0
+        # files are sent in delta mode when receiver supports it
+        self.delta = False
+        # compression chosen by user, 'auto' or one of COMPRESSIONS, None to send data as they are
+        self.compression = None
+        # size of group of data fragments and number of its parity fragments, None to send no parity fragments
+        self.fec = None
+        # checksum of fragments picked by receiver in handshake, Aead of secure session
+        self.checksum = CRC16
+        # digest of every message or file that receiver compares with its own, one of DIGESTS or None
+        self.digest = DIGEST_ALGORITHM
+        # congestion controller of every transfer, one of CONGESTION_CONTROLLERS
+        self.congestion = 'aimd'
+        # datagrams are paced at rate of congestion controller, transfer never exceeds rate limit in bytes per second
+        self.pacing = True
+        self.rate_limit = None
+        # round trip time measured on handshake and on acks of all transfers
+        self.rtt = RttEstimator()
+        # every message or file is sent as stream with id of its own
+        self.last_stream = 0
+        # number of fragments corrupted for testing of error detection
+        self.failed_count = 0
+
+    def next_stream(self):
+        """
+        :return: stream id for next message or file
+        """
+        self.last_stream += 1
+        return self.last_stream
+
+
+def make_handshake(version=PROTOCOL_VERSION, checksums=None, key=None, nonce=None):
+    """
+    Creates initial fragment that offers protocol version and checksums in its data.
+    Old receivers echo the fragment back, so the agreed version is read from index of reply
+    and session id from its data.
+
+    :param version: offered protocol version
+    :param checksums: offered checksums as bits of their flags, all supported checksums if not set
+    :param key: stretched pre-shared key to offer secure session with, None for plain session
+    :param nonce: random nonce of client, needed with key
+    :return: initial fragment
+    """
+    checksums = supported_checksums() if checksums is None else checksums
+    # initial fragment keeps header of version 1, so that every receiver understands it
+    if key is None:
+        return LEGACY_FRAGMENT_HEADER.pack(INIT, 2, 0, 0) + bytes([version, checksums])
+    fragment = LEGACY_FRAGMENT_HEADER.pack(INIT, 3 + SECURE_NONCE + HANDSHAKE_MAC, 0, 0) + \
+        bytes([version, checksums, SECURE_SUITE]) + nonce
+    return fragment + handshake_mac(key, fragment)
+
+
+def secure_offer(data, key):
+    """
+    :param data: initial fragment sent by client
+    :param key: stretched pre-shared key of receiver
+    :return: nonce of client that offers secure session and proves it has the key, None otherwise
+    """
+    end = LEGACY_FRAGMENT_HEADER.size + 3 + SECURE_NONCE
+    if len(data) < end + HANDSHAKE_MAC or data[LEGACY_FRAGMENT_HEADER.size + 2] != SECURE_SUITE:
+        return None
+    if not hmac.compare_digest(handshake_mac(key, data[:end]), data[end:end + HANDSHAKE_MAC]):
+        return None
+    return data[end - SECURE_NONCE:end]
+
+
+def negotiate_version(data):
+    """
+    Picks protocol version for initial fragment received from client
+
+    :param data: initial fragment sent by client
+    :return: version both sides understand
+    """
+    parsed_data = parser(data)
+    # version 1 clients send initial fragment without data
+    if parsed_data['data_length'] >= 1 and int.from_bytes(parsed_data['data'][:1], "big") == PROTOCOL_VERSION:
+        return PROTOCOL_VERSION
+    return LEGACY_VERSION
+
+
+def negotiate_checksum(data):
+    """
+    Picks the strongest checksum offered in initial fragment that is supported by receiver as well
+
+    :param data: initial fragment sent by client of version 5
+    :return: Checksum of fragments
+    """
+    parsed_data = parser(data)
+    # clients that offer no checksum use crc16
+    offered = parsed_data['data'][1] if parsed_data['data_length'] >= 2 else 0
+    usable = offered & supported_checksums()
+    for name in ('crc32c', 'crc32'):
+        if usable & (1 << CHECKSUMS[name]):
+            return Checksum(CHECKSUMS[name])
+    return CRC16
+
+
+def accept_handshake(sock, address, data):
+    """
+    Reads reply of receiver of version 5 to initial fragment
+
+    :param sock: socket used for the transfer
+    :param address: address of receiver
+    :param data: reply of receiver
+    :return: Connection, None if initial fragment or reply got corrupted on its way
+    """
+    if len(data) < LEGACY_FRAGMENT_HEADER.size + CRC32.size or \
+            CRC32.unpack_from(data, len(data) - CRC32.size)[0] != zlib.crc32(data[:len(data) - CRC32.size]):
+        return None
+    parsed_data = parser(data[:len(data) - CRC32.size])
+    if parsed_data['type'] != INIT or parsed_data['order'] != PROTOCOL_VERSION or parsed_data['data_length'] < 4:
+        return None
+    connection = Connection(sock, address, PROTOCOL_VERSION, int.from_bytes(parsed_data['data'][:4], "big"))
+    # receiver sends session id followed by compressions it supports, checksum it picked and its features
+    if parsed_data['data_length'] >= 5:
+        connection.compressions = parsed_data['data'][4]
+    if parsed_data['data_length'] >= 6:
+        try:
+            connection.checksum = Checksum(parsed_data['data'][5])
+        except ValueError:
+            # receiver picks only checksum that client offered, unless offer got corrupted
+            return None
+    if parsed_data['data_length'] >= 7:
+        connection.features = parsed_data['data'][6]
+    return connection
+
+
+def handshake(sock, address, version=PROTOCOL_VERSION, checksums=None, key=None):
+    """
+    Initializes connection with receiver
+
+    :param sock: socket used for the transfer
+    :param address: address of receiver
+    :param version: offered protocol version
+    :param checksums: offered checksums as bits of their flags, all supported checksums if not set
+    :param key: stretched pre-shared key, secure session is required when it's set
+    :return: Connection or None if receiver did not respond to any initial fragment or all its replies got corrupted
+    :raise ConnectionError: when receiver does not prove it has the same key
+    """
+    # send fragment for initialization and wait for response for max. two seconds every time
+    sock.settimeout(2)
+    for _ in range(HANDSHAKE_ATTEMPTS):
+        # initial fragment sent again has new nonce, receiver drops the same secure offer sent twice
+        nonce = os.urandom(SECURE_NONCE) if key is not None else None
+        initial = make_handshake(version, checksums, key, nonce)
+        started = time.monotonic()
+        sock.sendto(initial, address)
+        try:
+            data, address = sock.recvfrom(2048)
+        except socket.timeout:
+            continue
+        # version 1 receivers just echo the initial fragment
+        connection = Connection(sock, address) if data == initial else accept_handshake(sock, address, data)
+        if connection is not None:
+            break
+    else:
+        return None
+    if key is not None:
+        # plain session is never accepted in place of secure one
+        end = LEGACY_FRAGMENT_HEADER.size + 7 + SECURE_NONCE
+        if connection.version == LEGACY_VERSION or not connection.features & SECURE_FEATURE or \
+                len(data) < end + HANDSHAKE_MAC or \
+                not hmac.compare_digest(handshake_mac(key, initial + data[:end]), data[end:end + HANDSHAKE_MAC]):
+            raise ConnectionError(f"Receiver {address[0]}:{address[1]} did not authenticate secure session.")
+        client_key, receiver_key = session_keys(key, nonce, data[end - SECURE_NONCE:end], connection.session)
+        connection.checksum = Aead(client_key, receiver_key)
+    # the first retransmission timeout is derived from handshake
+    connection.rtt.on_rtt(time.monotonic() - started)
+    return connection
+
+
+def route_mtu(address):
+    """
+    Asks system for MTU of route to receiver, that is the upper bound of path MTU
+
+    :param address: address of receiver
+    :return: MTU in bytes
+    """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect(address)
+        return probe.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return MAX_DATAGRAM + 28
+    finally:
+        probe.close()
+
+
+def discover_datagram_size(sock, address):
+    """
+    Finds the largest datagram that gets to receiver without being fragmented (path MTU discovery).
+    Probes with don't fragment bit set are sent from the largest and receiver confirms the first one that arrives.
+
+    :param sock: socket used for the transfer, connection has to be already initialized
+    :param address: address of receiver
+    :return: size of the largest datagram, MAX_DATAGRAM when system does not support probing
+    """
+    if not sys.platform.startswith("linux"):
+        return MAX_DATAGRAM
+    # datagrams are never larger than jumbo frames, large datagrams would overflow buffers of sockets
+    upper = min(route_mtu(address) - 28, PROBE_SIZES[0])
+    sizes = sorted({size for size in PROBE_SIZES + (upper,) if size <= upper}, reverse=True)
+
+    sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+    try:
+        for size in sizes:
+            # probe of type 8 is padded with zeros up to its size, that is stored in its offset
+            probe = FRAGMENT_HEADER.pack(PROBE, 0, size - FRAGMENT_HEADER.size, 0, 0, 0, 0, size)
+            probe += bytes(size - FRAGMENT_HEADER.size)
+            for attempt in range(2):
+                try:
+                    sock.sendto(probe, address)
+                except OSError:
+                    # datagram is larger than MTU of interface
+                    break
+                deadline = time.monotonic() + PROBE_TIMEOUT
+                while time.monotonic() < deadline:
+                    sock.settimeout(max(deadline - time.monotonic(), 0.001))
+                    try:
+                        data, _ = sock.recvfrom(2048)
+                    except socket.timeout:
+                        break
+                    # confirmations of smaller probes that were sent earlier are ignored
+                    if len(data) >= FRAGMENT_HEADER.size and data[0] == PROBE and \
+                            FRAGMENT_HEADER.unpack_from(data)[7] == size:
+                        return size
+    finally:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_WANT)
+    return MAX_DATAGRAM
+
+
+def alter_fragment(fragment, header_size=LEGACY_FRAGMENT_HEADER.size):
+    """
+    Corrupts first byte of data in fragment, so that it fails crc check on receiving end
+
+    :param fragment: fragment to be corrupted
+    :param header_size: size of header in front of data
+    :return: corrupted copy of fragment
+    """
+    fragment = bytearray(fragment)
+    try:
+        fragment[header_size] = fragment[header_size]+1
+    except ValueError:
+        fragment[header_size] = fragment[header_size]-1
+    return bytes(fragment)
+
+
+def send_batches(connection, fragments):
+    """
+    Sends fragments in batches of 10 and waits for acknowledgement of every batch (protocol version 1)
+
+    :param connection: connection with receiver
+    :param fragments: fragment source, fragments are made again in case of unsuccessful delivery
+    :return: True if all batches were delivered
+    """
+    sock, address = connection.sock, connection.address
+    # queue of indexes of fragments that need to be sent
+    fragments_queue = queue.Queue()
+    for i in range(len(fragments)):
+        fragments_queue.put(i)
+
+    global ALTERED
+    global MISSING
+    failed_count = 0
+    batch_count = 0
+    progress = Progress(fragments.size)
+    # sends data fragments while queue is not empty
+    while not fragments_queue.empty():
+        count = 0
+        batch = []
+        started = time.monotonic()
+        while count != 10 and not fragments_queue.empty():
+            batch.append(fragments_queue.get())
+            fragment = fragments[batch[-1]]
+            # if some fragments need to be altered in case of testing of error detection
+            if ALTERED and count%2 == 0 :
+                fragment = alter_fragment(fragment)
+                failed_count += 1
+                if failed_count > 10:
+                    ALTERED = False
+            # if MISSING is true, first fragment is not sent for error detection
+            if not MISSING:
+                sock.sendto(fragment, address)
+                METRICS.packets_sent += 1
+                METRICS.bytes_sent += len(fragment)
+            else:
+                MISSING = False
+            count += 1
+        sent = time.monotonic()
+        backoff = 0
+        while True:
+            # waits for confirmation message - if all fragments arrived as they should, nothing much happens
+            # otherwise fragments that arrived corrupted are put into queue again
+            sock.settimeout(connection.rtt.timeout(backoff))
+            try:
+                data, address = sock.recvfrom(1024)
+            except socket.timeout:
+                if time.monotonic() - sent > GIVE_UP_TIMEOUT:
+                    progress.message("Receiver stopped responding.")
+                    progress.close(False)
+                    return False
+                # reply or the whole batch was lost, keep alive fragment with number of batch asks for reply again
+                backoff += 1
+                sock.sendto(LEGACY_FRAGMENT_HEADER.pack(KEEP_ALIVE, 0, 0, batch_number(batch_count)), address)
+                continue
+            # receivers that don't number batches store 0, replies of former batches are dropped
+            if len(data) < LEGACY_FRAGMENT_HEADER.size or \
+                    int.from_bytes(data[5:7], "big") not in (0, batch_number(batch_count)):
+                continue
+            now = time.monotonic()
+            if backoff == 0:
+                # it's not known which request the reply answers once batch was asked for again (Karn's algorithm)
+                connection.rtt.on_rtt(now - sent)
+            METRICS.batch_latency.observe(now - started)
+            if int.from_bytes(data[0:1], "big") == 5:
+                progress.add(sum(fragments.payload_size(i) for i in batch))
+                batch_count += 1
+                break
+            elif int.from_bytes(data[0:1], "big") == 3:
+                n_of_failed = int(int.from_bytes(data[3:5], "big"))
+                failed = [int.from_bytes(data[7+i*2:7+i*2+2], "big") for i in range(n_of_failed)]
+                for i in failed:
+                    fragments_queue.put(i)
+                METRICS.nacks_received += 1
+                METRICS.retransmits += n_of_failed
+                progress.add(sum(fragments.payload_size(i) for i in batch if i not in failed))
+                progress.message(f"Batch {batch_count} delivered unsuccessfully.")
+                progress.message(f"Fragments [ {' '.join(str(i) for i in failed)} ] were unsuccessful in their delivery.")
+                batch_count += 1
+                break
+    progress.close()
+    return True
+
+
+class CongestionController:
+    """
+    Window of fragments in flight shared by all streams of connection (AIMD). Window grows by one fragment
+    with every acknowledged fragment in slow start and by one fragment per round trip afterwards,
+    it's halved when loss is detected, at most once per round trip. Round trip times measured on acks
+    decide how fast pacer sends window.
+    """
+
+    def __init__(self, window=WINDOW_SIZE):
+        """
+        :param window: number of fragments in flight at the start of transfer
+        """
+        self.window = float(window)
+        self.threshold = float(MAX_WINDOW)
+        # smoothed, the lowest and the latest round trip time, None until the first one is measured
+        self.srtt = None
+        self.min_rtt = None
+        self.latest_rtt = None
+        self.reduced = -math.inf
+
+    def slow_start(self):
+        return self.window < self.threshold
+
+    def on_rtt(self, sample):
+        """
+        :param sample: round trip time of fragment that was sent just once
+        """
+        self.latest_rtt = sample
+        self.min_rtt = sample if self.min_rtt is None else min(self.min_rtt, sample)
+        self.srtt = sample if self.srtt is None else self.srtt + (sample - self.srtt) / 8
+
+    def on_ack(self, acked):
+        """
+        :param acked: number of newly acknowledged fragments
+        """
+        if self.slow_start():
+            self.window += acked
+        else:
+            self.window += acked / self.window
+        self.window = min(self.window, float(MAX_WINDOW))
+
+    def on_loss(self, now):
+        """
+        :param now: current time of time.monotonic
+        """
+        # fragments sent before the window was reduced are lost as well, window is not reduced for them again
+        if now - self.reduced >= (self.srtt or INITIAL_RTO):
+            self.threshold = self.window = max(float(MIN_WINDOW), self.window / 2)
+            self.reduced = now
+
+    def pacing_rate(self, datagram):
+        """
+        :param datagram: size of datagram in bytes
+        :return: bytes per second window is sent at, None until round trip time is known
+        """
+        if self.srtt is None:
+            return None
+        gain = PACING_GAIN[0] if self.slow_start() else PACING_GAIN[1]
+        return gain * self.window * datagram / max(self.srtt, 1e-4)
+
+
+class LedbatController(CongestionController):
+    """
+    Delay based controller (LEDBAT). Queuing delay is round trip time above the lowest one seen, window grows
+    while it's below LEDBAT_TARGET and shrinks when it's above, so that transfer yields to other traffic
+    before buffers of path overflow. Slow start ends when queuing delay reaches target, loss halves window like AIMD.
+    """
+
+    def on_ack(self, acked):
+        if self.latest_rtt is None:
+            super().on_ack(acked)
+            return
+        queuing_delay = self.latest_rtt - self.min_rtt
+        if self.slow_start() and queuing_delay < LEDBAT_TARGET:
+            self.window += acked
+        else:
+            off_target = (LEDBAT_TARGET - queuing_delay) / LEDBAT_TARGET
+            self.window += LEDBAT_GAIN * off_target * acked / self.window
+            # window that shrank does not return to slow start
+            self.threshold = min(self.threshold, self.window)
+        self.window = min(max(self.window, float(MIN_WINDOW)), float(MAX_WINDOW))
+
+
+# congestion controllers that can be picked for connection
+CONGESTION_CONTROLLERS = {'aimd': CongestionController, 'ledbat': LedbatController}
+
+
+class Pacer:
+    """
+    Token bucket that spaces out datagrams, so that they do not arrive to bottleneck of path in bursts.
+    Bucket is filled at rate of congestion controller or at rate limit of connection, whichever is lower,
+    and holds tokens for at most PACING_BURST datagrams or datagrams of PACING_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        # bytes that can be sent right away, None when rate is not limited
+        self.rate = None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def refill(self, rate, datagram, now):
+        """
+        :param rate: bytes per second, None to send without pacing
+        :param datagram: size of datagram in bytes
+        :param now: current time of time.monotonic
+        """
+        if rate is not None:
+            depth = max(PACING_BURST * datagram, rate * PACING_INTERVAL)
+            start = self.tokens if self.rate is not None else depth
+            self.tokens = min(depth, start + (now - self.updated) * rate)
+        self.rate = rate
+        self.updated = now
+
+    def allowance(self, datagram):
+        """
+        :return: number of datagrams that can be sent right away
+        """
+        if self.rate is None:
+            return math.inf
+        return max(int(self.tokens // datagram), 0)
+
+    def consume(self, size):
+        """
+        :param size: number of bytes that were sent, retransmissions can take bucket below zero
+        """
+        if self.rate is not None:
+            self.tokens -= size
+
+    def delay(self, datagram):
+        """
+        :return: seconds until the next datagram can be sent
+        """
+        if self.rate is None or self.tokens >= datagram:
+            return 0
+        return (datagram - self.tokens) / self.rate
+
+
+class LossSimulator:
+    """
+    Simulates lossy path on loopback without netem, like ALTERED and MISSING do for single fragments.
+    Data fragments are lost or corrupted with given probability and go through bottleneck of given rate,
+    whose queue delays them and drops those that overflow its buffer, the way switch drops bursts of fragments.
+    Delayed fragments are sent by thread of simulator, that runs while its queue is not empty.
+    """
+
+    def __init__(self, loss=0.0, corruption=0.0, rate=None, buffer=64 * 1024, delay=0.0, seed=None):
+        """
+        :param loss: probability that fragment is lost
+        :param corruption: probability that fragment arrives corrupted
+        :param rate: bytes per second of bottleneck, None for no bottleneck
+        :param buffer: size of queue of bottleneck in bytes
+        :param delay: seconds every fragment is delayed by on top of its time in queue
+        :param seed: seed of random generator, so that runs can be repeated
+        """
+        self.loss = loss
+        self.corruption = corruption
+        self.rate = rate
+        self.buffer = buffer
+        self.delay = delay
+        self.random = random.Random(seed)
+        # bytes queued at bottleneck at time of last fragment
+        self.backlog = 0.0
+        self.updated = time.monotonic()
+        self.lost = self.corrupted = 0
+        # fragments waiting to be sent by time they are due
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def send(self, sock, fragment, address):
+        """
+        Sends fragment through simulated path
+
+        :param sock: socket of client
+        :param fragment: data fragment of version 5
+        :param address: address of receiver
+        """
+        now = time.monotonic()
+        if self.rate is not None:
+            self.backlog = max(0.0, self.backlog - (now - self.updated) * self.rate)
+            self.updated = now
+            if self.backlog + len(fragment) > self.buffer:
+                self.lost += 1
+                return
+            self.backlog += len(fragment)
+        if self.random.random() < self.loss:
+            self.lost += 1
+            return
+        if self.random.random() < self.corruption:
+            self.corrupted += 1
+            fragment = alter_fragment(fragment, FRAGMENT_HEADER.size)
+        due = now + self.delay + (self.backlog / self.rate if self.rate is not None else 0)
+        if due <= now:
+            sock.sendto(fragment, address)
+            return
+        with self.condition:
+            # queue of bottleneck keeps order of fragments
+            self.queue.append((due, sock, fragment, address))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.deliver, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def deliver(self):
+        with self.condition:
+            while self.queue:
+                due, sock, fragment, address = self.queue[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                self.queue.popleft()
+                try:
+                    sock.sendto(fragment, address)
+                except OSError:
+                    # socket was closed by finished transfer
+                    pass
+            self.thread = None
+
+
+class OutgoingStream:
+    """
+    Message or file sent to receiver as one stream of fragments using selective repeat (protocol version 5).
+    Every fragment has its own retransmission timer and receiver reports cumulative and selective acks.
+    Streams of connection share window of congestion controller and pacer, acks and losses of every stream
+    are reported to them.
+    """
+
+    def __init__(self, connection, io, fragments, header, controller, pacer):
+        """
+        :param connection: connection with receiver
+        :param io: DatagramIO that fragments are sent with
+        :param fragments: fragment source, fragments are made again when they need to be sent again
+        :param header: filename fragment, that announces the stream
+        :param controller: congestion controller of connection
+        :param pacer: pacer of connection
+        """
+        self.connection = connection
+        self.io = io
+        self.fragments = fragments
+        self.controller = controller
+        self.pacer = pacer
+        # size of data fragment with header and checksum and how much the last fragment is shorter
+        self.datagram = FRAGMENT_HEADER.size + fragments.fragment_size + fragments.checksum.size
+        self.shortfall = fragments.fragment_size - fragments.payload_size(len(fragments) - 1) if len(fragments) else 0
+        self.header = header
+        self.id = fragments.stream
+        self.total = len(fragments)
+        # size of group and number of parity fragments of group, None when no parity fragments are sent
+        self.fec = FEC_PARAMETERS.unpack_from(header, FRAGMENT_HEADER.size) if header[1] & FEC_FLAG else None
+        # time of last transmission of filename fragment, None when receiver confirmed it
+        self.header_sent = None
+        # file that receiver may have received partially waits for ranges of missing fragments before it's sent
+        self.resume = bool(header[1] & RESUME_FLAG)
+        # digest fragment is made once all fragments were sent, receiver answers it with result of comparison,
+        # that is None until receiver answers and stays None when no digest is sent
+        self.digest = None
+        self.digest_sent = None
+        self.verified = None
+        # time of last transmission of every fragment that is in flight
+        self.in_flight = {}
+        self.acked = bytearray(self.total)
+        self.base = self.next_index = 0
+        # fragments that were sent more than once, their acks do not measure round trip time
+        self.resent = set()
+        self.retransmitted = 0
+        # bytes of data receiver acknowledged and last fragments of bursts that were not acknowledged yet with their time
+        self.delivered = 0
+        self.bursts = collections.deque()
+        # number of times retransmission timer of stream expired since the last ack
+        self.backoff = 0
+        self.last_progress = time.monotonic()
+
+    def done(self):
+        if self.fragments.digest is not None and self.verified is None:
+            return False
+        return self.header_sent is None and self.base >= self.total
+
+    def transmit(self, indexes):
+        if not indexes:
+            return
+        now = time.monotonic()
+        for index in indexes:
+            if index in self.in_flight:
+                self.resent.add(index)
+            self.in_flight[index] = now
+        self.pacer.consume(len(indexes) * self.datagram)
+        METRICS.packets_sent += len(indexes)
+        METRICS.bytes_sent += len(indexes) * self.datagram - (self.shortfall if self.total - 1 in indexes else 0)
+        if SIMULATOR is None:
+            self.io.send_fragments(self.fragments, indexes, self.connection.address)
+            return
+        for k, index in enumerate(indexes):
+            # receiver acknowledges the last fragment of burst right away
+            fragment = b"".join(self.fragments.buffers(index, flags=ACK_NOW if k == len(indexes) - 1 else 0))
+            SIMULATOR.send(self.connection.sock, fragment, self.connection.address)
+
+    def retransmit(self, indexes):
+        self.transmit(indexes)
+        self.retransmitted += len(indexes)
+        METRICS.retransmits += len(indexes)
+
+    def send_header(self):
+        # number of fragments and flags of stream in header are covered by checksum as well as filename,
+        # filename of secure session is encrypted
+        self.connection.sock.sendto(self.fragments.checksum.seal_datagram(self.header), self.connection.address)
+        self.header_sent = time.monotonic()
+
+    def send_digest(self):
+        if self.digest is None:
+            digest = self.fragments.finish_digest()
+            self.digest = self.fragments.checksum.seal(FRAGMENT_HEADER.pack(DIGEST, 0, len(digest),
+                                                                            self.connection.session, self.id,
+                                                                            self.total, 0, 0), digest)
+        self.connection.sock.sendto(self.digest, self.connection.address)
+        self.digest_sent = time.monotonic()
+
+    def on_verdict(self, flags):
+        self.digest_sent = None
+        self.verified = flags == DIGEST_MATCH
+
+    def on_header(self, flags, ranges):
+        """
+        Confirms filename fragment, fragments outside of ranges of missing fragments are not sent
+
+        :param flags: flags of confirmation
+        :param ranges: ranges of missing fragments packed by RANGE
+        """
+        if flags & SEARCH_FLAG:
+            # receiver searches for blocks of file, filename fragment is sent again until it's confirmed
+            self.last_progress = time.monotonic()
+            self.backoff = 0
+            return
+        self.header_sent = None
+        self.backoff = 0
+        if not self.resume:
+            return
+        self.resume = False
+        if not flags & RESUME_FLAG:
+            return
+        self.acked = bytearray(b"\x01" * self.total)
+        for i in range(0, len(ranges) - RANGE.size + 1, RANGE.size):
+            start, end = RANGE.unpack_from(ranges, i)
+            end = min(end, self.total)
+            self.acked[start:end] = bytes(max(end - start, 0))
+        while self.base < self.total and self.acked[self.base]:
+            self.base += 1
+        self.next_index = self.base
+        kept = self.acked.count(1)
+        if kept:
+            print(f"Receiver already has {kept} of {self.total} fragments, they are not going to be sent again.")
+
+    def pending(self):
+        """
+        :return: True if stream has fragments that were not sent yet
+        """
+        return not self.resume and self.next_index < self.total
+
+    def fill(self, budget):
+        """
+        Sends new fragments, receiver never reports more than MAX_WINDOW fragments above cumulative ack,
+        so stream never gets further ahead
+
+        :param budget: number of fragments window and pacer allow to be sent
+        :return: number of fragments that were sent
+        """
+        global ALTERED
+        global MISSING
+
+        if self.resume:
+            return 0
+        batch = []
+        sent = 0
+        while self.next_index < self.total and sent < budget and self.next_index < self.base + MAX_WINDOW:
+            if self.acked[self.next_index]:
+                # fragment was received before transfer was interrupted, receiver ignores parity fragments then
+                self.next_index += 1
+                continue
+            # if some fragments need to be altered in case of testing of error detection
+            if ALTERED and self.next_index % 2 == 0:
+                self.connection.sock.sendto(alter_fragment(self.fragments[self.next_index], FRAGMENT_HEADER.size),
+                                            self.connection.address)
+                self.in_flight[self.next_index] = time.monotonic()
+                self.connection.failed_count += 1
+                if self.connection.failed_count > 10:
+                    ALTERED = False
+            # if MISSING is true, fragment is not sent for error detection and its timer has to expire
+            elif MISSING:
+                self.in_flight[self.next_index] = time.monotonic()
+                MISSING = False
+            else:
+                batch.append(self.next_index)
+            sent += 1
+            self.next_index += 1
+            # parity fragments follow the last fragment of group before fragments of the next group,
+            # so that receiver rebuilds lost fragment before it reports fragments behind it
+            if self.fec is not None and (self.next_index % self.fec[0] == 0 or self.next_index == self.total):
+                self.transmit(batch)
+                batch = []
+                self.send_parity((self.next_index - 1) // self.fec[0])
+        self.transmit(batch)
+        if sent:
+            self.bursts.append((self.next_index - 1, time.monotonic()))
+        # all data were hashed when every fragment was sent at least once
+        if self.fragments.digest is not None and self.digest is None and self.next_index == self.total:
+            self.send_digest()
+        return sent
+
+    def send_parity(self, group):
+        """
+        Sends parity fragments of group, that are sent just once and are not acknowledged.
+        Parity fragment stores its number in index and size of data of stream in offset,
+        so that receiver knows size of the last fragment it rebuilds.
+
+        :param group: index of group
+        """
+        size, count = self.fec
+        first = group * size
+        last = min(first + size, self.total)
+        for j in range(min(count, last - first)):
+            payloads = [self.fragments.read(i) for i in range(first + j, last, count)]
+            parity = xor_payloads(payloads, max(len(payload) for payload in payloads))
+            fragment = self.fragments.checksum.seal(FRAGMENT_HEADER.pack(PARITY, 0, len(parity),
+                                                                         self.connection.session, self.id, self.total,
+                                                                         group * count + j, self.fragments.size),
+                                                    parity)
+            self.connection.sock.sendto(fragment, self.connection.address)
+            METRICS.packets_sent += 1
+            METRICS.bytes_sent += len(fragment)
+
+    def deadline(self):
+        """
+        :return: time when the oldest retransmission timer of stream expires
+        """
+        oldest = min(self.in_flight.values(), default=math.inf)
+        if self.header_sent is not None:
+            oldest = min(oldest, self.header_sent)
+        if self.digest_sent is not None:
+            oldest = min(oldest, self.digest_sent)
+        return oldest + self.connection.rtt.timeout(self.backoff)
+
+    def on_timeout(self, now):
+        """
+        Sends again filename fragment, digest fragment and fragments whose retransmission timer expired
+        """
+        timeout = self.connection.rtt.timeout(self.backoff)
+        expired = [i for i, sent in self.in_flight.items() if now - sent >= timeout]
+        header_expired = self.header_sent is not None and now - self.header_sent >= timeout
+        digest_expired = self.digest_sent is not None and now - self.digest_sent >= timeout
+        if header_expired:
+            self.send_header()
+        if digest_expired:
+            self.send_digest()
+        if expired:
+            self.controller.on_loss(now)
+        if expired or header_expired or digest_expired:
+            # timer is backed off until receiver answers
+            self.backoff += 1
+        self.retransmit(expired)
+
+    def on_sack(self, cumulative, bitmap):
+        # receiver acknowledges fragments only after it got filename fragment,
+        # confirmation with missing ranges is awaited even then
+        if not self.resume:
+            self.header_sent = None
+        newly_acked = []
+        for i in range(self.base, cumulative):
+            if not self.acked[i]:
+                newly_acked.append(i)
+        for byte_index, byte in enumerate(bitmap):
+            if byte:
+                for bit in range(8):
+                    i = cumulative + 1 + byte_index * 8 + bit
+                    if byte & (0x80 >> bit) and i < self.total and not self.acked[i]:
+                        newly_acked.append(i)
+        if not newly_acked:
+            return
+
+        now = self.last_progress = time.monotonic()
+        highest = max(newly_acked)
+        # time when the newest of acknowledged fragments was sent
+        newest = max(self.in_flight.get(i, 0) for i in newly_acked)
+        # round trip time is measured on the newest fragment, unless it was sent more than once (Karn's algorithm)
+        latest = max((i for i in newly_acked if i in self.in_flight), key=self.in_flight.get, default=None)
+        if latest is not None and latest not in self.resent:
+            self.controller.on_rtt(now - self.in_flight[latest])
+            self.connection.rtt.on_rtt(now - self.in_flight[latest])
+        self.backoff = 0
+        for i in newly_acked:
+            self.acked[i] = 1
+            self.in_flight.pop(i, None)
+            self.resent.discard(i)
+        self.controller.on_ack(len(newly_acked))
+        self.delivered += len(newly_acked) * self.fragments.fragment_size - \
+            (self.shortfall if self.total - 1 in newly_acked else 0)
+        while self.bursts and self.acked[self.bursts[0][0]]:
+            METRICS.batch_latency.observe(now - self.bursts.popleft()[1])
+        while self.base < self.total and self.acked[self.base]:
+            self.base += 1
+
+        # fragments sent before acknowledged ones that are still missing are considered lost,
+        # fragments of group with parity are lost only when receiver could not rebuild them after the group
+        if self.fec is None:
+            lost = [i for i, sent in self.in_flight.items() if i + REORDER_THRESHOLD <= highest and sent < newest]
+        else:
+            size = self.fec[0]
+            lost = [i for i, sent in self.in_flight.items()
+                    if min((i // size + 1) * size, self.total) - 1 + REORDER_THRESHOLD <= highest and sent < newest]
+        if lost:
+            self.controller.on_loss(now)
+        self.retransmit(lost)
+
+    def on_nack(self, corrupted):
+        # fragments that arrived corrupted are sent again right away
+        METRICS.nacks_received += 1
+        corrupted = [i for i in corrupted if i < self.total and not self.acked[i]]
+        if corrupted:
+            self.controller.on_loss(time.monotonic())
+        self.retransmit(corrupted)
+
+
+class PreparedStreams:
+    """
+    Makes streams in another thread one stream ahead of send loop, so that compression of the next file
+    doesn't hold up acks and retransmission timers of streams in flight
+    """
+
+    def __init__(self, streams):
+        """
+        :param streams: iterable of tuples of fragment source and filename fragment
+        """
+        self.queue = queue.Queue(maxsize=1)
+        self.stopped = threading.Event()
+        self.exhausted = False
+        threading.Thread(target=self.prepare, args=(streams,), daemon=True).start()
+
+    def prepare(self, streams):
+        try:
+            for item in streams:
+                if not self.put(item):
+                    item[0].close()
+                    return
+        except Exception as error:
+            # error of file that can't be read is raised by send loop
+            self.put(error)
+            return
+        self.put(None)
+
+    def put(self, item):
+        """
+        :return: False if send loop stopped before it took the item
+        """
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=SERVER_TICK)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, timeout=None):
+        """
+        :param timeout: seconds to wait for the next stream, None to not wait at all
+        :return: tuple of fragment source and filename fragment, None if no stream is ready or all were taken
+        """
+        if self.exhausted:
+            return None
+        try:
+            item = self.queue.get(timeout is not None, timeout)
+        except queue.Empty:
+            return None
+        if item is None:
+            self.exhausted = True
+        elif isinstance(item, Exception):
+            self.exhausted = True
+            raise item
+        return item
+
+    def close(self):
+        """
+        Stops thread and closes fragment sources of streams that were made but not sent
+        """
+        self.stopped.set()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, tuple):
+                item[0].close()
+
+
+def send_streams(connection, streams, parallel=PARALLEL_STREAMS, total=None):
+    """
+    Sends streams of messages or files over one connection (protocol version 5). Up to parallel streams
+    are in flight at once, so that round trips of one file are overlapped with fragments of others.
+    Data fragments follow filename fragment right away, receiver acknowledges them once it got the filename.
+    New fragments of all streams are sent while window of congestion controller and pacer allow.
+
+    :param connection: connection with receiver
+    :param streams: iterable of tuples of fragment source and filename fragment, it's consumed lazily
+                    by another thread, so that only files that are being sent or are next are open
+    :param parallel: maximum number of streams in flight
+    :param total: number of bytes of all streams shown in progress line, None when it's not known
+    :return: True if all streams were delivered
+    """
+    prepared = PreparedStreams(streams)
+    try:
+        return send_prepared(connection, prepared, parallel, total)
+    finally:
+        prepared.close()
+
+
+def send_prepared(connection, prepared, parallel, total):
+    """
+    Event loop of send_streams
+
+    :param prepared: streams made by another thread
+    :return: True if all streams were delivered
+    """
+    sock = connection.sock
+    progress = Progress(total)
+    io = datagram_io(sock)
+    controller = CONGESTION_CONTROLLERS[connection.congestion]()
+    pacer = Pacer()
+    active = {}
+    delivered = True
+
+    while True:
+        while len(active) < parallel:
+            # send loop waits for the next stream only when there is nothing else to do
+            item = prepared.get(None if active else KEEP_ALIVE_INTERVAL)
+            if item is None:
+                break
+            stream = OutgoingStream(connection, io, *item, controller, pacer)
+            active[stream.id] = stream
+            stream.send_header()
+        if not active:
+            if prepared.exhausted:
+                break
+            # next file is still being compressed
+            send_keep_alive(connection)
+            continue
+
+        now = time.monotonic()
+        for stream in list(active.values()):
+            if now - stream.last_progress > GIVE_UP_TIMEOUT:
+                progress.message("Receiver stopped responding.")
+                stream.fragments.close()
+                del active[stream.id]
+                delivered = False
+        datagram = max((stream.datagram for stream in active.values()), default=MAX_DATAGRAM)
+        rate = controller.pacing_rate(datagram) if connection.pacing else None
+        if connection.rate_limit is not None:
+            rate = connection.rate_limit if rate is None else min(rate, connection.rate_limit)
+        pacer.refill(rate, datagram, now)
+        budget = min(int(controller.window) - sum(len(stream.in_flight) for stream in active.values()),
+                     pacer.allowance(datagram))
+        for stream in active.values():
+            if budget <= 0:
+                break
+            budget -= stream.fill(budget)
+
+        deadline = min(stream.deadline() for stream in active.values()) if active else now
+        timeout = min(max(deadline - time.monotonic(), 0.001), connection.rtt.timeout())
+        if len(active) < parallel and not prepared.exhausted:
+            # stream that is being made is picked up soon after it's ready
+            timeout = min(timeout, SERVER_TICK)
+        if any(stream.pending() for stream in active.values()) and \
+                sum(len(stream.in_flight) for stream in active.values()) < int(controller.window):
+            # window allows more fragments, pacer lets them go out later
+            timeout = min(timeout, max(pacer.delay(datagram), 0.0001))
+        sock.settimeout(timeout)
+        try:
+            data, _ = sock.recvfrom(2048)
+        except socket.timeout:
+            # retransmission timers of fragments expired or pacer allows next fragments
+            now = time.monotonic()
+            for stream in active.values():
+                stream.on_timeout(now)
+            continue
+
+        # acks that got corrupted on their way or are not authentic in secure session are dropped,
+        # timers of fragments send them again
+        data = connection.checksum.open_datagram(memoryview(data))
+        if data is None:
+            continue
+        typ, flags, data_length, session, stream_id, n_of_failed, cumulative, _ = FRAGMENT_HEADER.unpack_from(data)
+        stream = active.get(stream_id)
+        if session != connection.session or stream is None:
+            # acks of former connection with receiver or of streams that were already delivered
+            continue
+        delivered_before = stream.delivered
+        if typ == HEADER or typ == SIGNATURES:
+            stream.on_header(flags, data[FRAGMENT_HEADER.size:FRAGMENT_HEADER.size + data_length])
+        elif typ == SACK and cumulative <= stream.total:
+            # ack of broken receiver must not move stream past its end
+            stream.on_sack(cumulative, data[FRAGMENT_HEADER.size:FRAGMENT_HEADER.size + data_length])
+        elif typ == NACK and data_length == 4 * n_of_failed:
+            stream.on_nack(struct.unpack_from(f"!{n_of_failed}I", data, FRAGMENT_HEADER.size))
+        elif typ == DIGEST:
+            stream.on_verdict(flags)
+        progress.add(stream.delivered - delivered_before)
+
+        if stream.done():
+            progress.message(f"All {stream.total} fragments delivered, "
+                             f"{stream.retransmitted} of them had to be sent again.")
+            if stream.verified is False:
+                progress.message("Digest of received data does not match, data were damaged on their way.")
+                delivered = False
+            elif stream.verified:
+                progress.message(f"Receiver verified {connection.digest} digest of data.")
+            stream.fragments.close()
+            del active[stream_id]
+
+    progress.close(delivered)
+    return delivered
+
+
+def make_stream(connection, fragment_size, message=None, path=None, name=None):
+    """
+    Creates fragment source and filename fragment of message or file
+
+    :param connection: connection with receiver, it has to be already initialized
+    :param fragment_size: maximum size of fragments to be sent, 0 for auto
+    :param message: text message to be sent as bytearray, it's ignored when file is sent
+    :param path: path to file to be sent, None if message is just text message
+    :param name: name file is saved under by receiver, relative path with / as separator, basename of path if not set
+    :return: tuple of fragment source and filename fragment
+    """
+    version = connection.version
+    fragment_size = data_size(connection, fragment_size)
+    delta = delta_mode(connection, path)
+
+    stream = connection.next_stream()
+    flag = 0
+    # digest is computed over data before compression, so that it covers decompression on receiving end as well
+    digest = hashlib.new(connection.digest) if version != LEGACY_VERSION and connection.digest else None
+    # data sent in delta mode are not compressed, so that their fragments match blocks of file
+    if version != LEGACY_VERSION and not delta:
+        if path is None:
+            sample = bytes(message[:COMPRESSION_CHUNK])
+        else:
+            with open(path, "rb") as file:
+                sample = file.read(COMPRESSION_CHUNK)
+        flag = choose_compression(connection, sample)
+
+    if flag == 0:
+        fragments = FragmentSource(fragment_size, message=message, path=path, version=version,
+                                   session=connection.session, stream=stream, checksum=connection.checksum)
+        size = fragments.size
+        # data are hashed while fragments are sent
+        fragments.digest = digest
+    else:
+        # data are compressed before they are sent, so that number of fragments is known in advance
+        # and fragments that need to be sent again can be read from compressed data
+        compressor = make_compressor(flag)
+        if path is None:
+            size = len(message)
+            if digest is not None:
+                digest.update(message)
+            fragments = FragmentSource(fragment_size, message=compressor.compress(bytes(message)) + compressor.flush(),
+                                       version=version, session=connection.session, stream=stream,
+                                       checksum=connection.checksum)
+        else:
+            size = os.path.getsize(path)
+            fragments = FragmentSource(fragment_size, file=compress_file(path, flag, digest), version=version,
+                                       session=connection.session, stream=stream, checksum=connection.checksum)
+        # data were hashed while they were compressed
+        fragments.digest = digest
+        fragments.hashed = len(fragments)
+        name_of_compression = next(name for name, value in COMPRESSIONS.items() if value == flag)
+        print(f"Data were compressed by {name_of_compression} from {size} to {fragments.size} bytes.")
+
+    # filename fragment, if only a simple text message is being sent, it creates just header without data
+    if path is None:
+        filename = b""
+    else:
+        filename = bytes(name if name is not None else os.path.basename(path), "utf-8")
+    if fragments.digest is not None and len(fragments):
+        flag |= DIGESTS[connection.digest] << DIGEST_SHIFT
+    else:
+        # empty message or file is not hashed
+        fragments.digest = None
+    if version != LEGACY_VERSION and path is not None and not flag & COMPRESSION_MASK and \
+            (size >= RESUME_SIZE or delta):
+        # compressed data can not be decompressed from the middle, so only files sent as they are can be resumed,
+        # receiver answers file sent in delta mode with ranges of fragments it did not find the same way
+        flag |= RESUME_FLAG
+        filename = RESUME_IDENTITY.pack(os.stat(path).st_mtime_ns) + filename
+    if version != LEGACY_VERSION and connection.fec is not None:
+        # data of filename fragment start with parameters of parity fragments
+        flag |= FEC_FLAG
+        filename = FEC_PARAMETERS.pack(*connection.fec) + filename
+    if version == LEGACY_VERSION:
+        # data fragment with filename in data is created, empty data means that a message is being sent.
+        # Transfer refuses more fragments than version 1 can count before the fragment is sent.
+        header = LEGACY_FRAGMENT_HEADER.pack(DATA, len(filename), min(len(fragments), 65535), 0) + filename
+    else:
+        # version 5 receivers tell filename fragment from data fragments by its type and get fragment size
+        # in its index, size of file before compression in its offset, so that they can prepare file of right size,
+        # and compression and digest in its flags
+        header = FRAGMENT_HEADER.pack(HEADER, flag, len(filename), connection.session, stream, len(fragments),
+                                      fragments.fragment_size, size) + filename
+    return fragments, header
+
+
+def send_keep_alive(connection, stream=0):
+    """
+    Sends keep alive fragment, so that receiver doesn't forget session of client that has nothing to send
+
+    :param connection: connection with receiver, it has to be already initialized
+    :param stream: id of stream that keeps the session alive
+    """
+    if connection.version == LEGACY_VERSION:
+        connection.sock.sendto(LEGACY_FRAGMENT_HEADER.pack(KEEP_ALIVE, 0, 0, 0), connection.address)
+    else:
+        connection.sock.sendto(FRAGMENT_HEADER.pack(KEEP_ALIVE, 0, 0, connection.session, stream, 0, 0, 0),
+                               connection.address)
+
+
+def keeping_alive(connection, function, *args):
+    """
+    Calls function in another thread and keeps session alive until it returns, compression of large file
+    may take longer than receiver waits for client
+
+    :param connection: connection with receiver, it has to be already initialized
+    :param function: function to be called
+    :param args: arguments of function
+    :return: what function returned, exception it raised is raised again
+    """
+    outcome = []
+
+    def call():
+        try:
+            outcome.append((True, function(*args)))
+        except BaseException as error:
+            outcome.append((False, error))
+
+    thread = threading.Thread(target=call, daemon=True)
+    thread.start()
+    while True:
+        thread.join(KEEP_ALIVE_INTERVAL)
+        if not thread.is_alive():
+            break
+        send_keep_alive(connection)
+    returned, value = outcome[0]
+    if not returned:
+        raise value
+    return value
+
+
+def data_size(connection, fragment_size):
+    """
+    :param connection: connection with receiver
+    :param fragment_size: maximum size of fragments chosen by user, 0 for auto
+    :return: size of data of fragments, automatic size fills the largest datagram found by path MTU discovery
+    """
+    # larger fragments would be fragmented by IP on their way (1463 for version 1, that does not discover path MTU)
+    if connection.version == LEGACY_VERSION:
+        largest = MAX_DATAGRAM - LEGACY_FRAGMENT_HEADER.size - CRC.size
+    else:
+        largest = (connection.datagram_size or MAX_DATAGRAM) - FRAGMENT_HEADER.size - connection.checksum.size
+    return largest if fragment_size == 0 or fragment_size > largest else fragment_size
+
+
+def delta_mode(connection, path):
+    """
+    :return: True if file is sent in delta mode
+    """
+    return connection.version != LEGACY_VERSION and path is not None and connection.delta and \
+        bool(connection.features & DELTA_FEATURE)
+
+
+def block_signatures(path, block_size):
+    """
+    Computes signatures of blocks of file, receiver looks for them in file it already has
+
+    :param path: path to file
+    :param block_size: size of blocks, that is the size of data of fragments
+    :return: signatures packed by BLOCK_SIGNATURE
+    """
+    signatures = bytearray()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            signatures += BLOCK_SIGNATURE.pack(zlib.adler32(block), hashlib.blake2b(block, digest_size=8).digest())
+    return signatures
+
+
+def make_signatures(connection, fragment_size, path, name=None):
+    """
+    Creates fragment source and filename fragment of signatures of blocks of file sent in delta mode
+
+    :param connection: connection with receiver, it has to be already initialized
+    :param fragment_size: maximum size of fragments to be sent, 0 for auto
+    :param path: path to file
+    :param name: name file is saved under by receiver, basename of path if not set
+    :return: tuple of fragment source and filename fragment
+    """
+    fragment_size = data_size(connection, fragment_size)
+    stream = connection.next_stream()
+    signatures = block_signatures(path, fragment_size)
+    fragments = FragmentSource(fragment_size, message=signatures, session=connection.session, stream=stream,
+                               checksum=connection.checksum)
+    filename = DELTA_PARAMETERS.pack(fragment_size, os.path.getsize(path)) + \
+        bytes(name if name is not None else os.path.basename(path), "utf-8")
+    header = FRAGMENT_HEADER.pack(SIGNATURES, 0, len(filename), connection.session, stream, len(fragments),
+                                  fragment_size, len(signatures)) + filename
+    return fragments, header
+
+
+def transfer(connection, fragment_size, message, path):
+    """
+    Sends filename fragment and all data fragments of message to receiver
+
+    :param connection: connection with receiver, it has to be already initialized
+    :param fragment_size: maximum size of fragments to be sent
+    :param message: text message to be sent as bytearray, it's ignored when file is sent
+    :param path: path to file to be sent, it's 0 if message is just text message
+    :return: True if message was delivered
+    """
+    fragments, header = keeping_alive(connection, make_stream, connection, fragment_size, message,
+                                      None if path == 0 else path)
+
+    if connection.version == LEGACY_VERSION and len(fragments) > 65535:
+        print("Receiver uses protocol version 1, that can not transfer more than 65535 fragments.")
+        fragments.close()
+        return False
+
+    if path != 0:
+        print(f"File {os.path.abspath(path)} is going to be transfered.")
+
+    print(f"Fragments of maximum size of {fragments.fragment_size} are going to be sent.")
+    print(f"{len(fragments)} fragments are going to be sent.")
+
+    if connection.version != LEGACY_VERSION:
+        if delta_mode(connection, None if path == 0 else path):
+            # receiver has to know which blocks it has before filename fragment of file arrives
+            print("Signatures of blocks of file are going to be sent.")
+            if not send_streams(connection, [make_signatures(connection, fragment_size, path)]):
+                fragments.close()
+                return False
+        return send_streams(connection, [(fragments, header)], total=fragments.size)
+    try:
+        connection.sock.sendto(header, connection.address)
+        return send_batches(connection, fragments)
+    finally:
+        fragments.close()
+
+
+def list_directory(directory):
+    """
+    Lists all files in directory and its subdirectories
+
+    :param directory: path to directory
+    :return: list of tuples of path to file and its path relative to directory with / as separator
+    """
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                files.append((path, os.path.relpath(path, directory).replace(os.sep, "/")))
+    return files
+
+
+def transfer_directory(connection, fragment_size, directory):
+    """
+    Sends all files of directory as parallel streams of one connection, receiver saves them
+    under directory of the same name
+
+    :param connection: connection with receiver, it has to be already initialized
+    :param fragment_size: maximum size of fragments to be sent
+    :param directory: path to directory to be sent
+    :return: True if all files were delivered
+    """
+    if connection.version == LEGACY_VERSION:
+        print("Receiver uses protocol version 1, that can not transfer directories.")
+        return False
+
+    prefix = os.path.basename(os.path.normpath(directory))
+    files = list_directory(directory)
+    print(f"{len(files)} files of directory {os.path.abspath(directory)} are going to be transfered.")
+    if connection.delta and connection.features & DELTA_FEATURE:
+        # signatures of all files are sent before the files
+        print("Signatures of blocks of files are going to be sent.")
+        signatures = (make_signatures(connection, fragment_size, path, f"{prefix}/{name}") for path, name in files)
+        if not send_streams(connection, signatures):
+            return False
+    streams = (make_stream(connection, fragment_size, path=path, name=f"{prefix}/{name}") for path, name in files)
+    # size of compressed files is known only once they are compressed
+    total = sum(os.path.getsize(path) for path, _ in files) if connection.compression is None else None
+    return send_streams(connection, streams, total=total)
+
+
+class MessageStream:
+    """
+    Stream of small messages sent over connection (message-stream mode, protocol version 5). Messages are framed
+    by their length and coalesced into one datagram until it's full or until the oldest of them waited flush delay,
+    like Nagle's algorithm does. Receiver acknowledges datagrams cumulatively and delivers their messages in order,
+    so no handshake, filename fragment or round trip is spent on single message. Acks are received and datagrams
+    are sent again by thread of the stream, socket of connection can't be used by other transfers until it's closed.
+    """
+
+    def __init__(self, connection, fragment_size=0, flush_delay=MESSAGE_FLUSH_DELAY):
+        """
+        :param connection: connection with receiver of protocol version 5
+        :param fragment_size: maximum size of data of datagram, 0 to fill the largest datagram path allows
+        :param flush_delay: seconds the first message waits for others before datagram that is not full is sent,
+                            0 to send every message right away
+        :raise ValueError: when receiver speaks only protocol version 1
+        """
+        if connection.version == LEGACY_VERSION:
+            raise ValueError("Message streams need receiver of protocol version 5.")
+        self.connection = connection
+        self.id = connection.next_stream()
+        self.capacity = data_size(connection, fragment_size)
+        self.flush_delay = flush_delay
+        self.controller = CONGESTION_CONTROLLERS[connection.congestion]()
+        self.condition = threading.Condition()
+        # framed messages of datagram that was not sent yet, their number and time when the first one was added
+        self.pending = bytearray()
+        self.count = 0
+        self.since = None
+        # datagrams that were not acknowledged yet by their index, with time they were sent,
+        # datagrams sent again are not used for measurement of round trip time
+        self.datagrams = {}
+        self.in_flight = {}
+        self.resent = set()
+        self.next_index = 0
+        self.acked = 0
+        self.duplicates = 0
+        self.backoff = 0
+        self.last_progress = self.last_sent = time.monotonic()
+        # error that stopped the stream, it's raised by next call
+        self.error = None
+        self.stopped = False
+        # thread is woken up by byte sent through socket pair when message waits for flush or stream is closed
+        self.wakeup, self.waker = socket.socketpair()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, message):
+        """
+        Adds message to datagram, that is sent once it's full or once flush delay elapses.
+        Waits while window of congestion controller is full.
+
+        :param message: message as bytes or text, that is encoded in utf-8
+        :raise ValueError: when message does not fit into one datagram
+        :raise ConnectionError: when receiver stopped responding
+        """
+        if isinstance(message, str):
+            message = message.encode()
+        size = MESSAGE_LENGTH.size + len(message)
+        if size > self.capacity:
+            raise ValueError(f"Message of {len(message)} bytes does not fit into datagram, send it by send_message.")
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            if len(self.pending) + size > self.capacity:
+                self.flush_pending()
+            self.pending += MESSAGE_LENGTH.pack(len(message))
+            self.pending += message
+            self.count += 1
+            if self.flush_delay <= 0 or len(self.pending) + MESSAGE_LENGTH.size >= self.capacity:
+                self.flush_pending()
+            elif self.since is None:
+                self.since = time.monotonic()
+                self.waker.send(b"\0")
+
+    def flush(self):
+        """
+        Sends messages that wait for flush delay right away
+        """
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            self.flush_pending()
+
+    def flush_pending(self):
+        # caller holds condition, it's released while window is full
+        while len(self.in_flight) >= int(self.controller.window) and self.error is None:
+            self.condition.wait()
+        if not self.count or self.error is not None:
+            return
+        header = FRAGMENT_HEADER.pack(MESSAGES, 0, len(self.pending), self.connection.session, self.id, self.count,
+                                      self.next_index, 0)
+        datagram = self.connection.checksum.seal(header, self.pending)
+        self.datagrams[self.next_index] = datagram
+        METRICS.messages_sent += self.count
+        self.transmit(self.next_index, time.monotonic())
+        self.next_index += 1
+        self.pending = bytearray()
+        self.count = 0
+        self.since = None
+
+    def transmit(self, index, now):
+        datagram = self.datagrams[index]
+        self.connection.sock.sendto(datagram, self.connection.address)
+        if index in self.in_flight:
+            self.resent.add(index)
+            METRICS.retransmits += 1
+        self.in_flight[index] = self.last_sent = now
+        METRICS.packets_sent += 1
+        METRICS.bytes_sent += len(datagram)
+
+    def run(self):
+        """
+        Sends datagrams whose flush delay elapsed, receives acks and sends again datagrams whose timer expired
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self.connection.sock, selectors.EVENT_READ)
+        selector.register(self.wakeup, selectors.EVENT_READ)
+        try:
+            while True:
+                with self.condition:
+                    if self.stopped or self.error is not None:
+                        return
+                    timeout = self.on_timer(time.monotonic())
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is self.wakeup:
+                        self.wakeup.recv(1024)
+                    else:
+                        self.receive()
+        except OSError as error:
+            with self.condition:
+                self.error = error
+                self.condition.notify_all()
+        finally:
+            selector.close()
+
+    def on_timer(self, now):
+        """
+        :param now: current time of time.monotonic
+        :return: seconds until the next timer expires, None when there is none
+        """
+        if self.since is not None and len(self.in_flight) < int(self.controller.window) and \
+                now - self.since >= self.flush_delay:
+            self.flush_pending()
+        deadlines = [now + KEEP_ALIVE_INTERVAL]
+        if self.since is not None and len(self.in_flight) < int(self.controller.window):
+            deadlines.append(self.since + self.flush_delay)
+        if self.in_flight:
+            if now - self.last_progress > GIVE_UP_TIMEOUT:
+                self.error = ConnectionError("Receiver stopped responding.")
+                self.condition.notify_all()
+                return 0
+            timeout = self.connection.rtt.timeout(self.backoff)
+            expired = [index for index, sent in self.in_flight.items() if now - sent >= timeout]
+            if expired:
+                self.backoff += 1
+                self.controller.on_loss(now)
+                for index in expired:
+                    self.transmit(index, now)
+            deadlines.append(min(self.in_flight.values()) + self.connection.rtt.timeout(self.backoff))
+        elif now - self.last_sent >= KEEP_ALIVE_INTERVAL:
+            # session of client that sends nothing for long expires on receiver
+            send_keep_alive(self.connection, self.id)
+            self.last_sent = now
+        return max(min(deadlines) - now, 0)
+
+    def receive(self):
+        try:
+            data, _ = self.connection.sock.recvfrom(2048)
+        except (BlockingIOError, socket.timeout):
+            return
+        # acks that got corrupted on their way or are not authentic in secure session are dropped
+        data = self.connection.checksum.open_datagram(memoryview(data))
+        if data is None:
+            return
+        typ, _, _, session, stream_id, _, cumulative, _ = FRAGMENT_HEADER.unpack_from(data)
+        if typ != MESSAGES or session != self.connection.session or stream_id != self.id:
+            return
+        with self.condition:
+            self.on_ack(min(cumulative, self.next_index), time.monotonic())
+
+    def on_ack(self, cumulative, now):
+        """
+        :param cumulative: number of datagrams receiver delivered in order
+        :param now: current time of time.monotonic
+        """
+        if cumulative <= self.acked:
+            # the first datagram that was not acknowledged is sent again when later ones keep arriving
+            self.duplicates += 1
+            if self.duplicates == REORDER_THRESHOLD and cumulative in self.in_flight:
+                self.controller.on_loss(now)
+                self.transmit(cumulative, now)
+            return
+        # round trip time is measured on the last acknowledged datagram, the others waited for it
+        if cumulative - 1 not in self.resent:
+            sample = now - self.in_flight[cumulative - 1]
+            self.connection.rtt.on_rtt(sample)
+            self.controller.on_rtt(sample)
+        for index in range(self.acked, cumulative):
+            del self.in_flight[index]
+            del self.datagrams[index]
+            self.resent.discard(index)
+        self.controller.on_ack(cumulative - self.acked)
+        self.acked = cumulative
+        self.duplicates = 0
+        self.backoff = 0
+        self.last_progress = now
+        self.condition.notify_all()
+
+    def close(self):
+        """
+        Sends messages that wait for flush delay and waits until receiver acknowledges all messages
+
+        :return: True if all messages were delivered
+        """
+        if self.stopped:
+            return self.error is None
+        with self.condition:
+            if self.error is None:
+                self.flush_pending()
+            while self.in_flight and self.error is None:
+                self.condition.wait()
+            delivered = self.error is None
+            self.stopped = True
+        self.waker.send(b"\0")
+        self.thread.join()
+        self.wakeup.close()
+        self.waker.close()
+        return delivered
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Sender:
+    """
+    Client that sends messages, files and directories to one receiver over one connection, without any menu
+    """
+
+    def __init__(self, address, fragment_size=0, version=PROTOCOL_VERSION, compression=None, fec=None,
+                 rate_limit=None, congestion='aimd', pacing=True, delta=False, psk=None):
+        """
+        :param address: host and port of receiver
+        :param fragment_size: maximum size of fragments to be sent, 0 to find it out by path MTU discovery
+        :param version: offered protocol version
+        :param compression: 'auto', one of COMPRESSIONS or None to send data as they are
+        :param fec: size of group and number of its parity fragments or None
+        :param rate_limit: bytes per second data are sent at most or None
+        :param congestion: congestion controller, one of CONGESTION_CONTROLLERS
+        :param pacing: whether datagrams are paced at rate of congestion controller
+        :param delta: whether files are sent in delta mode, receiver gets only blocks it doesn't have in file
+                      of the same name, files are not compressed then
+        :param psk: pre-shared key as text or bytes, all fragments are encrypted in secure session when it's set
+        :raise ConnectionError: when receiver does not respond to initial fragment or does not have the same key
+        :raise ValueError: when psk is set but cryptography package is not installed
+        """
+        if psk is not None and ChaCha20Poly1305 is None:
+            raise ValueError("Secure sessions need cryptography package, install it with pip.")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            connection = handshake(sock, address, version, key=psk_key(psk) if psk is not None else None)
+        except ConnectionError:
+            sock.close()
+            raise
+        if connection is None:
+            sock.close()
+            raise ConnectionError(f"Receiver {address[0]}:{address[1]} did not respond.")
+        self.connection = connection
+        self.fragment_size = fragment_size
+        # message stream that uses socket of connection, None when none is open
+        self.messages = None
+        self.configure(compression, fec, rate_limit, congestion, pacing, delta)
+
+    def configure(self, compression=None, fec=None, rate_limit=None, congestion='aimd', pacing=True, delta=False):
+        """
+        Changes options of following transfers, parameters are the same as those of constructor
+        """
+        self.connection.compression = compression
+        self.connection.fec = fec
+        self.connection.rate_limit = rate_limit
+        self.connection.congestion = congestion
+        self.connection.pacing = pacing
+        self.connection.delta = delta
+
+    def prepare(self):
+        if self.messages is not None and not self.messages.stopped:
+            raise ValueError("Message stream has to be closed before the next transfer.")
+        # path is probed just once, before the first transfer that needs it, for automatic size and for sizes
+        # that do not fit into ethernet frame
+        connection = self.connection
+        largest = MAX_DATAGRAM - FRAGMENT_HEADER.size - connection.checksum.size
+        if connection.version != LEGACY_VERSION and connection.datagram_size is None and \
+                (self.fragment_size == 0 or self.fragment_size > largest):
+            connection.datagram_size = discover_datagram_size(connection.sock, connection.address)
+            print(f"Path allows datagrams of {connection.datagram_size} bytes.")
+
+    def send_message(self, message):
+        """
+        :param message: message as bytes or text, that is encoded in utf-8
+        :return: True if message was delivered
+        """
+        self.prepare()
+        if isinstance(message, str):
+            message = message.encode()
+        return transfer(self.connection, self.fragment_size, bytearray(message), 0)
+
+    def send_file(self, path):
+        """
+        :param path: path to file, its fragments are read only when they are sent
+        :return: True if file was delivered
+        """
+        self.prepare()
+        return transfer(self.connection, self.fragment_size, None, path)
+
+    def send_directory(self, path):
+        """
+        :param path: path to directory, that is sent with all its subdirectories
+        :return: True if all files were delivered
+        """
+        self.prepare()
+        return transfer_directory(self.connection, self.fragment_size, path)
+
+    def send_path(self, path):
+        """
+        :param path: path to file or directory
+        :return: True if file or all files of directory were delivered
+        """
+        return self.send_directory(path) if os.path.isdir(path) else self.send_file(path)
+
+    def open_messages(self, flush_delay=MESSAGE_FLUSH_DELAY):
+        """
+        Opens stream of small messages, that are coalesced into datagrams and delivered to on_message of receiver
+
+        :param flush_delay: seconds the first message waits for others before datagram that is not full is sent
+        :return: MessageStream, other transfers can't be sent until it's closed
+        :raise ValueError: when receiver speaks only protocol version 1
+        """
+        self.prepare()
+        self.messages = MessageStream(self.connection, self.fragment_size, flush_delay)
+        return self.messages
+
+    def close(self):
+        if self.messages is not None and not self.messages.stopped:
+            self.messages.close()
+        self.connection.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def check_ip(IP):
+    """
+    Checks if IP is valid or not
+    :param IP: IP to be checked
+    :return: Boolean
+    """
+    try:
+        socket.inet_aton(IP)
+    except:
+        return False
+    return True
+
+
+def menu_options(answers):
+    """
+    :param answers: answers of client menu
+    :return: options of Sender chosen in menu
+    """
+    return dict(compression=compression_of(answers['compression']),
+                fec=(FEC_GROUP, FEC_PARITY) if answers['fec'] == 'Yes' else None,
+                rate_limit=rate_limit_of(answers['rate_limit']))
+
+
+def start_client():
+    """
+    Starts client, opens menu and sends data entered by user in menu until user quits or changes to server
+
+    :return: 'Server' if user wants to act as server, None if user quits
+    """
+    global ALTERED
+    sender = None
+    answers = prompt(default_client_menu)
+    while True:
+        if 'corr' in answers:
+            ALTERED = answers['corr'] == 'Yes'
+        if sender is None:
+            try:
+                sender = Sender((answers['ip'], int(answers['port'])), **menu_options(answers))
+            except ConnectionError:
+                print("Error occurred while connecting to the server. Please try again.")
+                answers = prompt(default_client_menu)
+                continue
+            print(f"Connection was initialized successfully (protocol version {sender.connection.version}).")
+        else:
+            sender.configure(**menu_options(answers))
+        sender.fragment_size = int(answers['fragment_size'])
+        # files are not read here, fragments are read from file only when they are sent
+        if answers['fm'] == 'Message':
+            sender.send_message(bytearray(answers['message'], "ascii"))
+        else:
+            sender.send_path(answers['file_path'])
+
+        # connection is kept alive while user decides how to continue
+        e = threading.Event()
+        ip, port = sender.connection.address
+        threading.Thread(target=keep_alive, daemon=True, args=(e, sender.connection.sock, ip, port)).start()
+        answer = prompt(end_menu)['selection']
+        e.set()
+
+        if answer == 'Send data to the same server':
+            answers = prompt(same_server_menu)
+        elif answer == 'Send data to different server':
+            sender.close()
+            sender = None
+            answers = prompt(default_client_menu)
+        else:
+            sender.close()
+            return 'Server' if answer == 'Change to server' else None
+
+
+def log(address, text):
+    """
+    Prints out text together with address of client it concerns, so that output of concurrent transfers can be told apart
+
+    :param address: address of client
+    :param text: text to be printed
+    """
+    print(f"[{address[0]}:{address[1]}] {text}")
+
+
+def report_transfer(address, typ, filename, data):
+    """
+    Prints out message if it was a message, otherwise prints path of saved file
+
+    :param address: address of client
+    :param typ: 1 for message, 2 for file
+    :param filename: name of received file, None for message
+    :param data: received message or path to received file, None if transfer was not completed
+    """
+    if data is None:
+        log(address, "Transfer was not completed.")
+    elif typ == 1:
+        log(address, f"Message: {data.decode(errors='replace')}")
+    else:
+        log(address, f"File path to the file: {data}")
+
+
+def report_message(address, message):
+    """
+    Prints out message of message stream
+
+    :param address: address of client
+    :param message: received message as bytes
+    """
+    log(address, f"Message: {message.decode(errors='replace')}")
+
+
+def make_sack(cumulative, received, highest, session=0, stream=0):
+    """
+    Creates selective acknowledgement (type 6). Index stores number of fragments received without gap,
+    data stores bitmap of fragments received after the gap, bit 0 stands for fragment cumulative + 1.
+
+    :param cumulative: index of first fragment that was not received yet
+    :param received: bytearray with 1 on index of every received fragment
+    :param highest: highest index of received fragment
+    :param session: session id of client
+    :param stream: stream id of acknowledged message or file
+    :return: ack fragment, session seals it with its checksum
+    """
+    highest = min(highest, cumulative + MAX_WINDOW)
+    bitmap = bytearray(max(highest - cumulative + 7, 0) // 8)
+    for i in range(cumulative + 1, highest + 1):
+        if received[i]:
+            bit = i - cumulative - 1
+            bitmap[bit // 8] |= 0x80 >> (bit % 8)
+    return FRAGMENT_HEADER.pack(SACK, 0, len(bitmap), session, stream, 0, cumulative, 0) + bytes(bitmap)
+
+
+class MemorySink:
+    """
+    Keeps received fragments of text message in memory
+    """
+
+    def __init__(self):
+        self.fragments = {}
+
+    def write(self, offset, payload):
+        # payload can be view of buffer that is reused for next datagram
+        self.fragments[offset] = bytes(payload)
+
+    def finish(self):
+        """
+        :return: received message
+        """
+        return b"".join(self.fragments[offset] for offset in sorted(self.fragments))
+
+    def abort(self):
+        self.fragments = {}
+
+
+class FileSink:
+    """
+    Writes received fragments straight to their offsets in file, so that file is never held in memory.
+    Fragments are written to partial file, that is renamed when all of them are received.
+    """
+
+    def __init__(self, path, size=0, keep=False):
+        """
+        :param path: path of received file
+        :param size: expected size of file, space for it is allocated in advance when it's known
+        :param keep: True to continue writing partial file of interrupted transfer, size has to be known
+        """
+        self.path = path
+        self.partial_path = path + ".part"
+        self.fd = os.open(self.partial_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # partial file is locked, so that stream of another client in this or another worker process
+            # doesn't write the same file at the same time
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(self.fd)
+            raise OSError(errno.EBUSY, "File is being received from another client", path)
+        if not keep:
+            os.ftruncate(self.fd, 0)
+        # data of resumed transfer are written up to size of file
+        self.end = size if keep else 0
+        if size:
+            try:
+                os.posix_fallocate(self.fd, 0, size)
+            except (AttributeError, OSError):
+                os.ftruncate(self.fd, size)
+
+    def write(self, offset, payload):
+        os.pwrite(self.fd, payload, offset)
+        self.end = max(self.end, offset + len(payload))
+
+    def finish(self):
+        """
+        Cuts off space allocated for the last fragment that was not used and renames partial file
+
+        :return: path to the file
+        """
+        os.ftruncate(self.fd, self.end)
+        # partial file is renamed while it's still locked, file stays open when renaming fails and stream is aborted
+        os.replace(self.partial_path, self.path)
+        os.close(self.fd)
+        return os.path.abspath(self.path)
+
+    def abort(self):
+        try:
+            os.remove(self.partial_path)
+        except FileNotFoundError:
+            # partial file was already renamed when closing of file failed
+            pass
+        os.close(self.fd)
+
+    def close(self):
+        """
+        Keeps partial file, so that interrupted transfer can be resumed
+        """
+        os.close(self.fd)
+
+    def chunks(self, size=COMPRESSION_CHUNK):
+        """
+        Reads data written to partial file
+
+        :param size: size of chunks
+        :return: generator of chunks of data
+        """
+        offset = 0
+        while offset < self.end:
+            data = os.pread(self.fd, min(size, self.end - offset), offset)
+            if not data:
+                break
+            yield data
+            offset += len(data)
+
+
+class Journal:
+    """
+    Bitmap of fragments that were written to partial file, kept in file next to it, so that transfer interrupted
+    by loss of connection continues where it stopped. Bitmap is written when fragments are acknowledged,
+    only bytes that changed since the last time.
+    """
+
+    # bytes of received of 8 fragments by byte of bitmap
+    EXPANDED = [bytes((byte >> (7 - bit)) & 1 for bit in range(8)) for byte in range(256)]
+
+    def __init__(self, path, identity, total):
+        """
+        :param path: path of journal
+        :param identity: size of file, fragment size, number of fragments and modification time of file on client
+        :param total: number of fragments
+        """
+        self.path = path
+        self.identity = JOURNAL_HEADER.pack(*identity)
+        self.total = total
+        self.bits = bytearray((total + 7) // 8)
+        self.fd = None
+        # bytes of bitmap that were not written yet
+        self.dirty_start = len(self.bits)
+        self.dirty_end = 0
+
+    def load(self):
+        """
+        :return: True if journal of the same file was found
+        """
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except OSError:
+            return False
+        if len(data) != len(self.identity) + len(self.bits) or not data.startswith(self.identity):
+            return False
+        self.bits[:] = data[len(self.identity):]
+        return True
+
+    def open(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.pwrite(self.fd, self.identity + self.bits, 0)
+
+    def received(self):
+        """
+        :return: bytearray with 1 on index of every fragment that was written
+        """
+        return bytearray(b"".join(self.EXPANDED[byte] for byte in self.bits)[:self.total])
+
+    def add(self, index):
+        byte = index >> 3
+        self.bits[byte] |= 0x80 >> (index & 7)
+        self.dirty_start = min(self.dirty_start, byte)
+        self.dirty_end = max(self.dirty_end, byte + 1)
+
+    def flush(self):
+        """
+        Writes bytes of bitmap that changed, data of fragments were already written to partial file
+        """
+        if self.dirty_start < self.dirty_end:
+            os.pwrite(self.fd, self.bits[self.dirty_start:self.dirty_end], len(self.identity) + self.dirty_start)
+        self.dirty_start = len(self.bits)
+        self.dirty_end = 0
+
+    def close(self):
+        self.flush()
+        os.close(self.fd)
+
+    def remove(self):
+        os.close(self.fd)
+        os.remove(self.path)
+
+
+class DecompressingSink:
+    """
+    Decompresses fragments of compressed message or file as soon as all fragments in front of them are received
+    and writes decompressed data to another sink. Fragments received out of order wait in memory,
+    there are never more of them than client keeps in flight.
+    """
+
+    def __init__(self, sink, decompressor):
+        """
+        :param sink: MemorySink or FileSink that decompressed data are written to
+        :param decompressor: streaming decompressor of compression announced by client
+        """
+        self.sink = sink
+        self.decompressor = decompressor
+        self.pending = {}
+        # offset of compressed data that is decompressed next and offset of decompressed data written next
+        self.position = 0
+        self.end = 0
+
+    def write(self, offset, payload):
+        if offset != self.position:
+            self.pending[offset] = bytes(payload)
+            return
+        while payload is not None:
+            self.position += len(payload)
+            data = self.decompressor.decompress(payload)
+            if data:
+                self.sink.write(self.end, data)
+                self.end += len(data)
+            payload = self.pending.pop(self.position, None)
+
+    def finish(self):
+        """
+        :return: what sink returns when it's finished
+        """
+        # zlib and zstd decompressors can keep the end of data until they are flushed
+        if hasattr(self.decompressor, "flush"):
+            data = self.decompressor.flush()
+            if data:
+                self.sink.write(self.end, data)
+        return self.sink.finish()
+
+    def abort(self):
+        self.sink.abort()
+
+
+class DigestSink:
+    """
+    Hashes data written to another sink in order of their offsets, so that digest of message or file
+    is computed while it's received. Data are written right away, only copies of fragments received out of order
+    wait in memory until fragments in front of them are received.
+    """
+
+    def __init__(self, sink, digest, resumed=False):
+        """
+        :param sink: MemorySink or FileSink that data are written to
+        :param digest: hash object of digest announced by client
+        :param resumed: True when sink is FileSink of resumed transfer, data received before transfer was interrupted
+                        are not received again, so partial file is hashed once it's complete
+        """
+        self.sink = sink
+        self.digest = digest
+        # digest computed by client, None until it's received
+        self.expected = None
+        self.pending = {}
+        # offset of data that are hashed next, None when data are hashed from file
+        self.position = None if resumed else 0
+
+    def write(self, offset, payload):
+        self.sink.write(offset, payload)
+        if self.position is None:
+            return
+        if offset != self.position:
+            self.pending[offset] = bytes(payload)
+            return
+        while payload is not None:
+            self.digest.update(payload)
+            self.position += len(payload)
+            payload = self.pending.pop(self.position, None)
+
+    def finish(self):
+        """
+        :return: what sink returns when it's finished, raises ValueError and aborts sink when digests differ
+        """
+        if self.position is None:
+            for chunk in self.sink.chunks():
+                self.digest.update(chunk)
+        if self.digest.digest() != self.expected:
+            self.sink.abort()
+            raise ValueError("Digest of received data does not match digest of client")
+        return self.sink.finish()
+
+    def abort(self):
+        self.sink.abort()
+
+    def close(self):
+        self.sink.close()
+
+
+def rolling_adler32(data, size):
+    """
+    Computes adler32 of every window of data at once, so that blocks can be found at any offset of file
+
+    :param data: bytes, at least size of them
+    :param size: size of window
+    :return: numpy array of adler32 of window that starts at every offset of data
+    """
+    values = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.int64)
+    # sums of values and of values multiplied by their offsets in front of every offset
+    sums = numpy.concatenate(([0], numpy.cumsum(values)))
+    weighted = numpy.concatenate(([0], numpy.cumsum(values * numpy.arange(len(values)))))
+    a = sums[size:] - sums[:-size]
+    b = (numpy.arange(len(a)) + size) * a - (weighted[size:] - weighted[:-size])
+    return (b + size) % 65521 << 16 | (a + 1) % 65521
+
+
+def find_blocks(path, block_size, size, signatures):
+    """
+    Finds blocks of file of client in file receiver already has (delta mode). Every block is looked for
+    at its own offset first, then blocks that moved are looked for at every offset by rolling weak checksum,
+    that needs numpy, receiver without it does not offer delta mode.
+
+    :param path: path to file receiver already has
+    :param block_size: size of blocks
+    :param size: size of file of client
+    :param signatures: signatures of blocks of client packed by BLOCK_SIGNATURE
+    :return: dictionary of offsets of blocks in file of receiver by their indexes
+    """
+    found = {}
+    try:
+        file = open(path, "rb")
+    except OSError:
+        return found
+    with file:
+        fd = file.fileno()
+        end = os.fstat(fd).st_size
+        moved = {}
+        for index in range(len(signatures) // BLOCK_SIGNATURE.size):
+            weak, strong = BLOCK_SIGNATURE.unpack_from(signatures, index * BLOCK_SIGNATURE.size)
+            length = min(block_size, size - index * block_size)
+            block = os.pread(fd, length, index * block_size)
+            if len(block) == length and zlib.adler32(block) == weak and \
+                    hashlib.blake2b(block, digest_size=8).digest() == strong:
+                found[index] = index * block_size
+            elif length == block_size:
+                moved.setdefault(weak, []).append((index, strong))
+
+        if numpy is None or not moved:
+            return found
+        # offsets whose weak checksum may be that of block that was not found yet are picked by table
+        # indexed by bits of weak checksums, that filters out nearly all other offsets at once.
+        # Table is built once and entry is cleared when all blocks of weak checksums of the entry are found.
+        weaks = numpy.fromiter(moved, dtype=numpy.int64, count=len(moved))
+        slots = collections.Counter(((weaks ^ weaks >> 11) & DELTA_TABLE - 1).tolist())
+        table = numpy.zeros(DELTA_TABLE, dtype=bool)
+        table[list(slots)] = True
+        offset = 0
+        while moved and offset + block_size <= end:
+            data = os.pread(fd, DELTA_CHUNK + block_size - 1, offset)
+            checksums = rolling_adler32(data, block_size)
+            for start in numpy.flatnonzero(table[(checksums ^ checksums >> 11) & DELTA_TABLE - 1]):
+                weak = int(checksums[start])
+                if weak not in moved:
+                    continue
+                strong = hashlib.blake2b(data[start:start + block_size], digest_size=8).digest()
+                remaining = []
+                for index, expected in moved[weak]:
+                    if expected == strong:
+                        found[index] = offset + start
+                    else:
+                        remaining.append((index, expected))
+                if remaining:
+                    moved[weak] = remaining
+                    continue
+                del moved[weak]
+                slot = (weak ^ weak >> 11) & DELTA_TABLE - 1
+                slots[slot] -= 1
+                if not slots[slot]:
+                    table[slot] = False
+            offset += DELTA_CHUNK
+    return found
+
+
+def safe_path(filename):
+    """
+    Turns name of received file into relative path, so that client can not write outside of current directory
+
+    :param filename: name of file with / as separator of directories
+    :return: relative path or None if nothing remains of the name
+    """
+    parts = [part for part in filename.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return os.path.join(*parts) if parts else None
+
+
+def header_path(header):
+    """
+    Reads path of file from filename fragment, the same way Stream does
+
+    :param header: filename fragment of version 5
+    :return: relative path file is saved under, None if fragment holds no valid filename
+    """
+    parsed_data = parser(header, PROTOCOL_VERSION)
+    filename = bytes(parsed_data['data'][:parsed_data['data_length']])
+    if parsed_data['flags'] & FEC_FLAG:
+        filename = filename[FEC_PARAMETERS.size:]
+    if parsed_data['flags'] & RESUME_FLAG:
+        filename = filename[RESUME_IDENTITY.size:]
+    try:
+        return safe_path(filename.decode("utf-8"))
+    except UnicodeDecodeError:
+        return None
+
+
+class Stream:
+    """
+    Message or file received from client as one stream of fragments, fragments are received in any order
+    and acknowledged selectively
+    """
+
+    def __init__(self, session, stream_id, header, version=PROTOCOL_VERSION):
+        """
+        :param session: session of client
+        :param stream_id: stream id of message or file, 0 for version 1
+        :param header: filename fragment
+        :param version: protocol version of filename fragment
+        """
+        self.session = session
+        self.id = stream_id
+        self.header = header
+        self.last_activity = self.last_ack = time.monotonic()
+        # number of acks sent in a row because client sent nothing, their timer is backed off
+        self.reminders = 0
+        parsed_data = parser(header, version)
+        self.total_fragments = parsed_data['total_n']
+        session.log(f"{self.total_fragments} fragments are going to be received.")
+
+        self.filename = None
+        filename = parsed_data['data'][:parsed_data['data_length']]
+        # flags of filename fragment hold compression of data, digest and flag of parity fragments
+        flags = parsed_data.get('flags', 0)
+        decompressor = make_decompressor(flags & COMPRESSION_MASK) if flags & COMPRESSION_MASK else None
+        algorithm = None
+        if flags & DIGEST_MASK:
+            algorithm = next((name for name, value in DIGESTS.items()
+                              if value == (flags & DIGEST_MASK) >> DIGEST_SHIFT), None)
+            if algorithm is None:
+                raise ValueError(f"Unsupported digest {(flags & DIGEST_MASK) >> DIGEST_SHIFT}")
+        self.fec = None
+        if flags & FEC_FLAG:
+            if len(filename) < FEC_PARAMETERS.size:
+                raise ValueError("Parameters of parity fragments are missing")
+            self.fec = FEC_PARAMETERS.unpack_from(filename)
+            # every parity fragment covers at least one fragment of group
+            if self.fec[0] == 0 or self.fec[1] == 0 or self.fec[1] > self.fec[0]:
+                raise ValueError(f"Invalid parameters of parity fragments {self.fec}")
+            filename = filename[FEC_PARAMETERS.size:]
+        # size of blocks and size of file whose signatures client sends in delta mode, None for other streams
+        self.delta = None
+        if parsed_data['type'] == SIGNATURES:
+            if len(filename) < DELTA_PARAMETERS.size:
+                raise ValueError("Parameters of delta mode are missing")
+            self.delta = DELTA_PARAMETERS.unpack_from(filename)
+            if self.delta[0] == 0:
+                raise ValueError("Blocks of delta mode can not be empty")
+            filename = filename[DELTA_PARAMETERS.size:]
+        modified = None
+        if flags & RESUME_FLAG:
+            if len(filename) < RESUME_IDENTITY.size:
+                raise ValueError("Identity of resumed file is missing")
+            modified = RESUME_IDENTITY.unpack_from(filename)[0]
+            filename = filename[RESUME_IDENTITY.size:]
+        # xor of received fragments and parity fragment by group and number of parity fragment
+        self.parities = {}
+        # parity fragments that were received, their fragments can be rebuilt
+        self.parity_received = set()
+        # groups below this one were received completely
+        self.complete_groups = 0
+        self.fragment_size = parsed_data['order']
+        self.size = 0
+        # journal of written fragments of file whose client asked for missing ranges, None otherwise
+        self.journal = None
+        resumed = False
+        # blocks of file that receiver already has, that client does not send in delta mode
+        found = None
+        if self.delta is not None:
+            session.log("Signatures of blocks of file are to be received.")
+            self.typ = 2
+            self.filename = filename.decode("utf-8")
+            self.path = safe_path(self.filename)
+            if self.path is None:
+                raise ValueError(f"Invalid filename {self.filename!r}")
+            self.sink = MemorySink()
+        # when data length of first fragment is 0, no filename was sent. That means that message is incoming.
+        elif not filename:
+            session.log("Message is to be received.")
+            self.typ = 1
+            self.sink = MemorySink()
+        else:
+            session.log("File is to be received")
+            self.typ = 2
+            self.filename = filename.decode("utf-8")
+            path = safe_path(self.filename)
+            if path is None:
+                raise ValueError(f"Invalid filename {self.filename!r}")
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # version 5 clients send size of file in offset of filename fragment
+            size = parsed_data['offset'] if version != LEGACY_VERSION else 0
+            if modified is not None:
+                self.journal = Journal(path + ".journal", (size, self.fragment_size, self.total_fragments, modified),
+                                       self.total_fragments)
+                # stream of another client that writes the same file was interrupted, its journal is released
+                other = session.server.receiving.get(self.journal.path)
+                if other is not None:
+                    other.session.close(other)
+                    other.suspend()
+                resumed = self.journal.load() and os.path.exists(path + ".part")
+            self.sink = FileSink(path, size, keep=resumed)
+            if self.journal is not None:
+                self.journal.open()
+                session.server.receiving[self.journal.path] = self
+                # client sent signatures of blocks of file in delta mode
+                blocks = session.blocks.pop(path, None)
+                if blocks is not None and blocks[0] == self.fragment_size:
+                    found = blocks[1]
+        # decompressed data are hashed, they are always written in order,
+        # blocks copied from file receiver already has are hashed with the rest of file once it's complete
+        self.digest = None
+        if algorithm is not None:
+            self.sink = self.digest = DigestSink(self.sink, hashlib.new(algorithm), resumed or found is not None)
+        if decompressor is not None:
+            self.sink = DecompressingSink(self.sink, decompressor)
+
+        self.received = self.journal.received() if resumed else bytearray(self.total_fragments)
+        if resumed:
+            session.log(f"{self.total_fragments - self.received.count(0)} fragments were received before "
+                        f"transfer was interrupted.")
+        if found:
+            self.copy_blocks(path, size, found)
+        # index of first fragment that was not received yet
+        self.cumulative = self.received.find(0) if self.received.find(0) != -1 else self.total_fragments
+        self.highest = self.received.rfind(1)
+        self.unacked = 0
+        self.ack_requested = False
+        if resumed or found:
+            # parity fragments cover fragments received before transfer was interrupted or copied from file
+            # receiver already has, whose data are not kept
+            self.fec = None
+
+    def copy_blocks(self, path, size, found):
+        """
+        Copies blocks of file receiver already has into partial file, client does not send them (delta mode)
+
+        :param path: path to file receiver already has
+        :param size: size of file of client
+        :param found: offsets of blocks in file of receiver by their indexes
+        """
+        sink = self.digest.sink if self.digest is not None else self.sink
+        copied = 0
+        with open(path, "rb") as file:
+            for index, offset in found.items():
+                if index >= self.total_fragments or self.received[index]:
+                    continue
+                length = min(self.fragment_size, size - index * self.fragment_size)
+                sink.write(index * self.fragment_size, os.pread(file.fileno(), length, offset))
+                self.received[index] = 1
+                self.journal.add(index)
+                copied += 1
+        self.journal.flush()
+        self.session.log(f"{copied} fragments were copied from file that is already here.")
+
+    def confirmation(self):
+        """
+        Confirmation of filename fragment, that holds ranges of missing fragments when client asked for them.
+        Ranges that do not fit into one datagram are sent as one range up to the last fragment.
+
+        :return: confirmation fragment
+        """
+        if self.journal is None:
+            return FRAGMENT_HEADER.pack(HEADER, 0, 0, self.session.id, self.id, self.total_fragments, 0, 0)
+        limit = (MAX_DATAGRAM - FRAGMENT_HEADER.size) // RANGE.size
+        ranges = []
+        start = self.received.find(0)
+        while start != -1:
+            end = self.received.find(1, start)
+            if end == -1 or len(ranges) == limit - 1:
+                end = self.total_fragments
+            ranges.append(RANGE.pack(start, end))
+            start = self.received.find(0, end)
+        data = b"".join(ranges)
+        return FRAGMENT_HEADER.pack(HEADER, RESUME_FLAG, len(data), self.session.id, self.id, self.total_fragments,
+                                    len(ranges), 0) + data
+
+    def release(self):
+        """
+        Lets another stream use journal of the same file
+        """
+        if self.journal is not None and self.session.server.receiving.get(self.journal.path) is self:
+            del self.session.server.receiving[self.journal.path]
+
+    def complete(self):
+        """
+        :return: True when all fragments and digest of client, if it's sent, were received
+        """
+        return self.cumulative == self.total_fragments and (self.digest is None or self.digest.expected is not None)
+
+    def finish(self):
+        self.session.log(f"All {self.total_fragments} fragments were received.")
+        if self.delta is not None:
+            # file whose signatures were received is expected next, nothing is reported
+            # search reads whole file, so it doesn't hold up loop of server
+            block_size, size = self.delta
+            search = self.session.server.searcher.submit(find_blocks, self.path, block_size, size, self.sink.finish())
+            self.session.searches[self.path] = (block_size, search)
+            return
+        if self.journal is not None:
+            self.release()
+            self.journal.remove()
+        try:
+            data = self.sink.finish()
+        except ValueError as error:
+            # sink was aborted, client is told that data were damaged
+            self.session.log(str(error))
+            self.session.send_verdict(self.id, False)
+            self.session.server.complete(self.session, self, None)
+            return
+        if self.digest is not None:
+            self.session.log("Digest of received data was verified.")
+            self.session.send_verdict(self.id, True)
+        self.session.server.complete(self.session, self, data)
+
+    def abort(self):
+        if self.journal is not None:
+            self.release()
+            self.journal.remove()
+        self.sink.abort()
+        self.session.server.complete(self.session, self, None)
+
+    def suspend(self):
+        """
+        Keeps partial file and its journal when client stopped sending fragments, so that client can resume transfer.
+        Streams without journal are aborted.
+        """
+        if self.journal is None:
+            self.abort()
+            return
+        self.release()
+        self.journal.close()
+        self.sink.close()
+        self.session.log(f"{self.total_fragments - self.received.count(0)} of {self.total_fragments} fragments "
+                         f"were kept, so that transfer can be resumed.")
+        self.session.server.complete(self.session, self, None)
+
+    def on_data(self, index, offset, payload, valid):
+        """
+        :return: True when all fragments of stream were received
+        """
+        self.last_activity = time.monotonic()
+        self.reminders = 0
+        # corrupted fragments are counted in crc_failures by session, they are not logged one by one
+        if not valid and self.fec is not None:
+            # corrupted fragment is rebuilt from parity fragment of its group or sent again when it can't be
+            return False
+        if not valid:
+            # corrupted fragment is reported right away, so that it does not wait for its timer
+            METRICS.nacks_sent += 1
+            self.session.send(FRAGMENT_HEADER.pack(NACK, 0, 4, self.session.id, self.id, 1, 0, 0) +
+                              struct.pack("!I", index))
+            return False
+
+        if index < self.total_fragments and not self.received[index]:
+            self.received[index] = 1
+            self.sink.write(offset, payload)
+            if self.journal is not None:
+                self.journal.add(index)
+            self.highest = max(self.highest, index)
+            while self.cumulative < self.total_fragments and self.received[self.cumulative]:
+                self.cumulative += 1
+            if self.fec is not None:
+                self.add_to_parity(index, payload)
+        self.unacked += 1
+
+        if self.cumulative == self.total_fragments:
+            self.send_ack()
+            return self.complete()
+        return False
+
+    def on_digest(self, digest, valid):
+        """
+        :param digest: digest of data computed by client
+        :param valid: checksum check result of digest fragment
+        :return: True when all fragments of stream were received
+        """
+        self.last_activity = time.monotonic()
+        self.reminders = 0
+        if self.digest is None or not valid:
+            return False
+        self.digest.expected = bytes(digest)
+        return self.complete()
+
+    def add_to_parity(self, index, payload):
+        """
+        Xors received fragment into parity of its group, so that payloads of received fragments don't have to be kept
+        """
+        size, count = self.fec
+        group, position = divmod(index, size)
+        key = (group, position % count)
+        if group >= self.complete_groups:
+            self.parities[key] = self.parities.get(key, 0) ^ int.from_bytes(payload, "little")
+            if key in self.parity_received:
+                self.rebuild(key)
+        # parities of groups received completely are not needed anymore
+        while (self.complete_groups + 1) * size <= self.cumulative:
+            for j in range(count):
+                self.parities.pop((self.complete_groups, j), None)
+                self.parity_received.discard((self.complete_groups, j))
+            self.complete_groups += 1
+
+    def on_parity(self, number, size, payload, valid):
+        """
+        :param number: number of parity fragment in stream
+        :param size: size of data of stream
+        :return: True when all fragments of stream were received
+        """
+        self.last_activity = time.monotonic()
+        self.reminders = 0
+        if self.fec is None or not valid:
+            return False
+        key = divmod(number, self.fec[1])
+        if key[0] < self.complete_groups or key in self.parity_received:
+            return False
+        self.size = size
+        self.parities[key] = self.parities.get(key, 0) ^ int.from_bytes(payload, "little")
+        self.parity_received.add(key)
+        return self.rebuild(key)
+
+    def rebuild(self, key):
+        """
+        Rebuilds fragment of group when it's the only one covered by parity fragment that is missing
+
+        :param key: group and number of parity fragment in group
+        :return: True when all fragments of stream were received
+        """
+        size, count = self.fec
+        first = key[0] * size
+        missing = [i for i in range(first + key[1], min(first + size, self.total_fragments), count)
+                   if not self.received[i]]
+        if len(missing) != 1:
+            if not missing:
+                self.parities.pop(key, None)
+                self.parity_received.discard(key)
+            return False
+        index = missing[0]
+        length = min(self.fragment_size, self.size - index * self.fragment_size)
+        # rebuilt fragment is xored into parity too, so parity is dropped once it's zero and nothing is missing
+        payload = self.parities[key].to_bytes(self.fragment_size, "little")[:length]
+        METRICS.fragments_rebuilt += 1
+        return self.on_data(index, index * self.fragment_size, payload, True)
+
+    def send_ack(self):
+        # fragments are acknowledged only when the journal knows they were written
+        if self.journal is not None:
+            self.journal.flush()
+        self.session.send(make_sack(self.cumulative, self.received, self.highest, self.session.id, self.id))
+        self.unacked = 0
+        self.ack_requested = False
+        self.last_ack = time.monotonic()
+
+    def flush(self):
+        # out of order fragments are acknowledged right away, so that client finds out about the gap
+        if self.unacked >= ACK_EVERY or self.ack_requested or (self.unacked and self.cumulative <= self.highest):
+            self.send_ack()
+
+    def on_timer(self, now):
+        """
+        :param now: current time of time.monotonic
+        :return: False when client stopped sending fragments
+        """
+        if now - self.last_activity > GIVE_UP_TIMEOUT:
+            self.session.log("Client stopped sending fragments.")
+            return False
+        if now - max(self.last_activity, self.last_ack) >= self.session.rtt.timeout(self.reminders):
+            # reminds client about missing fragments in case last ack was lost
+            self.send_ack()
+            self.reminders += 1
+        return True
+
+
+class MessageChannel:
+    """
+    Message stream of client on server side. Datagrams are delivered in order of their index, those that arrive
+    before datagrams in front of them wait, those that arrive again are dropped. Every batch of received datagrams
+    is acknowledged cumulatively by number of datagrams delivered in order.
+    """
+
+    def __init__(self, session, stream_id):
+        """
+        :param session: session of client
+        :param stream_id: stream id of message stream
+        """
+        self.session = session
+        self.id = stream_id
+        # index of the next datagram that is delivered
+        self.expected = 0
+        # data and number of messages of datagrams that arrived before the expected one by their index
+        self.early = {}
+        self.ack_requested = False
+
+    def on_datagram(self, index, count, payload):
+        """
+        :param index: index of datagram
+        :param count: number of messages in datagram
+        :param payload: memoryview of framed messages, valid only until this call returns
+        """
+        self.ack_requested = True
+        if index < self.expected or index >= self.expected + MAX_WINDOW or index in self.early:
+            return
+        if index > self.expected:
+            self.early[index] = (bytes(payload), count)
+            return
+        self.deliver(payload, count)
+        while self.expected in self.early:
+            self.deliver(*self.early.pop(self.expected))
+
+    def deliver(self, payload, count):
+        """
+        Passes messages of the expected datagram to on_message of server
+        """
+        self.expected += 1
+        position = 0
+        for _ in range(count):
+            if position + MESSAGE_LENGTH.size > len(payload):
+                break
+            size = MESSAGE_LENGTH.unpack_from(payload, position)[0]
+            position += MESSAGE_LENGTH.size
+            message = bytes(payload[position:position + size])
+            position += size
+            METRICS.messages_received += 1
+            self.session.server.on_message(self.session.address, message)
+
+    def flush(self):
+        if self.ack_requested:
+            self.session.send(FRAGMENT_HEADER.pack(MESSAGES, 0, 0, self.session.id, self.id, 0, self.expected, 0))
+            self.ack_requested = False
+
+
+class Session:
+    """
+    State of one client of server (protocol version 5). Session lives from handshake until client stops
+    sending keep alive fragments. Client sends every message or file as stream of its own,
+    many streams can be received at once.
+    """
+
+    def __init__(self, server, address, session_id, checksum=CRC16):
+        """
+        :param server: server that dispatches datagrams of client to the session
+        :param address: address of client
+        :param session_id: session id assigned to client in handshake, 0 for version 1
+        :param checksum: checksum of fragments picked in handshake, Aead of secure session
+        """
+        self.server = server
+        self.address = address
+        self.id = session_id
+        self.checksum = checksum
+        # random nonce of initial fragment of secure session, so that the same fragment sent again is recognized
+        self.nonce = None
+        self.last_activity = time.monotonic()
+        # round trip time of client, that is measured on datagrams answering replies of server
+        self.rtt = RttEstimator()
+        # time when server sent reply that client is expected to answer, handshake is answered right after session starts
+        self.replied = self.last_activity
+        # streams that are being received by their ids
+        self.streams = {}
+        # number of fragments of streams that were already received, so that late fragments can be acknowledged
+        self.finished = {}
+        # results of comparison of digests of streams that were already received, so that they can be sent again
+        self.verdicts = {}
+        # streams that received datagrams from the current batch
+        self.touched = {}
+        # blocks found in files receiver already has by their paths, with size of block,
+        # they are copied into file once client sends its filename fragment (delta mode)
+        self.blocks = {}
+        # searches for blocks that are not done yet by paths of files, with size of block
+        self.searches = {}
+        # filename fragments of files whose blocks are being searched for by stream ids, with path of file
+        self.waiting = {}
+        # message streams by their stream ids
+        self.channels = {}
+
+    def log(self, text):
+        log(self.address, text)
+
+    def send(self, data):
+        # acks are stored in headers of replies, so checksum covers whole datagram,
+        # replies of secure session are encrypted
+        self.server.send(self.checksum.seal_datagram(data), self.address)
+
+    def on_answer(self, now):
+        """
+        Measures round trip time on the first datagram that client sent after reply of server
+
+        :param now: time of arrival of datagram
+        """
+        if self.replied is not None:
+            self.rtt.on_rtt(now - self.replied)
+            self.replied = None
+
+    def on_keep_alive(self, view):
+        """
+        :param view: keep alive fragment, client sends it between transfers
+        """
+        self.last_activity = time.monotonic()
+        METRICS.keep_alives_received += 1
+
+    def send_verdict(self, stream_id, verified):
+        """
+        Tells client whether digest of its message or file matches digest of received data
+        """
+        self.verdicts[stream_id] = verified
+        self.send(FRAGMENT_HEADER.pack(DIGEST, DIGEST_MATCH if verified else 0, 0, self.id, stream_id, 0, 0, 0))
+
+    def on_datagram(self, view):
+        """
+        :param view: memoryview of datagram received from client, valid only until this call returns
+        """
+        if view[0] == HEADER or view[0] == SIGNATURES:
+            # corrupted filename fragment doesn't start stream, client sends it again on timeout
+            datagram = self.checksum.open_datagram(view)
+            if datagram is None:
+                METRICS.crc_failures += 1
+                return
+            self.last_activity = time.monotonic()
+            self.on_answer(self.last_activity)
+            self.on_header(FRAGMENT_HEADER.unpack_from(datagram)[4], memoryview(datagram))
+            return
+        typ, flags, stream_id, total_n, index, offset, payload, valid = PacketCodec.decode(view, self.checksum)
+        if not valid:
+            METRICS.crc_failures += 1
+            if self.checksum.sealed:
+                # fragment that is not authentic doesn't touch secure session, client sends it again on timeout
+                return
+        self.last_activity = time.monotonic()
+        self.on_answer(self.last_activity)
+        if typ == MESSAGES:
+            # corrupted datagram is sent again once its timer expires
+            if valid:
+                channel = self.channels.get(stream_id)
+                if channel is None:
+                    channel = self.channels[stream_id] = MessageChannel(self, stream_id)
+                channel.on_datagram(index, total_n, payload)
+                self.touched[channel] = True
+            return
+
+        if typ != DATA and typ != PARITY and typ != DIGEST:
+            return
+        stream = self.streams.get(stream_id)
+        if stream is None and typ == PARITY:
+            return
+        if stream is None and typ == DIGEST:
+            # client did not get result of comparison of digests
+            if stream_id in self.verdicts:
+                self.send_verdict(stream_id, self.verdicts[stream_id])
+            return
+        if stream is None:
+            # client did not get the last ack and sends remaining fragments again,
+            # fragments of stream whose filename fragment was not received yet are dropped
+            if stream_id in self.finished:
+                self.send(make_sack(self.finished[stream_id], b"", -1, self.id, stream_id))
+            return
+        try:
+            if typ == DATA:
+                delivered = stream.on_data(index, offset, payload, valid)
+                stream.ack_requested |= bool(flags & ACK_NOW)
+            elif typ == PARITY:
+                delivered = stream.on_parity(index, offset, payload, valid)
+            else:
+                delivered = stream.on_digest(payload, valid)
+        except SINK_ERRORS as error:
+            # data can not be decompressed or written
+            self.log(f"Stream was aborted: {error}")
+            self.close(stream)
+            stream.abort()
+            return
+        if delivered:
+            self.close(stream)
+            self.finish_stream(stream)
+        else:
+            self.touched[stream] = True
+
+    def on_header(self, stream_id, view):
+        if stream_id in self.streams:
+            # confirmation of filename fragment was lost
+            self.send(self.streams[stream_id].confirmation())
+            return
+        if stream_id in self.finished:
+            self.confirm_header(stream_id, self.finished[stream_id])
+            return
+        path = header_path(view) if self.searches and view[0] == HEADER else None
+        if path in self.searches:
+            # file is confirmed once search for its blocks is done, client waits for it meanwhile
+            self.waiting[stream_id] = (path, bytes(view))
+            self.send(FRAGMENT_HEADER.pack(HEADER, SEARCH_FLAG, 0, self.id, stream_id, 0, 0, 0))
+            return
+        try:
+            stream = Stream(self, stream_id, bytes(view))
+        except (ValueError, OSError, struct.error) as error:
+            # stream is not confirmed, client gives up on it
+            self.log(f"File can not be received: {error}")
+            return
+        self.send(stream.confirmation())
+        # empty message or file and file that was received completely before transfer was interrupted
+        if stream.complete():
+            self.finished[stream_id] = stream.total_fragments
+            self.finish_stream(stream)
+        else:
+            self.streams[stream_id] = stream
+
+    def confirm_header(self, stream_id, total_fragments):
+        # confirmation carries no filename, so that its checksum covers just its header
+        self.send(FRAGMENT_HEADER.pack(HEADER, 0, 0, self.id, stream_id, total_fragments, 0, 0))
+
+    def finish_stream(self, stream):
+        """
+        Finishes stream that was received completely, stream whose file can't be saved is aborted,
+        so that error does not reach loop of server and other clients are still served
+
+        :param stream: stream that was already closed
+        """
+        try:
+            stream.finish()
+        except SINK_ERRORS as error:
+            self.log(f"File can not be saved: {error}")
+            stream.abort()
+
+    def close(self, stream):
+        del self.streams[stream.id]
+        self.touched.pop(stream, None)
+        self.finished[stream.id] = stream.total_fragments
+
+    def abort(self):
+        # client connected again, partial files are kept for it
+        for stream in list(self.streams.values()):
+            self.close(stream)
+            stream.suspend()
+
+    def flush(self):
+        """
+        Acknowledges datagrams that were dispatched to session from one batch of received datagrams
+        """
+        for stream in self.touched:
+            stream.flush()
+        self.touched = {}
+
+    def on_timer(self, now):
+        """
+        :param now: current time of time.monotonic
+        :return: False when session expired
+        """
+        for stream in list(self.streams.values()):
+            if not stream.on_timer(now):
+                self.close(stream)
+                stream.suspend()
+        for path, (block_size, search) in list(self.searches.items()):
+            if search.done():
+                self.on_search(path, block_size, search)
+        return bool(self.streams) or now - self.last_activity <= SESSION_TIMEOUT
+
+    def on_search(self, path, block_size, search):
+        """
+        Keeps blocks found by search that is done and confirms filename fragment of file that waited for them
+
+        :param path: path to file blocks were searched for in
+        :param block_size: size of blocks
+        :param search: future of find_blocks
+        """
+        del self.searches[path]
+        try:
+            found = search.result()
+        except OSError as error:
+            self.log(f"Blocks of file {path} can not be searched for: {error}")
+            found = {}
+        self.blocks[path] = (block_size, found)
+        self.log(f"{len(found)} blocks of file {path} are already here.")
+        for stream_id, (waiting, header) in list(self.waiting.items()):
+            if waiting == path:
+                del self.waiting[stream_id]
+                self.on_header(stream_id, memoryview(header))
+
+
+class LegacySession(Session):
+    """
+    State of client of protocol version 1, that sends fragments in batches of 10 and waits for acknowledgement
+    of every batch. Its fragments carry no session id, so client is identified just by its address.
+    Received fragments are marked in bitmap of stream, so fragments of batch can arrive in any order
+    and fragments that arrive twice are dropped.
+    """
+
+    def __init__(self, server, address):
+        super().__init__(server, address, 0)
+        # the only stream, that is being received, None between transfers
+        self.stream = None
+        # indexes of fragments in order client sends them, client puts fragments of negative ack
+        # at the end of its queue, so its queue is mirrored here and next batch is known in advance
+        self.queue = collections.deque()
+        # whether fragment of current batch arrived, even corrupted, by its index and number of those that did
+        self.batch = {}
+        self.arrived = 0
+        # number of fragments of transfer that were received and written
+        self.received = 0
+        # number of batches replied in current transfer and the last reply, that is sent again when client asks for it
+        self.replies = 0
+        self.last_reply = None
+        # number of batches rejected in a row because no fragment arrived, their timer is backed off
+        self.backoff = 0
+
+    def send(self, data):
+        # acks of version 1 carry no checksum
+        self.server.send(data, self.address)
+
+    def on_datagram(self, view):
+        self.last_activity = time.monotonic()
+        self.on_answer(self.last_activity)
+        self.backoff = 0
+        if len(view) < LEGACY_FRAGMENT_HEADER.size or view[0] != DATA:
+            return
+        _, size, _, index = LEGACY_FRAGMENT_HEADER.unpack_from(view)
+        # first data fragment of every transfer carries filename, unlike other fragments it has no crc
+        if self.stream is None:
+            if len(view) == LEGACY_FRAGMENT_HEADER.size + size:
+                self.start(bytes(view))
+            return
+        # filename fragment that arrived twice and fragments that are not part of current batch are dropped
+        if index not in self.batch or view == self.stream.header:
+            return
+        self.stream.last_activity = self.last_activity
+        if self.received == 0 and self.arrived == 0:
+            self.log(f"Maximum fragment size was set to {size} by client.")
+
+        # fragment that was already written arrived twice
+        if not self.stream.received[index]:
+            payload = view[LEGACY_FRAGMENT_HEADER.size:len(view) - CRC.size]
+            if len(view) >= LEGACY_FRAGMENT_HEADER.size + CRC.size and \
+                    CRC.unpack_from(view, len(view) - CRC.size)[0] == libscrc.ibm(payload):
+                self.stream.sink.write(index * size, payload)
+                self.stream.received[index] = 1
+                self.received += 1
+            else:
+                METRICS.crc_failures += 1
+        if not self.batch[index]:
+            self.batch[index] = True
+            self.arrived += 1
+        # batch is checked once all of its fragments arrived
+        if self.arrived == len(self.batch):
+            self.review()
+
+    def start(self, header):
+        """
+        Starts receiving transfer announced by filename fragment
+
+        :param header: filename fragment
+        """
+        try:
+            self.stream = Stream(self, 0, header, LEGACY_VERSION)
+        except (ValueError, OSError, struct.error) as error:
+            self.log(f"File can not be received: {error}")
+            return
+        self.queue = collections.deque(range(self.stream.total_fragments))
+        self.received = 0
+        self.replies = 0
+        self.last_reply = None
+        self.next_batch()
+        if self.stream.total_fragments == 0:
+            self.finish()
+
+    def next_batch(self):
+        self.batch = dict.fromkeys([self.queue.popleft() for _ in range(min(10, len(self.queue)))], False)
+        self.arrived = 0
+
+    def finish(self):
+        stream, self.stream = self.stream, None
+        self.finish_stream(stream)
+
+    def abort(self):
+        if self.stream is not None:
+            stream, self.stream = self.stream, None
+            stream.abort()
+
+    def review(self):
+        failed = [i for i in self.batch if not self.stream.received[i]]
+        if len(failed) == 0:
+            # positive ack fragment is created (type 5, size and index set to 0, total holds number of batch)
+            self.reply(LEGACY_FRAGMENT_HEADER.pack(ACK, 0, 0, batch_number(self.replies)))
+        else:
+            # when there are corrupted fragments, send their ids to client so they are sent again
+            self.log(f"Batch no. {self.replies} was corrupted.")
+            self.log(f"Fragments [ {' '.join(str(i) for i in failed)} ] where corrupted or missing.")
+            self.send_nack(failed)
+
+        if self.received == self.stream.total_fragments:
+            self.finish()
+        else:
+            self.next_batch()
+
+    def send_nack(self, failed):
+        """
+        Sends negative ack (type 3, size that includes indexes stored in data, number of indexes, number of batch)
+
+        :param failed: indexes of fragments that client has to send again
+        """
+        METRICS.nacks_sent += 1
+        self.queue.extend(failed)
+        self.reply(LEGACY_FRAGMENT_HEADER.pack(NACK, len(failed) * 2, len(failed), batch_number(self.replies)) +
+                   struct.pack(f"!{len(failed)}H", *failed))
+
+    def reply(self, fragment):
+        """
+        Sends ack or negative ack of batch, round trip time is measured on the first fragment client sends after it
+
+        :param fragment: reply of batch
+        """
+        self.send(fragment)
+        self.last_reply = fragment
+        self.replies += 1
+        self.stream.last_ack = time.monotonic()
+        # replies of batch rejected more than once can't tell which of them client answered (Karn's algorithm)
+        self.replied = self.stream.last_ack if self.backoff == 0 else None
+
+    def reject_batch(self):
+        """
+        Tells client that fragments of batch that did not arrive are missing, when they stopped arriving
+        """
+        self.log(f"Batch no. {self.replies} was corrupted.")
+        self.send_nack([i for i in self.batch if not self.stream.received[i]])
+        self.next_batch()
+
+    def on_keep_alive(self, view):
+        # client numbers keep alive fragment with batch it waits reply for, 0 is sent between transfers
+        number = LEGACY_FRAGMENT_HEADER.unpack_from(view)[3] if len(view) >= LEGACY_FRAGMENT_HEADER.size else 0
+        if number == 0:
+            super().on_keep_alive(view)
+            return
+        self.last_activity = time.monotonic()
+        self.replied = None
+        if self.last_reply is not None and number == batch_number(self.replies - 1):
+            self.log("Reply of batch was lost, it's sent again.")
+            self.send(self.last_reply)
+        elif self.stream is not None and number == batch_number(self.replies):
+            # fragments of batch were lost, even the last of them
+            self.reject_batch()
+
+    def flush(self):
+        # every batch is acknowledged as soon as it's complete
+        pass
+
+    def on_timer(self, now):
+        if self.stream is not None:
+            if now - self.last_activity > GIVE_UP_TIMEOUT:
+                self.log("Client stopped sending fragments.")
+                self.abort()
+            elif self.arrived and now - max(self.last_activity, self.stream.last_ack) >= self.rtt.timeout(self.backoff):
+                # when the rest of batch does not arrive when it should, client is told which fragments are missing,
+                # client asks for reply itself when it's not answered, so nothing is sent between batches
+                self.reject_batch()
+                self.backoff += 1
+            return True
+        return now - self.last_activity <= SESSION_TIMEOUT
+
+
+class Server:
+    """
+    Receives transfers of many clients at the same time. Datagrams are read by one selector loop and dispatched
+    to session of their client, that is found by address of client and session id stored in fragment.
+    Every session is a state machine driven by its datagrams and by timer of the loop, so no thread is needed for it.
+    """
+
+    def __init__(self, sock, on_complete=report_transfer, key=None, on_message=report_message):
+        """
+        :param sock: bound socket of server
+        :param on_complete: function called with address of client, type, filename and received message
+                            or path to received file (None if transfer failed) after every transfer
+        :param key: stretched pre-shared key, only clients with the same key are served in secure sessions when set
+        :param on_message: function called with address of client and message after every message of message stream
+        """
+        self.sock = sock
+        self.on_complete = on_complete
+        self.on_message = on_message
+        self.key = key
+        # sessions by address of client and session id
+        self.sessions = {}
+        # streams that write partial files by path of their journal
+        self.receiving = {}
+        # probes of path MTU discovery can be as large as jumbo frames
+        self.io = datagram_io(sock, buffer_size=PROBE_SIZES[0])
+        self.stopped = False
+        # thread that searches for blocks of files in delta mode
+        self.searcher = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # numbers of sessions of all worker processes shared by them and index of this one,
+        # None when server runs alone
+        self.load = None
+        self.worker = 0
+
+    def send(self, data, address):
+        try:
+            self.sock.sendto(data, address)
+        except BlockingIOError:
+            # socket buffer is full, fragment is handled as lost
+            pass
+
+    def complete(self, session, stream, data):
+        if data is None:
+            METRICS.transfers_failed += 1
+        else:
+            METRICS.transfers_completed += 1
+        self.on_complete(session.address, stream.typ, stream.filename, data)
+
+    def stop(self):
+        """
+        Makes run return, can be called from another thread
+        """
+        self.stopped = True
+
+    def run(self, until_idle=True):
+        """
+        Serves clients until stop is called or until sessions of all clients that connected expire
+
+        :param until_idle: returns once sessions of all clients expire, otherwise serves until stop is called
+        """
+        self.stopped = False
+        served = False
+        next_tick = time.monotonic()
+        self.sock.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        try:
+            while not self.stopped:
+                if selector.select(SERVER_TICK):
+                    self.receive()
+                now = time.monotonic()
+                if now < next_tick:
+                    continue
+                next_tick = now + SERVER_TICK
+                for key, session in list(self.sessions.items()):
+                    if not session.on_timer(now):
+                        session.log("Time has elapsed. Client has been disconnected.")
+                        del self.sessions[key]
+                active = len(self.sessions)
+                if self.load is not None:
+                    # worker processes return together, once clients of all of them disconnect
+                    self.load[self.worker] = active
+                    active = sum(self.load)
+                    METRICS.publish()
+                served = served or active > 0
+                if until_idle and served and not active:
+                    return
+        finally:
+            selector.close()
+            self.sock.setblocking(True)
+
+    def receive(self):
+        """
+        Dispatches batch of received datagrams and lets sessions acknowledge them together
+        """
+        try:
+            datagrams = self.io.receive()
+        except (BlockingIOError, InterruptedError):
+            return
+        touched = {}
+        METRICS.packets_received += len(datagrams)
+        for view, address in datagrams:
+            METRICS.bytes_received += len(view)
+            try:
+                session = self.dispatch(view, address)
+            except (struct.error, ValueError, IndexError):
+                # malformed datagram of one client must not stop transfers of the others
+                log(address, "Malformed datagram was dropped.")
+                continue
+            if session is not None:
+                touched[session] = True
+        for session in touched:
+            session.flush()
+
+    def dispatch(self, view, address):
+        """
+        :param view: memoryview of received datagram
+        :param address: address of client
+        :return: session datagram was dispatched to, None if it was handled by server
+        """
+        if len(view) == 0:
+            return None
+        typ = view[0]
+        if typ == INIT:
+            # initial fragment that is too short to hold header is dropped
+            if len(view) >= LEGACY_FRAGMENT_HEADER.size:
+                self.handshake(bytes(view), address)
+        elif typ == PROBE:
+            # confirmation of probe of path MTU discovery holds size of probe in its offset
+            self.send(FRAGMENT_HEADER.pack(PROBE, 0, 0, 0, 0, 0, 0, len(view)), address)
+        elif typ == KEEP_ALIVE:
+            for session in self.sessions.values():
+                if session.address == address:
+                    session.on_keep_alive(view)
+        else:
+            # version 1 fragments have no session id
+            session = self.sessions.get((address, 0))
+            if session is None and len(view) >= FRAGMENT_HEADER.size:
+                session = self.sessions.get((address, FRAGMENT_HEADER.unpack_from(view)[3]))
+            if session is not None:
+                session.on_datagram(view)
+            return session
+        return None
+
+    def handshake(self, data, address):
+        """
+        Answers initial fragment of client and starts its session
+
+        :param data: initial fragment
+        :param address: address of client
+        """
+        version = negotiate_version(data)
+        nonce = None
+        if self.key is not None:
+            nonce = secure_offer(data, self.key) if version == PROTOCOL_VERSION else None
+            if nonce is None:
+                # nobody without the key can start session or end session of client by its address
+                log(address, "Client did not prove it has pre-shared key, its initial fragment was dropped.")
+                return
+            if any(session.nonce == nonce for key, session in self.sessions.items() if key[0] == address):
+                # initial fragment of running session was sent again
+                return
+
+        # client that initializes connection again from the same address does not continue in its former sessions
+        for key in [key for key in self.sessions if key[0] == address]:
+            self.sessions.pop(key).abort()
+
+        if version == LEGACY_VERSION:
+            session = LegacySession(self, address)
+            # version 1 clients expect their initial fragment echoed back
+            self.send(data, address)
+        else:
+            # random session id keeps fragments of former session from the same address out of the new one
+            session_id = 0
+            while session_id == 0:
+                session_id = int.from_bytes(os.urandom(4), "big")
+            checksum = negotiate_checksum(data)
+            features = (DELTA_FEATURE if numpy is not None else 0) | (SECURE_FEATURE if nonce else 0)
+            reply = session_id.to_bytes(4, "big") + bytes([supported_compressions(), checksum.flag, features])
+            if nonce is None:
+                session = Session(self, address, session_id, checksum)
+                reply = LEGACY_FRAGMENT_HEADER.pack(INIT, 7, 0, version) + reply
+            else:
+                # reply proves that receiver has the key as well and is bound to initial fragment of client
+                receiver_nonce = os.urandom(SECURE_NONCE)
+                reply = LEGACY_FRAGMENT_HEADER.pack(INIT, 7 + SECURE_NONCE + HANDSHAKE_MAC, 0, version) + reply + \
+                    receiver_nonce
+                client_key, receiver_key = session_keys(self.key, nonce, receiver_nonce, session_id)
+                session = Session(self, address, session_id, Aead(receiver_key, client_key, client=False))
+                session.nonce = nonce
+                reply += handshake_mac(self.key, data + reply)
+            # reply is covered by crc32, client that gets it corrupted sends initial fragment again
+            self.send(reply + CRC32.pack(zlib.crc32(reply)), address)
+        self.sessions[(address, session.id)] = session
+        secure = ", secure session" if nonce else ""
+        session.log(f"Connection initialized by client (protocol version {version}{secure})")
+
+
+def set_receive_buffer(sock, size):
+    """
+    Sets size of receive buffer of socket, datagrams that arrive while it's full are dropped by kernel.
+    Privileged process may exceed limit of system, others are limited by net.core.rmem_max.
+
+    :param sock: socket
+    :param size: requested size in bytes
+    :return: size of buffer that system actually uses, Linux doubles the requested size for its bookkeeping
+    """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, size)
+    except OSError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+
+def bind_socket(address, reuse_port=False, rcvbuf=None):
+    """
+    :param address: host and port socket is bound to
+    :param reuse_port: lets sockets of more worker processes bind the same port
+    :param rcvbuf: size of receive buffer in bytes, default of system when not set
+    :return: bound UDP socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if rcvbuf:
+            set_receive_buffer(sock, rcvbuf)
+        sock.bind(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def serve_worker(sock, on_complete, worker, load, shared, stop, key=None, on_message=report_message):
+    """
+    Serves clients in worker process until stop is set. Every worker has socket of its own bound to the same port
+    and kernel picks socket by hash of address of client, so all datagrams of one client reach the same worker.
+
+    :param sock: socket of worker bound to port of receiver
+    :param on_complete: function called after every transfer received by this worker
+    :param worker: index of worker
+    :param load: numbers of sessions of all workers shared by them
+    :param shared: metrics of all workers shared by them, that are exported by the first worker
+    :param stop: event that stops the worker
+    :param key: stretched pre-shared key of secure sessions or None
+    :param on_message: function called after every message of message stream received by this worker
+    """
+    server = Server(sock, on_complete, key, on_message)
+    server.load = load
+    server.worker = worker
+    # worker forked with metrics of its parent counts only its own transfers
+    METRICS.reset()
+    METRICS.share(shared, worker)
+    threading.Thread(target=lambda: (stop.wait(), server.stop()), daemon=True).start()
+    try:
+        server.run(until_idle=False)
+    except KeyboardInterrupt:
+        # interrupt from terminal reaches all workers, the first one stops the others
+        pass
+    finally:
+        sock.close()
+        METRICS.publish()
+
+
+class Receiver:
+    """
+    Receives messages and files of clients on UDP port without any menu. Received files are saved
+    in current directory and on_complete is called after every transfer.
+    Datagrams can be received by more worker processes, that check and write fragments on cores of their own.
+    """
+
+    def __init__(self, port, host="0.0.0.0", on_complete=report_transfer, workers=1, rcvbuf=None, psk=None,
+                 on_message=report_message):
+        """
+        :param port: port receiver listens on, 0 for any free port
+        :param host: address of interface receiver listens on
+        :param on_complete: function called with address of client, type, filename and received message
+                            or path to received file (None if transfer failed) after every transfer,
+                            it's called in worker process that received the transfer
+        :param workers: number of processes that receive datagrams, this one included
+        :param rcvbuf: size of receive buffer of every socket in bytes, default of system when not set
+        :param psk: pre-shared key as text or bytes, only clients with the same key are served when it's set
+                    and all their fragments are encrypted
+        :param on_message: function called with address of client and message after every message
+                           of message stream, in worker process that received it
+        :raise OSError: when port can not be bound or system does not support SO_REUSEPORT needed by workers
+        :raise ValueError: when psk is set but cryptography package is not installed
+        """
+        if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+            raise OSError("Worker processes need SO_REUSEPORT, that this system does not support.")
+        if psk is not None and ChaCha20Poly1305 is None:
+            raise ValueError("Secure sessions need cryptography package, install it with pip.")
+        self.key = psk_key(psk) if psk is not None else None
+        self.sock = bind_socket((host, port), workers > 1, rcvbuf)
+        self.address = self.sock.getsockname()
+        # sockets of all workers are bound right away, kernel would spread clients differently whenever
+        # another socket joined the port and datagrams of session would reach worker that doesn't know it
+        self.socks = [bind_socket(self.address, True, rcvbuf) for _ in range(1, workers)]
+        self.buffer_size = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        self.workers = workers
+        self.rcvbuf = rcvbuf
+        self.server = Server(self.sock, on_complete, self.key, on_message)
+        self.stopping = None
+
+    def serve(self, forever=False):
+        """
+        :param forever: serves until stop is called, otherwise returns once sessions of all clients that connected expire
+        """
+        if self.workers == 1:
+            self.server.run(until_idle=not forever)
+            return
+        # workers are forked, so that on_complete doesn't have to be pickled
+        context = multiprocessing.get_context("fork")
+        self.stopping = context.Event()
+        load = context.Array('i', self.workers)
+        shared = context.Array('d', self.workers * METRICS.size())
+        processes = [context.Process(target=serve_worker, args=(sock, self.server.on_complete, worker, load, shared,
+                                                                self.stopping, self.key, self.server.on_message),
+                                     daemon=True)
+                     for worker, sock in enumerate(self.socks, 1)]
+        for process in processes:
+            process.start()
+        # this process is the first worker, it exports metrics of all workers
+        self.server.load = load
+        METRICS.share(shared, 0)
+        try:
+            self.server.run(until_idle=not forever)
+        finally:
+            self.stopping.set()
+            for process in processes:
+                process.join()
+            self.server.load = None
+            METRICS.unshare()
+
+    def messages(self):
+        """
+        Serves clients in another thread and yields messages of their message streams as they arrive,
+        messages of worker processes are passed through queue. Messages are not passed to on_message then.
+
+        :return: iterator of tuples of address of client and message, it ends once stop is called
+        """
+        received = multiprocessing.get_context("fork").Queue() if self.workers > 1 else queue.Queue()
+        on_message = self.server.on_message
+        self.server.on_message = lambda address, message: received.put((address, message))
+        thread = threading.Thread(target=self.serve, kwargs=dict(forever=True), daemon=True)
+        thread.start()
+        try:
+            while True:
+                try:
+                    yield received.get(timeout=SERVER_TICK)
+                except queue.Empty:
+                    if not thread.is_alive():
+                        return
+        finally:
+            self.stop()
+            thread.join()
+            self.server.on_message = on_message
+
+    def stop(self):
+        """
+        Makes serve return, can be called from another thread
+        """
+        self.server.stop()
+        if self.stopping is not None:
+            self.stopping.set()
+
+    def close(self):
+        for sock in [self.sock] + self.socks:
+            sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def start_server():
+    """
+    Starts server, listens until files or messages of all clients are received and asks user how to continue
+
+    :return: 'Client' if user wants to act as client, None if user quits
+    """
+    answers = prompt(default_server_menu)
+    port = int(answers['port'])
+
+    with Receiver(port) as receiver:
+        # listens until connection is initialised by client
+        print(f"Listening on port {port}")
+        while True:
+            receiver.serve()
+
+            # when sessions of all clients expire show menu
+            answer = prompt(server_end_menu)['selection']
+            if answer == 'Change to client':
+                return 'Client'
+            elif answer == 'Quit':
+                return None
+
+
+def interactive():
+    """
+    Lets user choose between client and server in menus and switch between them until user quits
+    """
+    client_or_server = {
+        'type': 'list',
+        'message': 'Select if you want to act as client or server',
+        'name': 'cs',
+        'choices': ['Client', 'Server']
+    }
+
+    answer = prompt(client_or_server)['cs']
+    while answer is not None:
+        answer = start_client() if answer == 'Client' else start_server()
+
+
+def integer_in(low, high):
+    """
+    :return: type of command line argument that accepts integers from low to high
+    """
+    def convert(value):
+        if not check_if_integer(value) or not low <= int(value) <= high:
+            raise argparse.ArgumentTypeError(f"enter number in range {low}-{high}")
+        return int(value)
+    return convert
+
+
+def make_argument_parser():
+    """
+    :return: parser of command line
+    """
+    argument_parser = argparse.ArgumentParser(
+        description="Sends messages, files and directories over UDP. Menus are opened when no command is given.")
+    commands = argument_parser.add_subparsers(dest='command')
+
+    # both commands export metrics the same way
+    metrics = argparse.ArgumentParser(add_help=False)
+    metrics.add_argument('--metrics-log', metavar='PATH',
+                         help="append metrics as JSON line to file every --metrics-interval seconds, '-' for output")
+    metrics.add_argument('--metrics-interval', type=float, default=METRICS_INTERVAL, metavar='SECONDS',
+                         help=f"seconds between two lines of metrics log (default {METRICS_INTERVAL:g})")
+    metrics.add_argument('--metrics-port', type=integer_in(1, 65535), metavar='PORT',
+                         help="serve metrics in text format of Prometheus on http://HOST:PORT/metrics")
+
+    # both sides of secure session read the same pre-shared key
+    secure = argparse.ArgumentParser(add_help=False)
+    secure.add_argument('--psk-file', metavar='PATH',
+                        help="encrypt and authenticate all fragments with pre-shared key stored in file "
+                             "(needs cryptography package)")
+
+    send = commands.add_parser('send', parents=[metrics, secure],
+                               help="send message, files and directories to receiver")
+    send.add_argument('host', help="address of receiver")
+    send.add_argument('port', type=integer_in(1, 65535), help="port of receiver")
+    send.add_argument('paths', nargs='*', help="files and directories to be sent")
+    send.add_argument('-m', '--message', help="text message to be sent")
+    send.add_argument('-f', '--fragment-size', type=integer_in(0, MAX_PAYLOAD), default=0,
+                      help="maximum fragment size, 0 for path MTU discovery (default)")
+    send.add_argument('-c', '--compression', choices=['auto'] + list(COMPRESSIONS),
+                      help="compression of data, data are sent as they are by default")
+    send.add_argument('--fec', action='store_true',
+                      help=f"add {FEC_PARITY} parity fragments to every {FEC_GROUP} fragments")
+    send.add_argument('--rate-limit', type=integer_in(0, 2 ** 31), default=0,
+                      help="rate limit in kB/s, 0 for no limit (default)")
+    send.add_argument('--congestion', choices=list(CONGESTION_CONTROLLERS), default='aimd',
+                      help="congestion controller (default aimd)")
+    send.add_argument('--no-pacing', dest='pacing', action='store_false', help="send datagrams in bursts")
+    send.add_argument('--delta', action='store_true',
+                      help="send only blocks of files that receiver doesn't have in files of the same names")
+    send.add_argument('--stdin', action='store_true',
+                      help="send every line of standard input as message of message stream, "
+                           "small messages are coalesced into datagrams")
+    send.add_argument('--flush-delay', type=float, default=MESSAGE_FLUSH_DELAY, metavar='SECONDS',
+                      help="seconds message of --stdin waits for others before datagram that is not full is sent, "
+                           f"0 to send every line right away (default {MESSAGE_FLUSH_DELAY:g})")
+    send.add_argument('--legacy', action='store_true', help="use protocol version 1")
+    send.add_argument('--corrupt', action='store_true', help="corrupt some fragments to test error detection")
+
+    serve = commands.add_parser('serve', parents=[metrics, secure],
+                                help="receive messages and files, files are saved in current directory")
+    serve.add_argument('port', type=integer_in(0, 65535), help="port to listen on")
+    serve.add_argument('--host', default="0.0.0.0", help="address of interface to listen on (default all)")
+    serve.add_argument('--once', action='store_true', help="exit once sessions of all clients that connected expire")
+    serve.add_argument('-w', '--workers', type=integer_in(1, 256), default=1,
+                       help="number of processes that receive datagrams on the same port (default 1)")
+    serve.add_argument('--rcvbuf', type=integer_in(1, 2 ** 31 - 1), metavar='BYTES',
+                       help="size of receive buffer of socket, default of system when not set")
+    return argument_parser
+
+
+def read_psk(arguments):
+    """
+    :param arguments: parsed arguments of send or serve command
+    :return: pre-shared key from file given on command line without line ending, None when no file was given
+    :raise OSError: when file can not be read
+    :raise ValueError: when file is empty
+    """
+    if arguments.psk_file is None:
+        return None
+    with open(arguments.psk_file, "rb") as file:
+        psk = file.read().rstrip(b"\r\n")
+    if not psk:
+        raise ValueError(f"File {arguments.psk_file} with pre-shared key is empty.")
+    return psk
+
+
+def send_command(arguments):
+    """
+    Sends message and paths given on command line over one connection
+
+    :param arguments: parsed arguments of send command
+    :return: exit status, 0 if everything was delivered
+    """
+    global ALTERED
+    ALTERED = arguments.corrupt
+    try:
+        sender = Sender((arguments.host, arguments.port), arguments.fragment_size,
+                        version=LEGACY_VERSION if arguments.legacy else PROTOCOL_VERSION,
+                        compression=arguments.compression,
+                        fec=(FEC_GROUP, FEC_PARITY) if arguments.fec else None,
+                        rate_limit=rate_limit_of(arguments.rate_limit),
+                        congestion=arguments.congestion, pacing=arguments.pacing, delta=arguments.delta,
+                        psk=read_psk(arguments))
+    except (OSError, ValueError) as error:
+        # receiver did not respond or its address can not be resolved
+        print(error)
+        return 1
+    delivered = True
+    with sender:
+        if arguments.message is not None:
+            delivered = sender.send_message(arguments.message)
+        for path in arguments.paths:
+            if not os.path.exists(path):
+                print(f"{path} does not exist.")
+                delivered = False
+                continue
+            delivered = sender.send_path(path) and delivered
+        if arguments.stdin:
+            try:
+                with sender.open_messages(arguments.flush_delay) as messages:
+                    for line in sys.stdin.buffer:
+                        messages.send(line.rstrip(b"\r\n"))
+                delivered = messages.close() and delivered
+            except (OSError, ValueError) as error:
+                print(error)
+                delivered = False
+    return 0 if delivered else 1
+
+
+def serve_command(arguments):
+    """
+    Receives messages and files until it's interrupted or, with --once, until all clients disconnect
+
+    :param arguments: parsed arguments of serve command
+    :return: exit status
+    """
+    try:
+        receiver = Receiver(arguments.port, arguments.host, workers=arguments.workers, rcvbuf=arguments.rcvbuf,
+                            psk=read_psk(arguments))
+    except (OSError, ValueError) as error:
+        print(error)
+        return 1
+    with receiver:
+        if arguments.rcvbuf and receiver.buffer_size < arguments.rcvbuf:
+            print(f"Receive buffer was limited to {receiver.buffer_size} bytes by system (net.core.rmem_max).")
+        workers = f" with {arguments.workers} worker processes" if arguments.workers > 1 else ""
+        print(f"Listening on {receiver.address[0]}:{receiver.address[1]}{workers}")
+        try:
+            receiver.serve(forever=not arguments.once)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+def main(argv=None):
+    """
+    Starts the whole application, runs command given on command line or let's user choose between client and server
+    in menus when no command is given
+
+    :param argv: arguments of command line, sys.argv is used when not set
+    :return: exit status
+    """
+    argument_parser = make_argument_parser()
+    arguments, rest = argument_parser.parse_known_args(argv)
+    if arguments.command == 'send' and not any(argument.startswith('-') for argument in rest):
+        # paths may follow options as well
+        arguments.paths += rest
+    elif rest:
+        argument_parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    if arguments.command is None:
+        interactive()
+        return 0
+    if arguments.command == 'send' and arguments.message is None and not arguments.paths and not arguments.stdin:
+        argument_parser.error("enter message, paths or --stdin to be sent")
+
+    exporters = []
+    try:
+        if arguments.metrics_log:
+            exporters.append(MetricsLog(arguments.metrics_log, arguments.metrics_interval))
+        if arguments.metrics_port:
+            exporters.append(MetricsEndpoint(arguments.metrics_port))
+    except OSError as error:
+        print(f"Metrics can not be exported: {error}")
+        for exporter in exporters:
+            exporter.close()
+        return 1
+    try:
+        return send_command(arguments) if arguments.command == 'send' else serve_command(arguments)
+    finally:
+        for exporter in exporters:
+            exporter.close()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
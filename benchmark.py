@@ -0,0 +1,858 @@
+"""
+Loopback benchmark of the transfer protocol. Sends random data from client to server running
+in another thread on 127.0.0.1 and prints throughput of every protocol version. File transfer
+is measured as well, together with peak memory used by the process.
+
+Usage: python benchmark.py [size of data in MB]
+       python benchmark.py codec     packets per second of fragment encoding and decoding
+       python benchmark.py bulk      packets per second of one datagram per system call and sendmmsg/recvmmsg
+       python benchmark.py files     directory of small files sent file by file and as parallel streams
+       python benchmark.py compression   text and random file sent with every compression
+       python benchmark.py loss      goodput of congestion controllers with and without pacing on simulated lossy path
+       python benchmark.py delta     bytes sent for new version of file receiver already has, with and without delta mode
+       python benchmark.py secure    throughput of secure sessions encrypted by ChaCha20-Poly1305 against plain ones
+       python benchmark.py messages  small messages sent one by one and through message stream with every flush delay
+       python benchmark.py sweep [options]   file sizes and fragment sizes sent through impairment proxy,
+                                             results are appended to file (see python benchmark.py sweep -h)
+       python benchmark.py report [results file]   median throughput of every scenario by commit
+"""
+import argparse
+import collections
+import contextlib
+import filecmp
+import heapq
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import selectors
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import app
+
+
+def run_transfer(fragment_size, version, message=None, path=0, compression=None, key=None, **options):
+    """
+    Transfers message or file over loopback, received file is saved in current directory
+
+    :param fragment_size: maximum size of fragments
+    :param version: protocol version offered by client
+    :param message: text message to be transferred
+    :param path: path to file to be transferred, it's 0 if message is transferred
+    :param compression: compression used by client
+    :param key: stretched pre-shared key of secure session, None for plain session
+    :param options: other attributes of connection, like congestion or pacing
+    :return: seconds it took to deliver the message
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    result = {}
+
+    def on_complete(address, typ, filename, data):
+        result['data'] = data
+        server.stop()
+
+    server = app.Server(sock, on_complete, key)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.perf_counter()
+    connection = app.handshake(client, sock.getsockname(), version, key=key)
+    connection.compression = compression
+    for name, value in options.items():
+        setattr(connection, name, value)
+    app.transfer(connection, fragment_size, message, path)
+    thread.join()
+    elapsed = time.perf_counter() - start
+
+    client.close()
+    sock.close()
+    if path == 0:
+        delivered = result.get('data') == message
+    else:
+        delivered = result.get('data') is not None and filecmp.cmp(path, result['data'], shallow=False)
+    if not delivered:
+        raise RuntimeError(f"Data transferred with protocol version {version} do not match")
+    return elapsed
+
+
+def peak_memory():
+    """
+    :return: peak resident set size of this process in MB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rate(function, count):
+    """
+    :param function: function that is called count times
+    :param count: number of calls
+    :return: calls per second
+    """
+    start = time.perf_counter()
+    for i in range(count):
+        function(i)
+    return count / (time.perf_counter() - start)
+
+
+def benchmark_codec(count=200000):
+    """
+    Compares fragments built by concatenation and parsed by slicing with PacketCodec with every checksum,
+    measures computation of parity fragments and digests as well
+    """
+    fragment_size = app.MAX_DATAGRAM - app.FRAGMENT_HEADER.size - app.CRC.size
+    message = os.urandom(fragment_size * 64)
+    view = memoryview(message)
+    codec = app.PacketCodec(fragment_size)
+
+    def encode_bytes(i):
+        start = (i % 64) * fragment_size
+        app.make_fragment(message[start:start + fragment_size], fragment_size, 64, i, app.PROTOCOL_VERSION)
+
+    def encode_codec(i):
+        start = (i % 64) * fragment_size
+        codec.encode(app.DATA, 64, i, start, view[start:start + fragment_size])
+
+    def decode_codec(i):
+        return app.PacketCodec.decode(received, codec.checksum)
+
+    fragment = app.make_fragment(message[:fragment_size], fragment_size, 64, 0, app.PROTOCOL_VERSION)
+    buffer = bytearray(2048)
+    buffer[:len(fragment)] = fragment
+    received = memoryview(buffer)[:len(fragment)]
+
+    def decode_bytes(i):
+        data = bytes(buffer[:len(fragment)])
+        app.parser(data, app.PROTOCOL_VERSION)
+        payload = data[app.FRAGMENT_HEADER.size:len(data) - 2]
+        return int.from_bytes(data[len(data) - 2:], "big") == app.libscrc.ibm(payload) and bytes(payload)
+
+    print(f"{'encode bytes':<20} {rate(encode_bytes, count):12,.0f} packets/s")
+    print(f"{'decode bytes':<20} {rate(decode_bytes, count):12,.0f} packets/s")
+    for name, flag in app.CHECKSUMS.items():
+        if not app.supported_checksums() & (1 << flag):
+            print(f"{'codec ' + name:<20} not available")
+            continue
+        codec = app.PacketCodec(fragment_size, checksum=app.Checksum(flag))
+        fragment = b"".join(bytes(buffer) for buffer in codec.encode(app.DATA, 64, 0, 0, view[:fragment_size]))
+        buffer[:len(fragment)] = fragment
+        received = memoryview(buffer)[:len(fragment)]
+        print(f"{'encode codec ' + name:<20} {rate(encode_codec, count):12,.0f} packets/s")
+        print(f"{'decode codec ' + name:<20} {rate(decode_codec, count):12,.0f} packets/s")
+
+    # digests of whole message or file are computed once per fragment on both ends
+    for name in app.DIGESTS:
+        digest = app.hashlib.new(name)
+
+        def update_digest(i):
+            start = (i % 64) * fragment_size
+            digest.update(view[start:start + fragment_size])
+
+        print(f"{'digest ' + name:<20} {rate(update_digest, count):12,.0f} packets/s")
+
+    # parity of group of FEC_GROUP fragments, throughput is measured in data fragments covered by parity
+    payloads = [view[i * fragment_size:(i + 1) * fragment_size] for i in range(app.FEC_GROUP)]
+
+    def encode_parity(i):
+        app.xor_payloads(payloads, fragment_size)
+
+    groups = rate(encode_parity, count // app.FEC_GROUP)
+    print(f"{'parity':<20} {groups * app.FEC_GROUP:12,.0f} packets/s "
+          f"({'numpy' if app.numpy is not None else 'python integers'})")
+
+
+def benchmark_bulk(count=200000, size=20):
+    """
+    Compares DatagramIO and MultiDatagramIO, first by sending fragments to socket nobody reads from,
+    then by transferring message of size MB (best of three)
+    """
+    fragments = app.FragmentSource(0, message=bytearray(os.urandom(1024 * 1024)))
+    indexes = [i % len(fragments) for i in range(count)]
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    message = os.urandom(size * 1024 * 1024)
+    app.ALTERED = False
+    app.MISSING = False
+
+    for name, io_class in (("per datagram", app.DatagramIO), ("sendmmsg/recvmmsg", app.MultiDatagramIO)):
+        if io_class is app.MultiDatagramIO and not io_class.available(sink):
+            print(f"{name:<20} not available")
+            continue
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        datagram_io = io_class(sock)
+        start = time.perf_counter()
+        for i in range(0, count, app.BATCH_SIZE):
+            datagram_io.send_fragments(fragments, indexes[i:i + app.BATCH_SIZE], sink.getsockname())
+        sent = count / (time.perf_counter() - start)
+        sock.close()
+
+        app.BULK_IO = io_class is app.MultiDatagramIO
+        # best of three transfers, a single retransmission timeout on loopback outweighs the difference
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed = min(run_transfer(0, app.PROTOCOL_VERSION, message=message) for _ in range(3))
+        print(f"{name:<20} {sent:12,.0f} packets/s sent, transfer {size / elapsed:8.2f} MB/s")
+    sink.close()
+
+
+def benchmark_files(count=1000):
+    """
+    Compares directory of count small files sent like send does it, with one handshake and transfer per file,
+    and sent by transfer_directory as parallel streams of one connection
+    """
+    app.ALTERED = False
+    app.MISSING = False
+    with tempfile.TemporaryDirectory() as source:
+        directory = os.path.join(source, "files")
+        os.mkdir(directory)
+        for i in range(count):
+            with open(os.path.join(directory, f"{i}.bin"), "wb") as file:
+                file.write(os.urandom(512 + i * 7919 % 8192))
+        files = app.list_directory(directory)
+
+        def sequential(client, address):
+            for path, name in files:
+                connection = app.handshake(client, address)
+                app.transfer(connection, 0, None, path)
+
+        def parallel(client, address):
+            app.transfer_directory(app.handshake(client, address), 0, directory)
+
+        for name, send in (("file by file", sequential), ("parallel streams", parallel)):
+            with tempfile.TemporaryDirectory() as destination:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind(("127.0.0.1", 0))
+                received = []
+
+                def on_complete(address, typ, filename, data):
+                    received.append(data)
+                    if len(received) == count:
+                        server.stop()
+
+                server = app.Server(sock, on_complete)
+                cwd = os.getcwd()
+                os.chdir(destination)
+                try:
+                    thread = threading.Thread(target=server.run, daemon=True)
+                    thread.start()
+                    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        send(client, sock.getsockname())
+                        thread.join()
+                    elapsed = time.perf_counter() - start
+                    client.close()
+                    sock.close()
+                    prefix = "" if send is sequential else "files"
+                    delivered = all(filecmp.cmp(path, os.path.join(prefix, *relative.split("/")), shallow=False)
+                                    for path, relative in files)
+                finally:
+                    os.chdir(cwd)
+            if not delivered:
+                raise RuntimeError(f"Files transferred {name} do not match")
+            print(f"{name:<20} {count / elapsed:8.0f} files/s ({elapsed:.2f} s)")
+
+
+def benchmark_compression(size=20):
+    """
+    Transfers text file (CSV export) and random file of size MB with every compression, prints how many bytes
+    were sent and throughput of data before compression
+    """
+    app.ALTERED = False
+    app.MISSING = False
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as destination:
+        text = os.path.join(source, "export.csv")
+        with open(text, "wb") as file:
+            i = 0
+            while file.tell() < size * 1024 * 1024:
+                file.write(b"".join(b"%d,customer%d,%.2f,2020-11-%02d\n" % (j, j % 977, j * 0.37, j % 30 + 1)
+                                    for j in range(i, i + 10000)))
+                i += 10000
+        random = os.path.join(source, "random.bin")
+        with open(random, "wb") as file:
+            file.write(os.urandom(size * 1024 * 1024))
+
+        cwd = os.getcwd()
+        os.chdir(destination)
+        try:
+            for path in (text, random):
+                original = os.path.getsize(path)
+                for compression in (None, "auto") + tuple(app.COMPRESSIONS):
+                    if compression == "zstd" and app.zstandard is None:
+                        continue
+                    connection = app.Connection(None, None, app.PROTOCOL_VERSION)
+                    connection.compression = compression
+                    connection.compressions = app.supported_compressions()
+                    with open(path, "rb") as file:
+                        flag = app.choose_compression(connection, file.read(app.COMPRESSION_CHUNK))
+                    sent = original
+                    if flag:
+                        with app.compress_file(path, flag) as spool:
+                            sent = os.fstat(spool.fileno()).st_size
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        elapsed = run_transfer(0, app.PROTOCOL_VERSION, path=path, compression=compression)
+                    print(f"{os.path.basename(path):<12} {str(compression):<6} {sent / original:6.1%} sent, "
+                          f"{original / 1024 / 1024 / elapsed:8.2f} MB/s ({elapsed:.2f} s)")
+        finally:
+            os.chdir(cwd)
+
+
+def benchmark_loss(size=10):
+    """
+    Transfers message of size MB over path simulated by LossSimulator with random loss and with bottleneck
+    that drops bursts, prints goodput of every congestion controller with and without pacing
+    """
+    app.ALTERED = False
+    app.MISSING = False
+    message = os.urandom(size * 1024 * 1024)
+    paths = (("loss 1%", dict(loss=0.01)),
+             ("loss 1%, rtt 10 ms", dict(loss=0.01, delay=0.01)),
+             ("loss 5%", dict(loss=0.05)),
+             ("bottleneck 20 MB/s", dict(rate=20e6, buffer=64 * 1024)),
+             ("bottleneck, rtt 10 ms", dict(rate=20e6, buffer=64 * 1024, delay=0.01)),
+             ("bottleneck + loss 1%", dict(rate=20e6, buffer=64 * 1024, loss=0.01)))
+    try:
+        for name, parameters in paths:
+            for congestion in app.CONGESTION_CONTROLLERS:
+                for pacing in (False, True):
+                    app.SIMULATOR = app.LossSimulator(seed=1, **parameters)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        elapsed = run_transfer(0, app.PROTOCOL_VERSION, message=message, congestion=congestion,
+                                               pacing=pacing)
+                    print(f"{name:<22} {congestion:<7} {'paced' if pacing else 'bursts':<7} "
+                          f"{size / elapsed:8.2f} MB/s, {app.SIMULATOR.lost:6} fragments lost")
+    finally:
+        app.SIMULATOR = None
+
+
+def benchmark_delta(size=50):
+    """
+    Transfers new version of file of size MB to receiver that has the previous version, that differs by inserted
+    and changed data, prints how many bytes were sent and time with and without delta mode
+    """
+    app.ALTERED = False
+    app.MISSING = False
+    previous = os.urandom(size * 1024 * 1024)
+    middle = len(previous) // 2
+    # data inserted in the middle move the rest of file, some data at the end are changed
+    current = previous[:middle] + b"inserted" * 128 + previous[middle:-100000] + os.urandom(5000) + \
+        previous[-95000:]
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as destination:
+        path = os.path.join(source, "build.bin")
+        with open(path, "wb") as file:
+            file.write(current)
+        cwd = os.getcwd()
+        os.chdir(destination)
+        try:
+            for delta in (False, True):
+                with open("build.bin", "wb") as file:
+                    file.write(previous)
+                sent = app.METRICS.bytes_sent
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed = run_transfer(0, app.PROTOCOL_VERSION, path=path, delta=delta)
+                sent = app.METRICS.bytes_sent - sent
+                print(f"{'delta' if delta else 'whole file':<10} {sent:>12} bytes sent, {sent / len(current):8.3%} "
+                      f"of file ({elapsed:.2f} s)")
+        finally:
+            os.chdir(cwd)
+
+
+def benchmark_secure(size=50, repeat=3, count=100000):
+    """
+    Compares secure sessions with plain ones: packets per second of encoding and decoding of fragments
+    with the strongest checksum and with AEAD, and median throughput of transfer of file of size MB
+    """
+    if app.ChaCha20Poly1305 is None:
+        print("Secure sessions need cryptography package, install it with pip.")
+        return
+    app.ALTERED = False
+    app.MISSING = False
+    key = app.psk_key(b"benchmark")
+    fragment_size = app.MAX_DATAGRAM - app.FRAGMENT_HEADER.size - app.AEAD_TAG
+    payload = memoryview(os.urandom(fragment_size))
+    checksums = (("plain", app.negotiate_checksum(app.make_handshake()), app.negotiate_checksum(app.make_handshake())),
+                 ("secure", app.Aead(key, key), app.Aead(key, key, client=False)))
+    for name, checksum, receiving in checksums:
+        codec = app.PacketCodec(fragment_size, 1, 1, checksum)
+        fragment = memoryview(b"".join(codec.encode(app.DATA, count, 0, 0, payload)))
+        encoded = rate(lambda i: codec.encode(app.DATA, count, i, i * fragment_size, payload), count)
+        decoded = rate(lambda i: app.PacketCodec.decode(fragment, receiving), count)
+        print(f"{name:<8} encode {encoded:10.0f} packets/s, decode {decoded:10.0f} packets/s")
+
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as destination:
+        path = os.path.join(source, "secure.bin")
+        with open(path, "wb") as file:
+            file.write(os.urandom(size * 1024 * 1024))
+        cwd = os.getcwd()
+        os.chdir(destination)
+        try:
+            throughput = {}
+            for name, secure in (("plain", None), ("secure", key)):
+                times = []
+                for _ in range(repeat):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        times.append(run_transfer(0, app.PROTOCOL_VERSION, path=path, key=secure))
+                throughput[name] = size / statistics.median(times)
+                print(f"{name:<8} {throughput[name]:8.2f} MB/s (median of {repeat} transfers of {size} MB)")
+            print(f"secure sessions cost {1 - throughput['secure'] / throughput['plain']:.1%} of throughput")
+        finally:
+            os.chdir(cwd)
+
+
+def benchmark_messages(count=100000, size=32, single=200):
+    """
+    Compares small messages sent one by one as transfers of their own with message stream that coalesces them
+    into datagrams, for every flush delay. Prints messages per second and datagrams sent per message.
+    """
+    received = []
+    with app.Receiver(0, "127.0.0.1", on_message=lambda address, message: received.append(message),
+                      on_complete=lambda address, typ, filename, data: received.append(data)) as receiver:
+        thread = threading.Thread(target=receiver.serve, kwargs=dict(forever=True), daemon=True)
+        thread.start()
+        message = os.urandom(size)
+        with contextlib.redirect_stdout(io.StringIO()), app.Sender(receiver.address) as sender:
+            sender.prepare()
+            results = []
+            start = time.perf_counter()
+            for _ in range(single):
+                sender.send_message(message)
+            results.append(("send_message", single, time.perf_counter() - start, None))
+            for delay in (0, 0.001, app.MESSAGE_FLUSH_DELAY, 0.05):
+                sent = app.METRICS.packets_sent
+                start = time.perf_counter()
+                with sender.open_messages(delay) as stream:
+                    for _ in range(count):
+                        stream.send(message)
+                results.append((f"stream, flush delay {delay:g} s", count, time.perf_counter() - start,
+                                app.METRICS.packets_sent - sent))
+        receiver.stop()
+        thread.join()
+    if len(received) != single + 4 * count:
+        raise RuntimeError("Some messages were not delivered")
+    for name, n, elapsed, datagrams in results:
+        datagrams = f", {datagrams / n:.3f} datagrams per message" if datagrams is not None else ""
+        print(f"{name:<28} {n / elapsed:10.0f} messages/s{datagrams}")
+
+
+class ImpairmentProxy:
+    """
+    UDP proxy between clients and receiver, that impairs datagrams in both directions like netem does:
+    drops, reorders, duplicates and corrupts them, delays them and limits bandwidth of path with queue
+    that drops datagrams which overflow it. Every client gets socket of its own towards receiver,
+    so that receiver tells clients apart by address.
+    """
+
+    def __init__(self, upstream, loss=0.0, reorder=0.0, duplicate=0.0, corrupt=0.0, delay=0.0, jitter=0.0,
+                 rate=None, buffer=64 * 1024, reorder_delay=0.002, seed=None):
+        """
+        :param upstream: address of receiver
+        :param loss: probability that datagram is dropped
+        :param reorder: probability that datagram is held back by reorder_delay, so that next datagrams overtake it
+        :param duplicate: probability that datagram is delivered twice
+        :param corrupt: probability that one byte of datagram behind the header of version 1 is changed
+        :param delay: seconds every datagram is delayed by
+        :param jitter: datagrams are delayed by random number of seconds up to jitter on top of delay
+        :param rate: bytes per second of path in every direction, None for no limit
+        :param buffer: size of queue of path in bytes, datagrams that don't fit are dropped
+        :param reorder_delay: seconds reordered datagram is held back by
+        :param seed: seed of random generator, so that runs can be repeated
+        """
+        self.upstream = upstream
+        self.loss = loss
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.corrupt = corrupt
+        self.delay = delay
+        self.jitter = jitter
+        self.rate = rate
+        self.buffer = buffer
+        self.reorder_delay = reorder_delay
+        self.random = random.Random(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        # socket towards receiver by address of client and address of client by socket
+        self.links = {}
+        self.clients = {}
+        # time when bandwidth limited path of every direction is free again
+        self.free = {"forward": 0.0, "backward": 0.0}
+        # datagrams waiting for their time ordered by it
+        self.queue = []
+        self.sequence = 0
+        self.stats = collections.Counter()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+
+    def link(self, client):
+        sock = self.links.get(client)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", 0))
+            sock.setblocking(False)
+            self.links[client] = sock
+            self.clients[sock] = client
+            self.selector.register(sock, selectors.EVENT_READ)
+        return sock
+
+    def impair(self, direction, data, sock, address, now):
+        """
+        Decides fate of datagram and schedules its delivery
+
+        :param direction: 'forward' from client to receiver, 'backward' from receiver to client
+        :param data: datagram
+        :param sock: socket datagram is sent from
+        :param address: address datagram is sent to
+        :param now: time of arrival of datagram
+        """
+        self.stats[f"{direction}_packets"] += 1
+        if self.random.random() < self.loss:
+            self.stats[f"{direction}_lost"] += 1
+            return
+        due = now
+        if self.rate is not None:
+            start = max(now, self.free[direction])
+            if (start - now) * self.rate + len(data) > self.buffer:
+                self.stats[f"{direction}_overflowed"] += 1
+                return
+            self.free[direction] = due = start + len(data) / self.rate
+        due += self.delay + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if self.random.random() < self.reorder:
+            self.stats[f"{direction}_reordered"] += 1
+            due += self.reorder_delay
+        if self.random.random() < self.corrupt and len(data) > app.LEGACY_FRAGMENT_HEADER.size:
+            self.stats[f"{direction}_corrupted"] += 1
+            data = bytearray(data)
+            data[self.random.randrange(app.LEGACY_FRAGMENT_HEADER.size, len(data))] ^= 0xff
+        copies = 1
+        if self.random.random() < self.duplicate:
+            self.stats[f"{direction}_duplicated"] += 1
+            copies = 2
+        for _ in range(copies):
+            self.sequence += 1
+            heapq.heappush(self.queue, (due, self.sequence, sock, bytes(data), address))
+
+    def run(self, stop):
+        """
+        Forwards datagrams until stop is set
+
+        :param stop: threading or multiprocessing Event
+        """
+        while not stop.is_set():
+            timeout = 0.05 if not self.queue else min(max(self.queue[0][0] - time.monotonic(), 0), 0.05)
+            for key, _ in self.selector.select(timeout):
+                sock = key.fileobj
+                while True:
+                    try:
+                        data, address = sock.recvfrom(65535)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    now = time.monotonic()
+                    if sock is self.sock:
+                        self.impair("forward", data, self.link(address), self.upstream, now)
+                    else:
+                        self.impair("backward", data, self.sock, self.clients[sock], now)
+            now = time.monotonic()
+            while self.queue and self.queue[0][0] <= now:
+                _, _, sock, data, address = heapq.heappop(self.queue)
+                try:
+                    sock.sendto(data, address)
+                except (BlockingIOError, ConnectionRefusedError):
+                    self.stats["send_failed"] += 1
+
+    def close(self):
+        self.selector.close()
+        for sock in [self.sock] + list(self.links.values()):
+            sock.close()
+
+
+def usage(since=None):
+    """
+    :param since: usage returned earlier, CPU time spent before it is not counted
+    :return: CPU seconds and peak resident set size in MB of this process
+    """
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = rusage.ru_utime + rusage.ru_stime
+    return {"cpu": cpu - (since["cpu"] if since else 0), "rss_mb": rusage.ru_maxrss / 1024}
+
+
+def receiver_process(directory, receiver_options, ready, stop, results):
+    """
+    Receives files into directory until stop is set, runs in process of its own
+    """
+    os.chdir(directory)
+    sys.stdout = open(os.devnull, "w")
+    app.ALTERED = False
+    # CPU time of starting the interpreter and importing modules is not counted
+    started = usage()
+    completed = []
+    receiver = app.Receiver(0, "127.0.0.1", on_complete=lambda address, typ, filename, data: completed.append(data),
+                            **receiver_options)
+    ready.put(receiver.address)
+    threading.Thread(target=lambda: (stop.wait(), receiver.stop()), daemon=True).start()
+    receiver.serve(forever=True)
+    receiver.close()
+    results.put(("receiver", dict(usage(started), transfers=len(completed),
+                                  packets_received=app.METRICS.packets_received,
+                                  crc_failures=app.METRICS.crc_failures)))
+
+
+def proxy_process(upstream, impairments, ready, stop, results):
+    """
+    Runs ImpairmentProxy in process of its own until stop is set
+    """
+    started = usage()
+    proxy = ImpairmentProxy(upstream, **impairments)
+    ready.put(proxy.address)
+    proxy.run(stop)
+    proxy.close()
+    results.put(("proxy", dict(usage(started), **proxy.stats)))
+
+
+def sender_process(address, path, fragment_size, version, options, results):
+    """
+    Sends file to receiver, runs in process of its own
+    """
+    sys.stdout = open(os.devnull, "w")
+    app.ALTERED = False
+    app.MISSING = False
+    started = usage()
+    start = time.perf_counter()
+    try:
+        with app.Sender(address, fragment_size, version=version, **options) as sender:
+            delivered = sender.send_file(path)
+    except ConnectionError:
+        delivered = False
+    elapsed = time.perf_counter() - start
+    results.put(("sender", dict(usage(started), elapsed=elapsed, delivered=delivered,
+                                packets_sent=app.METRICS.packets_sent, bytes_sent=app.METRICS.bytes_sent,
+                                retransmits=app.METRICS.retransmits)))
+
+
+def run_scenario(size, fragment_size, version=app.PROTOCOL_VERSION, impairments=None, options=None,
+                 receiver_options=None, timeout=600):
+    """
+    Sends random file of size MB from sender to receiver, both in processes of their own, through
+    impairment proxy in process of its own, so that CPU time and memory of every role are measured apart
+
+    :param size: size of file in MB
+    :param fragment_size: maximum size of fragments, 0 for path MTU discovery
+    :param version: protocol version offered by sender
+    :param impairments: parameters of ImpairmentProxy, None to send datagrams straight to receiver
+    :param options: options of Sender, like congestion, pacing, compression or fec
+    :param receiver_options: options of Receiver, like workers or rcvbuf
+    :param timeout: seconds after which transfer is considered failed
+    :return: dictionary with result of every role, throughput and whether received file matches
+    """
+    context = multiprocessing.get_context("spawn")
+    ready, results, stop = context.Queue(), context.Queue(), context.Event()
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as destination:
+        path = os.path.join(source, "benchmark.bin")
+        with open(path, "wb") as file:
+            for _ in range(int(size * 1024)):
+                file.write(os.urandom(1024))
+
+        processes = [context.Process(target=receiver_process,
+                                         args=(destination, receiver_options or {}, ready, stop, results))]
+        processes[0].start()
+        address = ready.get(timeout=30)
+        if impairments is not None:
+            processes.append(context.Process(target=proxy_process, args=(address, impairments, ready, stop, results)))
+            processes[-1].start()
+            address = ready.get(timeout=30)
+        sender = context.Process(target=sender_process,
+                                 args=(address, path, fragment_size, version, options or {}, results))
+        sender.start()
+        sender.join(timeout)
+        if sender.is_alive():
+            sender.terminate()
+            sender.join()
+
+        stop.set()
+        record = {}
+        for _ in range(len(processes) + (sender.exitcode == 0)):
+            role, result = results.get(timeout=30)
+            record[role] = result
+        for process in processes:
+            process.join()
+        received = os.path.join(destination, "benchmark.bin")
+        record["delivered"] = record.get("sender", {}).get("delivered", False) and os.path.exists(received) and \
+            filecmp.cmp(path, received, shallow=False)
+    elapsed = record.get("sender", {}).get("elapsed")
+    record["throughput_mb_s"] = size / elapsed if record["delivered"] else 0.0
+    return record
+
+
+def current_commit():
+    """
+    :return: short hash of commit of working tree with -dirty suffix when it has changes, None outside of git
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=directory, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=directory,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def benchmark_sweep(argv):
+    """
+    Sends files of every size with every fragment size through impairment proxy and appends result
+    of every run as JSON line to results file, so that later changes can be compared with it
+
+    :param argv: arguments of command line after sweep
+    """
+    argument_parser = argparse.ArgumentParser(prog="benchmark.py sweep")
+    argument_parser.add_argument("--sizes", default="1,10", help="sizes of files in MB separated by commas")
+    argument_parser.add_argument("--fragment-sizes", default="0,500,1400",
+                                 help="maximum fragment sizes separated by commas, 0 for path MTU discovery")
+    argument_parser.add_argument("--repeat", type=int, default=1, help="runs of every combination")
+    argument_parser.add_argument("--version", type=int, choices=(app.LEGACY_VERSION, app.PROTOCOL_VERSION),
+                                 default=app.PROTOCOL_VERSION, help="protocol version offered by sender")
+    argument_parser.add_argument("--loss", type=float, default=0.0, help="probability that datagram is dropped")
+    argument_parser.add_argument("--reorder", type=float, default=0.0, help="probability that datagram is reordered")
+    argument_parser.add_argument("--duplicate", type=float, default=0.0,
+                                 help="probability that datagram is duplicated")
+    argument_parser.add_argument("--corrupt", type=float, default=0.0, help="probability that datagram is corrupted")
+    argument_parser.add_argument("--delay", type=float, default=0.0, help="one way delay in seconds")
+    argument_parser.add_argument("--jitter", type=float, default=0.0, help="random delay up to this many seconds")
+    argument_parser.add_argument("--rate", type=float, help="bandwidth of path in bytes per second")
+    argument_parser.add_argument("--buffer", type=int, default=64 * 1024, help="queue of path in bytes")
+    argument_parser.add_argument("--direct", action="store_true", help="send straight to receiver without proxy")
+    argument_parser.add_argument("--congestion", choices=list(app.CONGESTION_CONTROLLERS), default="aimd")
+    argument_parser.add_argument("--no-pacing", dest="pacing", action="store_false")
+    argument_parser.add_argument("--compression", choices=list(app.COMPRESSIONS))
+    argument_parser.add_argument("--fec", action="store_true", help="send parity fragments")
+    argument_parser.add_argument("--workers", type=int, default=1, help="worker processes of receiver")
+    argument_parser.add_argument("--rcvbuf", type=int, help="receive buffer of receiver in bytes")
+    argument_parser.add_argument("--seed", type=int, default=1, help="seed of random generator of proxy")
+    argument_parser.add_argument("--results", default="benchmark-results.jsonl", help="file results are appended to")
+    arguments = argument_parser.parse_args(argv)
+
+    impairments = None
+    if not arguments.direct:
+        impairments = dict(loss=arguments.loss, reorder=arguments.reorder, duplicate=arguments.duplicate,
+                           corrupt=arguments.corrupt, delay=arguments.delay, jitter=arguments.jitter,
+                           rate=arguments.rate, buffer=arguments.buffer, seed=arguments.seed)
+    options = dict(congestion=arguments.congestion, pacing=arguments.pacing, compression=arguments.compression,
+                   fec=(app.FEC_GROUP, app.FEC_PARITY) if arguments.fec else None)
+    receiver_options = dict(workers=arguments.workers, rcvbuf=arguments.rcvbuf)
+    environment = dict(commit=current_commit(), python=platform.python_version(), platform=platform.platform())
+
+    print(f"{'MB':>6} {'fragment':>8} {'MB/s':>8} {'sender cpu':>10} {'receiver cpu':>12} "
+          f"{'sender rss':>10} {'receiver rss':>12} {'resent':>7}")
+    with open(arguments.results, "a") as results:
+        for size in (float(value) for value in arguments.sizes.split(",")):
+            for fragment_size in (int(value) for value in arguments.fragment_sizes.split(",")):
+                for _ in range(arguments.repeat):
+                    record = run_scenario(size, fragment_size, arguments.version, impairments, options,
+                                          receiver_options)
+                    scenario = dict(size_mb=size, fragment_size=fragment_size, version=arguments.version,
+                                    impairments=impairments, options=options, receiver=receiver_options)
+                    results.write(json.dumps(dict(environment, time=time.time(), scenario=scenario, **record)) + "\n")
+                    results.flush()
+                    sender = record.get("sender", {})
+                    receiver = record.get("receiver", {})
+                    print(f"{size:6g} {fragment_size:8} {record['throughput_mb_s']:8.2f} "
+                          f"{sender.get('cpu', 0):9.2f}s {receiver.get('cpu', 0):11.2f}s "
+                          f"{sender.get('rss_mb', 0):8.1f}MB {receiver.get('rss_mb', 0):10.1f}MB "
+                          f"{sender.get('retransmits', 0):7}" + ("" if record["delivered"] else "  not delivered"))
+
+
+def benchmark_report(path="benchmark-results.jsonl"):
+    """
+    Prints median throughput and CPU time of sender of every scenario of results file by commit
+
+    :param path: results file written by sweep
+    """
+    runs = collections.defaultdict(list)
+    with open(path) as results:
+        for line in results:
+            record = json.loads(line)
+            runs[(json.dumps(record["scenario"], sort_keys=True), record["commit"])].append(record)
+    scenario = None
+    for (key, commit), records in sorted(runs.items(), key=lambda item: (item[0][0], item[1][0]["time"])):
+        if key != scenario:
+            scenario = key
+            print(scenario)
+        throughput = statistics.median(record["throughput_mb_s"] for record in records)
+        cpu = statistics.median(record.get("sender", {}).get("cpu", 0) for record in records)
+        print(f"    {str(commit):<16} {throughput:8.2f} MB/s, sender cpu {cpu:.2f} s ({len(records)} runs)")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "sweep":
+        benchmark_sweep(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "report":
+        benchmark_report(*sys.argv[2:3])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "codec":
+        benchmark_codec()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "bulk":
+        benchmark_bulk()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "compression":
+        benchmark_compression()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "files":
+        benchmark_files()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "loss":
+        benchmark_loss()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "delta":
+        benchmark_delta()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "secure":
+        benchmark_secure()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "messages":
+        benchmark_messages()
+        return
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    message = os.urandom(size * 1024 * 1024)
+    # testing hooks would corrupt the measurement
+    app.ALTERED = False
+    app.MISSING = False
+
+    for name, version in (("batches of 10", app.LEGACY_VERSION), ("selective repeat", app.PROTOCOL_VERSION)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed = run_transfer(0, version, message=message)
+        print(f"{name:<20} {size / elapsed:8.2f} MB/s ({elapsed:.2f} s)")
+
+    # file is received into another directory, so that it does not overwrite the sent one
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as destination:
+        path = os.path.join(source, "benchmark.bin")
+        with open(path, "wb") as file:
+            file.write(message)
+        del message
+
+        before = peak_memory()
+        cwd = os.getcwd()
+        os.chdir(destination)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed = run_transfer(0, app.PROTOCOL_VERSION, path=path)
+        finally:
+            os.chdir(cwd)
+        print(f"{'file':<20} {size / elapsed:8.2f} MB/s ({elapsed:.2f} s), "
+              f"peak memory {peak_memory():.1f} MB (before transfer {before:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+# app and benchmark are modules in root of repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def hooks(monkeypatch):
+    # testing hooks are switched on only by tests that need them
+    monkeypatch.setattr(app, "ALTERED", False)
+    monkeypatch.setattr(app, "MISSING", False)
+
+
+class Receiver:
+    """
+    Server that runs in its own thread and collects results of transfers
+    """
+
+    def __init__(self, key=None):
+        """
+        :param key: stretched pre-shared key, only secure sessions are served when it's set
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = self.sock.getsockname()
+        self.received = []
+        # messages of message streams
+        self.messages = []
+        self.server = app.Server(self.sock, self.on_complete, key, self.messages_received)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+
+    def on_complete(self, address, typ, filename, data):
+        self.received.append(data)
+
+    def messages_received(self, address, message):
+        self.messages.append(message)
+
+    def wait_for(self, count, timeout=5.0):
+        """
+        Server reports transfer after its last ack is sent, so client may finish first
+
+        :return: results of transfers received so far
+        """
+        deadline = time.monotonic() + timeout
+        while len(self.received) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.received
+
+    def close(self):
+        self.server.stop()
+        self.thread.join()
+        self.sock.close()
+
+
+@pytest.fixture
+def receiver(tmp_path, monkeypatch):
+    # received files are saved in current directory
+    monkeypatch.chdir(tmp_path)
+    receiver = Receiver()
+    yield receiver
+    receiver.close()
@@ -0,0 +1,84 @@
+"""
+Batches of datagrams sent and received by sendmmsg/recvmmsg and the fallback of one datagram per system call
+"""
+import os
+import socket
+import sys
+
+import pytest
+
+import app
+import benchmark
+
+multi = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="sendmmsg and recvmmsg are Linux calls")
+
+
+@pytest.fixture
+def sockets():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(1)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+def exchange(sender_io, receiver_io, address, count=20):
+    """
+    :return: fragments sent by sender_io as received by receiver_io
+    """
+    fragments = app.FragmentSource(1000, message=os.urandom(count * 1000))
+    sender_io.send_fragments(fragments, range(count), address)
+    received = []
+    while len(received) < count:
+        received += [bytes(view) for view, _ in receiver_io.receive()]
+    # receiver is asked to acknowledge the last fragment of burst right away
+    expected = [fragments[i] for i in range(count - 1)] + [b"".join(fragments.buffers(count - 1, flags=app.ACK_NOW))]
+    assert received == expected
+    return received
+
+
+@multi
+def test_batch_is_sent_and_received_at_once(sockets):
+    sender, receiver = sockets
+    assert app.MultiDatagramIO.available(sender)
+    sender_io = app.MultiDatagramIO(sender)
+    receiver_io = app.MultiDatagramIO(receiver)
+    exchange(sender_io, receiver_io, receiver.getsockname())
+
+
+@multi
+def test_both_ways_of_sending_are_compatible(sockets):
+    sender, receiver = sockets
+    exchange(app.MultiDatagramIO(sender), app.DatagramIO(receiver), receiver.getsockname())
+    exchange(app.DatagramIO(sender), app.MultiDatagramIO(receiver), receiver.getsockname())
+
+
+def test_receive_keeps_timeout_of_socket(sockets):
+    _, receiver = sockets
+    receiver.settimeout(0.05)
+    with pytest.raises(socket.timeout):
+        app.datagram_io(receiver).receive()
+
+
+def test_fallback_without_bulk_io(monkeypatch, sockets):
+    monkeypatch.setattr(app, "BULK_IO", False)
+    assert type(app.datagram_io(sockets[0])) is app.DatagramIO
+
+
+def test_fallback_for_ipv6_socket():
+    try:
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    except OSError:
+        pytest.skip("IPv6 is not available")
+    assert type(app.datagram_io(sock)) is app.DatagramIO
+    sock.close()
+
+
+@pytest.mark.parametrize("bulk_io", [False, pytest.param(True, marks=multi)])
+def test_transfer(monkeypatch, bulk_io):
+    monkeypatch.setattr(app, "BULK_IO", bulk_io)
+    # system without sendmmsg falls back to one datagram per call
+    monkeypatch.setattr(app.MultiDatagramIO, "available", classmethod(lambda cls, sock: bulk_io))
+    benchmark.run_transfer(0, app.PROTOCOL_VERSION, message=os.urandom(500000))
@@ -0,0 +1,169 @@
+"""
+Checksum negotiated in handshake, datagrams sealed by checksum and digest of whole message or file
+"""
+import os
+import socket
+import threading
+
+import pytest
+
+import app
+
+
+class Corrupter:
+    """
+    Relays datagrams between client and receiver and flips a bit in the first reply of receiver of given type
+    """
+
+    def __init__(self, upstream, typ):
+        self.upstream = upstream
+        self.typ = typ
+        self.corrupted = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.client = None
+        self.stopped = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            if address != self.upstream:
+                self.client = address
+                self.sock.sendto(data, self.upstream)
+                continue
+            if data[0] == self.typ and not self.corrupted:
+                self.corrupted += 1
+                data = bytearray(data)
+                # flags of digest verdict, length of data of reply to initial fragment
+                data[1] ^= 0x01
+            self.sock.sendto(data, self.client)
+
+    def close(self):
+        self.stopped.set()
+
+
+def test_receiver_picks_the_strongest_common_checksum():
+    assert app.negotiate_checksum(app.make_handshake()).flag in (app.CHECKSUMS['crc32'], app.CHECKSUMS['crc32c'])
+    crc32 = 1 << app.CHECKSUMS['crc32']
+    assert app.negotiate_checksum(app.make_handshake(checksums=crc32)).flag == app.CHECKSUMS['crc32']
+    # clients that offer nothing get crc16
+    assert app.negotiate_checksum(app.make_handshake(checksums=0)) is app.CRC16
+
+
+def test_crc32c_is_offered_only_when_it_is_installed(monkeypatch):
+    monkeypatch.setattr(app, "crc32c", None)
+    assert not app.supported_checksums() & (1 << app.CHECKSUMS['crc32c'])
+    with pytest.raises(ValueError):
+        app.Checksum(app.CHECKSUMS['crc32c'])
+
+
+@pytest.mark.parametrize("name", ["crc16", "crc32", "crc32c"])
+def test_checksum_detects_corrupted_data(name):
+    if not app.supported_checksums() & (1 << app.CHECKSUMS[name]):
+        pytest.skip(f"{name} is not installed")
+    checksum = app.Checksum(app.CHECKSUMS[name])
+    payload = os.urandom(1000)
+    fragment = b"header" + payload + checksum.pack(payload)
+    assert checksum.check(fragment, payload)
+    assert not checksum.check(fragment, payload[:-1] + bytes([payload[-1] ^ 0x01]))
+
+
+@pytest.mark.parametrize("checksums", [0, 1 << app.CHECKSUMS['crc32']])
+def test_transfer_with_negotiated_checksum(receiver, checksums):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address, checksums=checksums)
+    assert connection.checksum.flag == (app.CHECKSUMS['crc32'] if checksums else app.CHECKSUMS['crc16'])
+    message = os.urandom(50000)
+    assert app.transfer(connection, 1000, message, 0)
+    assert receiver.wait_for(1) == [message]
+    client.close()
+
+
+def test_corrupted_reply_to_initial_fragment_is_asked_for_again(receiver):
+    relay = Corrupter(receiver.address, app.INIT)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, relay.address)
+    assert relay.corrupted == 1
+    assert connection.version == app.PROTOCOL_VERSION
+    # session of the second initial fragment is used
+    assert app.transfer(connection, 1000, b"message", 0)
+    assert receiver.wait_for(1) == [b"message"]
+    relay.close()
+    client.close()
+
+
+def test_client_gives_up_when_every_reply_is_corrupted():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def reply():
+        for _ in range(app.HANDSHAKE_ATTEMPTS):
+            data, address = receiver.recvfrom(2048)
+            reply = app.LEGACY_FRAGMENT_HEADER.pack(app.INIT, 6, 0, app.PROTOCOL_VERSION) + bytes(10)
+            receiver.sendto(reply, address)
+
+    thread = threading.Thread(target=reply, daemon=True)
+    thread.start()
+    assert app.handshake(client, receiver.getsockname()) is None
+    thread.join()
+    receiver.close()
+    client.close()
+
+
+def test_corrupted_filename_fragment_is_not_confirmed(receiver):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    fragment = bytearray(connection.checksum.seal_datagram(
+        app.FRAGMENT_HEADER.pack(app.HEADER, 0, 0, connection.session, 1, 5, 1000, 5000)))
+    # number of fragments in header, its lowest byte is 15th, is covered by checksum as well
+    fragment[15] ^= 0x01
+    client.sendto(fragment, receiver.address)
+    client.settimeout(0.3)
+    with pytest.raises(socket.timeout):
+        client.recv(2048)
+    fragment[15] ^= 0x01
+    client.sendto(fragment, receiver.address)
+    confirmation = connection.checksum.open_datagram(memoryview(client.recv(2048)))
+    assert app.parser(confirmation, app.PROTOCOL_VERSION)['total_n'] == 5
+    client.close()
+
+
+def test_receiver_verifies_digest(receiver, capsys):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    message = os.urandom(50000)
+    assert app.transfer(connection, 1000, message, 0)
+    assert receiver.wait_for(1) == [message]
+    assert f"Receiver verified {app.DIGEST_ALGORITHM} digest of data." in capsys.readouterr().out
+    client.close()
+
+
+def test_mismatching_digest_fails_transfer(receiver, monkeypatch, capsys):
+    # data are damaged in a way no checksum of fragment finds out
+    monkeypatch.setattr(app.FragmentSource, "finish_digest", lambda fragments: bytes(64))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    assert not app.transfer(connection, 1000, os.urandom(50000), 0)
+    assert receiver.wait_for(1) == [None]
+    assert "Digest of received data does not match" in capsys.readouterr().out
+    client.close()
+
+
+def test_corrupted_verdict_is_asked_for_again(receiver):
+    relay = Corrupter(receiver.address, app.DIGEST)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, relay.address)
+    message = os.urandom(50000)
+    # corrupted verdict of match would read as mismatch
+    assert app.transfer(connection, 1000, message, 0)
+    assert relay.corrupted == 1
+    assert receiver.wait_for(1) == [message]
+    relay.close()
+    client.close()
@@ -0,0 +1,84 @@
+"""
+Send and serve commands, that run without menus
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import app
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def arguments(receiver, *rest):
+    return ["send", receiver.address[0], str(receiver.address[1])] + list(rest)
+
+
+def test_send_exits_with_0_when_everything_was_delivered(receiver, tmp_path):
+    (tmp_path / "dir").mkdir()
+    (tmp_path / "dir" / "a.txt").write_bytes(b"a" * 5000)
+    (tmp_path / "b.bin").write_bytes(os.urandom(5000))
+    assert app.main(arguments(receiver, "-m", "hello", "-f", "1000", "dir", "b.bin")) == 0
+    received = receiver.wait_for(3)
+    assert b"hello" in received and len(received) == 3
+
+
+def test_send_exits_with_1_when_path_does_not_exist(receiver, capsys):
+    assert app.main(arguments(receiver, "-m", "hello", "missing.txt")) == 1
+    assert "missing.txt does not exist." in capsys.readouterr().out
+    # the rest is sent anyway
+    assert receiver.wait_for(1) == [b"hello"]
+
+
+def test_send_exits_with_1_when_receiver_does_not_respond(monkeypatch, capsys):
+    monkeypatch.setattr(app, "HANDSHAKE_ATTEMPTS", 1)
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    assert app.main(["send", "127.0.0.1", str(silent.getsockname()[1]), "-m", "hello"]) == 1
+    assert "did not respond" in capsys.readouterr().out
+    silent.close()
+
+
+@pytest.mark.parametrize("argv", [
+    ["send", "127.0.0.1", "5000"],
+    ["send", "127.0.0.1", "70000", "-m", "hello"],
+    ["send", "127.0.0.1", "5000", "-m", "hello", "-f", str(app.MAX_PAYLOAD + 1)],
+    ["send", "127.0.0.1", "5000", "-m", "hello", "--congestion", "cubic"],
+    ["send", "127.0.0.1", "5000", "-m", "hello", "file.bin", "--bogus"],
+    ["serve"],
+])
+def test_invalid_arguments_exit_with_2(argv):
+    with pytest.raises(SystemExit) as exit_info:
+        app.main(argv)
+    assert exit_info.value.code == 2
+
+
+def test_jumbo_fragment_size_is_accepted():
+    arguments = app.make_argument_parser().parse_args(["send", "127.0.0.1", "5000", "-m", "hi", "-f", "9000"])
+    assert arguments.fragment_size == 9000
+
+
+def test_serve_and_send_as_processes(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.bin").write_bytes(os.urandom(100000))
+    (tmp_path / "received").mkdir()
+    server = subprocess.Popen([sys.executable, "-u", APP, "serve", "0", "--host", "127.0.0.1"],
+                              cwd=tmp_path / "received", stdout=subprocess.PIPE, text=True)
+    try:
+        line = server.stdout.readline()
+        assert line.startswith("Listening on 127.0.0.1:")
+        port = line.strip().rsplit(":", 1)[1]
+        client = subprocess.run([sys.executable, APP, "send", "127.0.0.1", port, "-m", "hello", "file.bin"],
+                                cwd=source, stdout=subprocess.PIPE, text=True, timeout=60)
+        assert client.returncode == 0, client.stdout
+    finally:
+        server.send_signal(signal.SIGINT)
+        output, _ = server.communicate(timeout=10)
+    assert server.returncode == 0
+    assert "Message: hello" in output
+    assert (tmp_path / "received" / "file.bin").read_bytes() == (source / "file.bin").read_bytes()
@@ -0,0 +1,49 @@
+"""
+Fragments encoded into reused buffers and decoded from views of received datagrams
+"""
+import os
+
+import app
+
+
+def test_buffers_make_up_the_same_fragment(tmp_path):
+    data = os.urandom(2500)
+    (tmp_path / "file.bin").write_bytes(data)
+    for source in (app.FragmentSource(1000, message=data), app.FragmentSource(1000, path=str(tmp_path / "file.bin"))):
+        for index in range(len(source)):
+            assert b"".join(source.buffers(index)) == source[index]
+        source.close()
+
+
+def test_encoded_buffers_are_reused():
+    codec = app.PacketCodec(100)
+    header, _, trailer = codec.encode(app.DATA, 2, 0, 0, memoryview(b"a" * 100))
+    assert codec.encode(app.DATA, 2, 1, 100, memoryview(b"b" * 50))[0] is header
+    assert app.parser(bytes(header), app.PROTOCOL_VERSION)['order'] == 1
+    assert app.CRC.unpack_from(trailer)[0] == app.libscrc.ibm(bytes(header) + b"b" * 50)
+
+
+def test_decode_returns_view_of_datagram():
+    buffer = bytearray(app.make_fragment(b"payload", 1000, 5, 3))
+    decoded = app.PacketCodec.decode(memoryview(buffer))
+    typ, (total_n, index, offset, payload, valid) = decoded[0], decoded[-5:]
+    assert (typ, total_n, index, offset, bytes(payload), valid) == (app.DATA, 5, 3, 3000, b"payload", True)
+    # data are not copied out of the datagram
+    buffer[app.FRAGMENT_HEADER.size] = ord("P")
+    assert bytes(payload) == b"Payload"
+
+
+def test_decode_detects_corruption():
+    fragment = app.make_fragment(b"payload", 1000, 5, 3)
+    for position in (2, app.FRAGMENT_HEADER.size, len(fragment) - 1):
+        corrupted = bytearray(fragment)
+        corrupted[position] ^= 0x04
+        assert not app.PacketCodec.decode(memoryview(corrupted))[-1]
+
+
+def test_buffer_pool_gives_back_returned_buffers():
+    pool = app.BufferPool(1, 64)
+    buffer = pool.get()
+    assert len(pool.get()) == 64
+    pool.put(buffer)
+    assert pool.get() is buffer
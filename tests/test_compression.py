@@ -0,0 +1,120 @@
+"""
+Files and messages compressed by zlib, lzma or zstd before they are split into fragments
+"""
+import filecmp
+import os
+import socket
+import time
+
+import pytest
+
+import app
+
+compressions = [name for name in app.COMPRESSIONS if name != 'zstd' or app.zstandard is not None]
+# text compresses well, random data do not shrink at all
+TEXT = b"".join(b"%d,sensor-%d,%.3f\n" % (i, i % 17, i / 7) for i in range(50000))
+
+
+@pytest.fixture
+def client():
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield client
+    client.close()
+
+
+@pytest.mark.parametrize("name", compressions)
+def test_decompressing_sink_restores_fragments_received_out_of_order(name):
+    compressor = app.make_compressor(app.COMPRESSIONS[name])
+    data = compressor.compress(TEXT) + compressor.flush()
+    sink = app.DecompressingSink(app.MemorySink(), app.make_decompressor(app.COMPRESSIONS[name]))
+    offsets = list(range(0, len(data), 1000))
+    for offset in offsets[1::2] + offsets[::2]:
+        sink.write(offset, memoryview(data)[offset:offset + 1000])
+    assert sink.finish() == TEXT
+
+
+def test_unknown_compression_is_refused():
+    with pytest.raises(ValueError):
+        app.make_decompressor(7)
+
+
+def test_auto_compression_skips_data_that_do_not_shrink():
+    connection = app.Connection(None, None, app.PROTOCOL_VERSION)
+    connection.compressions = app.supported_compressions()
+    connection.compression = 'auto'
+    assert app.choose_compression(connection, os.urandom(app.COMPRESSION_CHUNK)) == 0
+    assert app.choose_compression(connection, TEXT[:app.COMPRESSION_CHUNK]) in \
+        (app.COMPRESSIONS['zstd'], app.COMPRESSIONS['zlib'])
+    # compression receiver can not decompress is not used
+    connection.compressions = 0
+    connection.compression = 'lzma'
+    assert app.choose_compression(connection, TEXT) == 0
+
+
+@pytest.mark.parametrize("name", compressions + ['auto'])
+def test_compressed_file_transfer(receiver, tmp_path_factory, client, capsys, name):
+    path = tmp_path_factory.mktemp("source") / "data.csv"
+    path.write_bytes(TEXT)
+    connection = app.handshake(client, receiver.address)
+    connection.compression = name
+    assert app.transfer(connection, 1000, None, str(path))
+    assert receiver.wait_for(1)[0] is not None
+    assert filecmp.cmp(str(path), "data.csv", shallow=False)
+    assert "Data were compressed by" in capsys.readouterr().out
+
+
+def test_compressed_message_transfer(receiver, client):
+    connection = app.handshake(client, receiver.address)
+    connection.compression = 'zlib'
+    assert app.transfer(connection, 1000, TEXT, 0)
+    assert receiver.wait_for(1) == [TEXT]
+
+
+def test_data_that_can_not_be_decompressed_abort_only_their_stream(receiver, client, monkeypatch):
+    class Identity:
+        def compress(self, data):
+            return data
+
+        def flush(self):
+            return b""
+
+    # client claims zlib, but sends data as they are
+    monkeypatch.setattr(app, "make_compressor", lambda flag: Identity())
+    monkeypatch.setattr(app, "GIVE_UP_TIMEOUT", 1)
+    connection = app.handshake(client, receiver.address)
+    connection.compression = 'zlib'
+    app.transfer(connection, 1000, TEXT, 0)
+    assert receiver.wait_for(1) == [None]
+    connection.compression = None
+    assert app.transfer(connection, 1000, b"message", 0)
+    assert receiver.wait_for(2)[1] == b"message"
+
+
+def test_session_is_kept_alive_while_stream_is_made(monkeypatch):
+    monkeypatch.setattr(app, "KEEP_ALIVE_INTERVAL", 0.02)
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.Connection(client, receiver.getsockname(), app.PROTOCOL_VERSION, 7)
+    assert app.keeping_alive(connection, lambda: time.sleep(0.2) or 5) == 5
+    receiver.settimeout(0.1)
+    assert receiver.recv(2048)[0] == app.KEEP_ALIVE
+    with pytest.raises(OSError):
+        app.keeping_alive(connection, open, "missing file")
+    receiver.close()
+    client.close()
+
+
+def test_prepared_streams_keep_order_and_raise_errors_of_send_loop():
+    def streams():
+        yield "first", None
+        yield "second", None
+        raise OSError("file can not be read")
+
+    prepared = app.PreparedStreams(streams())
+    assert prepared.get(1)[0] == "first"
+    assert prepared.get(1)[0] == "second"
+    with pytest.raises(OSError):
+        prepared.get(1)
+    assert prepared.exhausted and prepared.get() is None
+    prepared.close()
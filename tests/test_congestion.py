@@ -0,0 +1,110 @@
+"""
+Congestion controllers shared by streams of connection, pacer and simulated lossy path
+"""
+import os
+import socket
+import time
+
+import pytest
+
+import app
+
+
+def test_aimd_window_grows_exponentially_in_slow_start():
+    controller = app.CongestionController(window=4)
+    controller.on_ack(4)
+    assert controller.window == 8
+    controller.on_ack(2000)
+    assert controller.window == app.MAX_WINDOW
+
+
+def test_aimd_window_grows_by_one_fragment_per_round_trip_after_loss():
+    controller = app.CongestionController(window=40)
+    controller.on_loss(time.monotonic())
+    assert controller.window == controller.threshold == 20
+    controller.on_ack(20)
+    assert controller.window == pytest.approx(21)
+
+
+def test_aimd_window_is_halved_once_per_round_trip():
+    controller = app.CongestionController(window=64)
+    controller.on_rtt(0.1)
+    now = time.monotonic()
+    controller.on_loss(now)
+    controller.on_loss(now + 0.05)
+    assert controller.window == 32
+    controller.on_loss(now + 0.1)
+    assert controller.window == 16
+    for i in range(10):
+        controller.on_loss(now + 0.2 * (i + 1))
+    assert controller.window == app.MIN_WINDOW
+
+
+def test_round_trip_time_is_smoothed():
+    controller = app.CongestionController()
+    assert controller.pacing_rate(1000) is None
+    controller.on_rtt(0.1)
+    controller.on_rtt(0.02)
+    assert controller.min_rtt == controller.latest_rtt == 0.02
+    assert controller.srtt == pytest.approx(0.09)
+    assert controller.pacing_rate(1000) == pytest.approx(app.PACING_GAIN[0] * app.WINDOW_SIZE * 1000 / 0.09)
+
+
+def test_ledbat_window_follows_queuing_delay():
+    controller = app.LedbatController(window=64)
+    controller.on_rtt(0.01)
+    controller.on_ack(10)
+    assert controller.window == 74
+    # queuing delay above target ends slow start and shrinks window
+    controller.on_rtt(0.01 + 3 * app.LEDBAT_TARGET)
+    controller.on_ack(10)
+    assert controller.window < 74 and not controller.slow_start()
+    shrunk = controller.window
+    controller.on_rtt(0.01)
+    controller.on_ack(10)
+    assert controller.window > shrunk
+
+
+def test_pacer_without_rate_sends_everything():
+    pacer = app.Pacer()
+    pacer.refill(None, 1000, time.monotonic())
+    assert pacer.allowance(1000) == float("inf") and pacer.delay(1000) == 0
+
+
+def test_pacer_spaces_out_datagrams():
+    pacer = app.Pacer()
+    now = time.monotonic()
+    pacer.refill(100000, 1000, now)
+    # bucket starts full with burst of datagrams
+    assert pacer.allowance(1000) == app.PACING_BURST
+    pacer.consume(app.PACING_BURST * 1000)
+    assert pacer.allowance(1000) == 0
+    assert pacer.delay(1000) == pytest.approx(0.01)
+    pacer.refill(100000, 1000, now + 0.0501)
+    assert pacer.allowance(1000) == 5
+
+
+@pytest.mark.parametrize("congestion", list(app.CONGESTION_CONTROLLERS))
+def test_transfer_through_lossy_bottleneck(receiver, monkeypatch, congestion):
+    monkeypatch.setattr(app, "SIMULATOR", app.LossSimulator(loss=0.02, rate=2000000, buffer=32 * 1024, seed=1))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    connection.congestion = congestion
+    message = os.urandom(300000)
+    assert app.transfer(connection, 1000, message, 0)
+    assert receiver.wait_for(1) == [message]
+    assert app.SIMULATOR.lost > 0
+    client.close()
+
+
+def test_transfer_keeps_rate_limit(receiver):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    connection.rate_limit = 500000
+    message = os.urandom(200000)
+    started = time.monotonic()
+    assert app.transfer(connection, 1000, message, 0)
+    # the first burst of pacer is sent right away
+    assert time.monotonic() - started > (len(message) - app.PACING_BURST * 1000) / 500000 * 0.9
+    assert receiver.wait_for(1) == [message]
+    client.close()
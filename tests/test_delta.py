@@ -0,0 +1,137 @@
+"""
+Delta mode, in which client sends only blocks of file that receiver doesn't have in file of the same name
+"""
+import hashlib
+import os
+import socket
+import time
+import zlib
+
+import pytest
+
+import app
+
+with_numpy = pytest.mark.skipif(app.numpy is None, reason="blocks that moved are found only with numpy")
+
+
+class FakeSession:
+    def log(self, text):
+        pass
+
+
+def signatures(data, block_size):
+    result = bytearray()
+    for start in range(0, len(data), block_size):
+        block = data[start:start + block_size]
+        result += app.BLOCK_SIGNATURE.pack(zlib.adler32(block), hashlib.blake2b(block, digest_size=8).digest())
+    return result
+
+
+@with_numpy
+def test_rolling_adler32_matches_adler32_at_every_offset():
+    data = os.urandom(3000)
+    checksums = app.rolling_adler32(data, 100)
+    assert len(checksums) == len(data) - 99
+    assert [int(value) for value in checksums] == [zlib.adler32(data[i:i + 100]) for i in range(len(checksums))]
+
+
+@with_numpy
+def test_blocks_are_found_where_they_moved(tmp_path, monkeypatch):
+    # small chunks make the search go over more of them
+    monkeypatch.setattr(app, "DELTA_CHUNK", 4096)
+    blocks = [os.urandom(1000) for _ in range(20)]
+    new = b"".join(blocks)
+    old = b"".join(blocks[:5]) + os.urandom(333) + b"".join(blocks[5:15]) + b"".join(blocks[16:])
+    (tmp_path / "file.bin").write_bytes(old)
+    found = app.find_blocks(str(tmp_path / "file.bin"), 1000, len(new), signatures(new, 1000))
+    assert sorted(found) == [i for i in range(20) if i != 15]
+    for index, offset in found.items():
+        assert old[offset:offset + 1000] == blocks[index]
+
+
+@with_numpy
+def test_blocks_with_the_same_data_are_all_found(tmp_path):
+    block = os.urandom(500)
+    other = os.urandom(500)
+    new = block + other + block + block
+    (tmp_path / "file.bin").write_bytes(os.urandom(7) + block + other)
+    found = app.find_blocks(str(tmp_path / "file.bin"), 500, len(new), signatures(new, 500))
+    assert found == {0: 7, 1: 507, 2: 7, 3: 7}
+
+
+def test_only_blocks_that_did_not_move_are_found_without_numpy(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "numpy", None)
+    new = os.urandom(5000)
+    (tmp_path / "file.bin").write_bytes(new[:2000] + b"x" + new[2000:])
+    found = app.find_blocks(str(tmp_path / "file.bin"), 1000, len(new), signatures(new, 1000))
+    assert found == {0: 0, 1: 1000}
+    assert app.find_blocks(str(tmp_path / "missing.bin"), 1000, len(new), signatures(new, 1000)) == {}
+
+
+@pytest.mark.parametrize("parameters", [b"", app.DELTA_PARAMETERS.pack(0, 1000)])
+def test_invalid_parameters_of_delta_mode_are_refused(parameters):
+    filename = parameters + b"file.bin"
+    header = app.FRAGMENT_HEADER.pack(app.SIGNATURES, 0, len(filename), 1, 1, 1, 1000, 12) + filename
+    with pytest.raises(ValueError):
+        app.Stream(FakeSession(), 1, header)
+
+
+def send_delta(receiver, path):
+    """
+    :return: number of data fragments client sent
+    """
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    connection.delta = True
+    before = app.METRICS.packets_sent
+    assert app.transfer(connection, 1000, None, str(path))
+    client.close()
+    return app.METRICS.packets_sent - before
+
+
+@with_numpy
+def test_only_changed_blocks_are_sent(receiver, tmp_path, capsys):
+    old = os.urandom(200000)
+    new = old[:50000] + os.urandom(100) + old[50000:150000] + os.urandom(1000) + old[151000:]
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.bin").write_bytes(new)
+    # receiver saves files into its current directory
+    (tmp_path / "file.bin").write_bytes(old)
+    sent = send_delta(receiver, source / "file.bin")
+    receiver.wait_for(1)
+    assert (tmp_path / "file.bin").read_bytes() == new
+    assert "Signatures of blocks of file are going to be sent." in capsys.readouterr().out
+    # signatures, changed blocks and a few replies instead of 201 fragments
+    assert sent < 40
+
+
+@with_numpy
+def test_filename_fragment_waits_for_search(receiver, tmp_path, monkeypatch):
+    find_blocks = app.find_blocks
+
+    def slow(*arguments):
+        time.sleep(1)
+        return find_blocks(*arguments)
+
+    monkeypatch.setattr(app, "find_blocks", slow)
+    old = os.urandom(100000)
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.bin").write_bytes(old[:-10] + b"0123456789")
+    (tmp_path / "file.bin").write_bytes(old)
+    send_delta(receiver, source / "file.bin")
+    receiver.wait_for(1)
+    assert (tmp_path / "file.bin").read_bytes() == (source / "file.bin").read_bytes()
+
+
+def test_receiver_without_numpy_does_not_offer_delta_mode(receiver, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(app, "numpy", None)
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.bin").write_bytes(os.urandom(20000))
+    (tmp_path / "file.bin").write_bytes(os.urandom(20000))
+    send_delta(receiver, source / "file.bin")
+    receiver.wait_for(1)
+    assert (tmp_path / "file.bin").read_bytes() == (source / "file.bin").read_bytes()
+    assert "Signatures" not in capsys.readouterr().out
@@ -0,0 +1,57 @@
+"""
+Directories sent as parallel streams of one connection
+"""
+import filecmp
+import os
+import socket
+
+import pytest
+
+import app
+
+
+def make_directory(path, count=12):
+    os.makedirs(path / "nested")
+    for i in range(count):
+        (path / ("nested" if i % 3 == 0 else "") / f"{i}.bin").write_bytes(os.urandom(100 + i * 1500))
+    return path
+
+
+@pytest.fixture
+def client():
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield client
+    client.close()
+
+
+def test_directory_is_sent_as_parallel_streams(receiver, tmp_path_factory, client):
+    source = make_directory(tmp_path_factory.mktemp("source") / "files")
+    files = app.list_directory(str(source))
+    assert len(files) == 12
+    assert app.transfer_directory(app.handshake(client, receiver.address), 1000, str(source))
+    assert len(receiver.wait_for(len(files))) == len(files)
+    for path, name in files:
+        assert filecmp.cmp(path, os.path.join("files", *name.split("/")), shallow=False)
+
+
+def test_file_that_can_not_be_saved_aborts_only_its_stream(receiver, tmp_path_factory, client):
+    source = make_directory(tmp_path_factory.mktemp("source") / "files")
+    # directory of the same name keeps received file from being renamed
+    os.makedirs(os.path.join("files", "5.bin"))
+    app.transfer_directory(app.handshake(client, receiver.address), 1000, str(source))
+    received = receiver.wait_for(12)
+    assert len(received) == 12 and received.count(None) == 1
+    assert not os.path.exists(os.path.join("files", "5.bin.part"))
+    # server still serves its clients
+    assert app.transfer(app.handshake(client, receiver.address), 1000, b"message", 0)
+    assert receiver.wait_for(13)[-1] == b"message"
+
+
+def test_received_names_stay_in_current_directory():
+    assert app.safe_path("../../etc/passwd") == os.path.join("etc", "passwd")
+    assert app.safe_path("/files\\..\\a.txt") == os.path.join("files", "a.txt")
+    assert app.safe_path("../..") is None
+
+
+def test_legacy_receiver_can_not_receive_directory(tmp_path):
+    assert not app.transfer_directory(app.Connection(None, None), 0, str(make_directory(tmp_path / "files")))
@@ -0,0 +1,110 @@
+"""
+Parity fragments that rebuild lost fragments without waiting for a round trip
+"""
+import os
+import socket
+import threading
+
+import pytest
+
+import app
+
+
+class Dropper:
+    """
+    Relays datagrams between client and receiver and drops the first copy of one data fragment of every group
+    """
+
+    def __init__(self, upstream, position=3):
+        self.upstream = upstream
+        self.position = position
+        self.dropped = set()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.client = None
+        self.stopped = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            if address == self.upstream:
+                self.sock.sendto(data, self.client)
+                continue
+            self.client = address
+            if data[0] == app.DATA and len(data) >= app.FRAGMENT_HEADER.size:
+                index = app.parser(data, app.PROTOCOL_VERSION)['order']
+                if index % app.FEC_GROUP == self.position and index not in self.dropped:
+                    self.dropped.add(index)
+                    continue
+            self.sock.sendto(data, self.upstream)
+
+    def close(self):
+        self.stopped.set()
+
+
+class FakeSession:
+    def log(self, text):
+        pass
+
+
+def header(flags, data):
+    return app.FRAGMENT_HEADER.pack(app.HEADER, flags, len(data), 1, 1, 10, 1000, 10000) + data
+
+
+@pytest.mark.parametrize("with_numpy", [True, False])
+def test_parity_of_payloads_of_different_sizes(monkeypatch, with_numpy):
+    if not with_numpy:
+        monkeypatch.setattr(app, "numpy", None)
+    elif app.numpy is None:
+        pytest.skip("numpy is not installed")
+    payloads = [os.urandom(100), os.urandom(100), os.urandom(60)]
+    parity = app.xor_payloads(payloads, 100)
+    # any payload is parity of the others and of parity
+    assert app.xor_payloads([parity, payloads[0], payloads[1]], 100)[:60] == payloads[2]
+
+
+def test_lost_fragments_are_rebuilt_from_parity(receiver):
+    relay = Dropper(receiver.address)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, relay.address)
+    connection.fec = (app.FEC_GROUP, app.FEC_PARITY)
+    message = os.urandom(200000)
+    rebuilt = app.METRICS.fragments_rebuilt
+    assert app.transfer(connection, 1000, message, 0)
+    assert receiver.wait_for(1) == [message]
+    relay.close()
+    client.close()
+    assert len(relay.dropped) == 13
+    # parity fragments follow their group, so most lost fragments are rebuilt before client finds out about them
+    assert app.METRICS.fragments_rebuilt - rebuilt >= len(relay.dropped) // 2
+
+
+@pytest.mark.parametrize("parameters", [b"", b"\x00", app.FEC_PARAMETERS.pack(0, 2),
+                                        app.FEC_PARAMETERS.pack(16, 0), app.FEC_PARAMETERS.pack(2, 4)])
+def test_invalid_parameters_of_parity_are_refused(parameters):
+    with pytest.raises(ValueError):
+        app.Stream(FakeSession(), 1, header(app.FEC_FLAG, parameters))
+
+
+def test_valid_parameters_of_parity_are_accepted():
+    stream = app.Stream(FakeSession(), 1, header(app.FEC_FLAG, app.FEC_PARAMETERS.pack(4, 4)))
+    assert stream.fec == (4, 4) and stream.typ == 1
+
+
+def test_invalid_filename_fragment_is_not_confirmed(receiver):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    fragment = app.FRAGMENT_HEADER.pack(app.HEADER, app.FEC_FLAG, 1, connection.session, 1, 10, 1000, 10000) + b"\x00"
+    client.sendto(connection.checksum.seal_datagram(fragment), receiver.address)
+    client.settimeout(0.3)
+    with pytest.raises(socket.timeout):
+        client.recv(2048)
+    assert app.transfer(connection, 1000, b"message", 0)
+    assert receiver.wait_for(1) == [b"message"]
+    client.close()
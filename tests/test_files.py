@@ -0,0 +1,54 @@
+"""
+Files are read and written by offsets of their fragments instead of being held in memory
+"""
+import os
+
+import pytest
+
+import app
+import benchmark
+
+
+@pytest.fixture(autouse=True)
+def directory(monkeypatch, tmp_path):
+    # received files are saved in current directory
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.mark.parametrize("version", [app.LEGACY_VERSION, app.PROTOCOL_VERSION])
+def test_file_transfer(tmp_path, version):
+    os.mkdir(tmp_path / "sent")
+    path = tmp_path / "sent" / "file.bin"
+    path.write_bytes(os.urandom(300001))
+    benchmark.run_transfer(1000, version, path=str(path))
+    assert (tmp_path / "file.bin").read_bytes() == path.read_bytes()
+
+
+def test_fragments_of_file_are_read_by_index(tmp_path):
+    data = os.urandom(2500)
+    (tmp_path / "file.bin").write_bytes(data)
+    source = app.FragmentSource(1000, path=str(tmp_path / "file.bin"))
+    message = app.FragmentSource(1000, message=data)
+    assert len(source) == len(message) == 3
+    for index in (2, 0, 1):
+        assert source[index] == message[index]
+        assert app.parser(source[index], app.PROTOCOL_VERSION)['data'][:-2] == data[index * 1000:index * 1000 + 1000]
+    source.close()
+
+
+def test_file_sink_writes_fragments_out_of_order(tmp_path):
+    sink = app.FileSink(str(tmp_path / "file.bin"), size=3000)
+    sink.write(2000, b"c" * 500)
+    sink.write(0, b"a" * 1000)
+    assert not (tmp_path / "file.bin").exists()
+    sink.write(1000, b"b" * 1000)
+    assert sink.finish() == str(tmp_path / "file.bin")
+    assert (tmp_path / "file.bin").read_bytes() == b"a" * 1000 + b"b" * 1000 + b"c" * 500
+    assert not (tmp_path / "file.bin.part").exists()
+
+
+def test_aborted_file_sink_removes_partial_file(tmp_path):
+    sink = app.FileSink(str(tmp_path / "file.bin"), size=3000)
+    sink.write(0, b"a" * 1000)
+    sink.abort()
+    assert os.listdir(tmp_path) == []
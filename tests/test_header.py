@@ -0,0 +1,55 @@
+"""
+Wide header of version 3 and size of fragments of both versions
+"""
+import os
+
+import pytest
+
+import app
+import benchmark
+
+
+def test_data_fragment_carries_index_and_offset():
+    fragment = app.make_fragment(b"abc", 1000, 100000, 70000)
+    parsed = app.parser(fragment, app.PROTOCOL_VERSION)
+    assert (parsed['type'], parsed['data_length'], parsed['total_n'], parsed['order'], parsed['offset']) == \
+        (app.DATA, 3, 100000, 70000, 70000000)
+    # checksum covers header as well as data
+    header = fragment[:app.FRAGMENT_HEADER.size]
+    assert parsed['data'] == b"abc" + app.libscrc.ibm(header + b"abc").to_bytes(2, "big")
+
+
+def test_legacy_fragment_keeps_layout_of_version_1():
+    fragment = app.make_fragment(b"abc", 1000, 10, 7, app.LEGACY_VERSION)
+    assert fragment[:app.LEGACY_FRAGMENT_HEADER.size] == (2).to_bytes(1, "big") + (1000).to_bytes(2, "big") + \
+        (10).to_bytes(2, "big") + (7).to_bytes(2, "big")
+
+
+@pytest.mark.parametrize("version", [app.LEGACY_VERSION, app.PROTOCOL_VERSION])
+def test_automatic_fragments_fill_datagram(version):
+    fragments = app.FragmentSource(0, message=os.urandom(20000), version=version)
+    assert max(len(fragments[i]) for i in range(len(fragments))) == app.MAX_DATAGRAM
+
+
+@pytest.mark.parametrize("version", [app.LEGACY_VERSION, app.PROTOCOL_VERSION])
+@pytest.mark.parametrize("fragment_size", [1463, 9000])
+def test_too_large_fragments_are_clamped_to_datagram(version, fragment_size, capsys):
+    benchmark.run_transfer(fragment_size, version, message=os.urandom(20000))
+    if version == app.LEGACY_VERSION:
+        largest = app.MAX_DATAGRAM - app.LEGACY_FRAGMENT_HEADER.size - app.CRC.size
+    else:
+        # receiver picks 4 bytes long crc32 or crc32c
+        largest = app.MAX_DATAGRAM - app.FRAGMENT_HEADER.size - app.CRC32.size
+    assert f"Fragments of maximum size of {largest} are going to be sent." in capsys.readouterr().out
+
+
+def test_smaller_fragment_size_is_kept():
+    assert app.FragmentSource(100, message=bytes(1000)).fragment_size == 100
+
+
+def test_transfer_of_more_than_65535_fragments():
+    benchmark.run_transfer(8, app.PROTOCOL_VERSION, message=os.urandom(70000 * 8))
+
+
+def test_legacy_version_refuses_more_than_65535_fragments():
+    assert not app.transfer(app.Connection(None, None), 1, bytes(70000), 0)
@@ -0,0 +1,152 @@
+"""
+Impairment proxy of benchmark sweep and transfers through paths that lose, reorder, duplicate and corrupt datagrams
+"""
+import os
+import socket
+import threading
+
+import pytest
+
+import app
+import benchmark
+
+
+class ProxyThread:
+    """
+    ImpairmentProxy that runs in its own thread
+    """
+
+    def __init__(self, upstream, **impairments):
+        self.proxy = benchmark.ImpairmentProxy(upstream, **impairments)
+        self.address = self.proxy.address
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.proxy.run, args=(self.stopped,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.proxy.close()
+
+
+class SackForger:
+    """
+    Relays datagrams between client and receiver and replaces the first selective ack of receiver
+    with correctly sealed one that reports fragments past the end of stream
+    """
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.checksum = None
+        self.forged = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.client = None
+        self.stopped = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            if address != self.upstream:
+                self.client = address
+                self.sock.sendto(data, self.upstream)
+                continue
+            if data[0] == app.SACK and self.checksum is not None and not self.forged:
+                self.forged += 1
+                _, _, _, session, stream, total, _, _ = app.FRAGMENT_HEADER.unpack_from(data)
+                data = self.checksum.seal_datagram(app.make_sack(total + 1000, bytearray(), 0, session, stream))
+            self.sock.sendto(data, self.client)
+
+    def close(self):
+        self.stopped.set()
+
+
+def decisions(seed):
+    proxy = benchmark.ImpairmentProxy(None, loss=0.1, reorder=0.1, duplicate=0.1, corrupt=0.1, seed=seed)
+    for i in range(1000):
+        proxy.impair("forward", bytes(100) + i.to_bytes(4, "big"), None, None, 0.0)
+    proxy.close()
+    return proxy.stats, [data for _, _, _, data, _ in proxy.queue]
+
+
+def test_proxy_impairs_datagrams_the_same_way_with_the_same_seed():
+    stats, delivered = decisions(1)
+    assert (stats, delivered) == decisions(1)
+    assert stats != decisions(2)[0]
+    assert stats["forward_packets"] == 1000
+    for impairment in ("lost", "reordered", "duplicated", "corrupted"):
+        assert 50 < stats[f"forward_{impairment}"] < 150
+    assert len(delivered) == 1000 - stats["forward_lost"] + stats["forward_duplicated"]
+
+
+def test_header_of_version_1_is_never_corrupted():
+    proxy = benchmark.ImpairmentProxy(None, corrupt=1.0, seed=1)
+    header = bytes(app.LEGACY_FRAGMENT_HEADER.size)
+    proxy.impair("forward", header, None, None, 0.0)
+    proxy.impair("forward", header + bytes(10), None, None, 0.0)
+    proxy.close()
+    assert proxy.stats["forward_corrupted"] == 1
+    assert all(data.startswith(header) for _, _, _, data, _ in proxy.queue)
+
+
+def test_queue_of_limited_path_drops_what_overflows_it():
+    proxy = benchmark.ImpairmentProxy(None, rate=1000, buffer=3000, seed=1)
+    for _ in range(10):
+        proxy.impair("forward", bytes(1000), None, None, 0.0)
+    proxy.close()
+    # queue holds 3000 bytes, the first datagram is being sent already
+    assert proxy.stats["forward_overflowed"] == 7
+    assert sorted(due for due, _, _, _, _ in proxy.queue) == pytest.approx([1.0, 2.0, 3.0])
+
+
+@pytest.mark.parametrize("checksum", ["crc16", "crc32"])
+def test_corrupted_header_of_data_fragment_is_detected(checksum):
+    checksum = app.Checksum(app.CHECKSUMS[checksum])
+    fragment = app.make_fragment(b"payload", 1000, 5, 3, checksum=checksum)
+    assert app.PacketCodec.decode(memoryview(fragment), checksum)[-1]
+    # stream id, number of fragments, index and offset
+    for position in (11, 15, 19, 27):
+        corrupted = bytearray(fragment)
+        corrupted[position] ^= 0x01
+        assert not app.PacketCodec.decode(memoryview(corrupted), checksum)[-1]
+
+
+@pytest.mark.parametrize("impairments", [
+    dict(loss=0.05),
+    dict(reorder=0.1, duplicate=0.1),
+    dict(corrupt=0.2),
+    dict(loss=0.02, reorder=0.05, duplicate=0.05, corrupt=0.02, delay=0.001, jitter=0.001),
+])
+def test_transfer_through_impaired_path(receiver, impairments):
+    proxy = ProxyThread(receiver.address, seed=1, **impairments)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        connection = app.handshake(client, proxy.address)
+        message = os.urandom(200000)
+        assert app.transfer(connection, 1000, message, 0)
+        assert receiver.wait_for(1) == [message]
+    finally:
+        proxy.close()
+        client.close()
+    if impairments.get("corrupt", 0) > 0.1:
+        # acks of receiver are corrupted as well and sender drops them
+        assert proxy.proxy.stats["backward_corrupted"] > 0
+
+
+def test_sack_past_the_end_of_stream_is_ignored(receiver):
+    relay = SackForger(receiver.address)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, relay.address)
+    relay.checksum = connection.checksum
+    message = os.urandom(100000)
+    assert app.transfer(connection, 1000, message, 0)
+    assert receiver.wait_for(1) == [message]
+    assert relay.forged == 1
+    relay.close()
+    client.close()
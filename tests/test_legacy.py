@@ -0,0 +1,83 @@
+"""
+Sessions of protocol version 1 track fragments of batch in bitmap, so duplicated and reordered fragments do no harm
+"""
+import os
+import socket
+import threading
+
+import pytest
+
+import app
+import benchmark
+
+
+@pytest.fixture
+def impaired(receiver):
+    """
+    :return: function that starts impairment proxy in front of receiver and returns it
+    """
+    proxies = []
+
+    def start(**impairments):
+        proxy = benchmark.ImpairmentProxy(receiver.address, seed=1, **impairments)
+        stop = threading.Event()
+        thread = threading.Thread(target=proxy.run, args=(stop,), daemon=True)
+        thread.start()
+        proxies.append((proxy, stop, thread))
+        return proxy
+
+    yield start
+    for proxy, stop, thread in proxies:
+        stop.set()
+        thread.join()
+        proxy.close()
+
+
+def send_legacy(address, message):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        connection = app.handshake(client, address, app.LEGACY_VERSION)
+        assert connection.version == app.LEGACY_VERSION
+        return app.transfer(connection, 1000, message, 0)
+    finally:
+        client.close()
+
+
+def test_duplicated_fragments_do_not_complete_batch(receiver, impaired):
+    proxy = impaired(duplicate=1.0)
+    nacks = app.METRICS.nacks_sent
+    message = os.urandom(50000)
+    assert send_legacy(proxy.address, message)
+    assert receiver.wait_for(1) == [message]
+    # every fragment arrived, so no batch was rejected, filename fragment that arrived twice did not start
+    # another transfer
+    assert app.METRICS.nacks_sent == nacks
+
+
+def test_reordered_fragments_are_accepted(receiver, impaired):
+    proxy = impaired(reorder=0.3)
+    message = os.urandom(50000)
+    assert send_legacy(proxy.address, message)
+    assert receiver.wait_for(1) == [message]
+    assert proxy.stats["forward_reordered"] > 0
+
+
+def test_transfer_through_impaired_path(receiver, impaired):
+    proxy = impaired(loss=0.02, duplicate=0.02, reorder=0.02, corrupt=0.01)
+    message = os.urandom(100000)
+    assert send_legacy(proxy.address, message)
+    assert receiver.wait_for(1) == [message]
+
+
+def test_legacy_client_after_client_of_current_version(receiver):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    first, second = os.urandom(20000), os.urandom(20000)
+    assert app.transfer(app.handshake(client, receiver.address), 1000, first, 0)
+    assert receiver.wait_for(1) == [first]
+    # the same address connects again with version 1
+    connection = app.handshake(client, receiver.address, app.LEGACY_VERSION)
+    assert connection.version == app.LEGACY_VERSION
+    assert app.transfer(connection, 1000, second, 0)
+    assert receiver.wait_for(2) == [first, second]
+    client.close()
+
@@ -0,0 +1,133 @@
+"""
+Message-stream mode, in which small messages are coalesced into datagrams and delivered in order
+"""
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import app
+import benchmark
+
+
+def wait_for_messages(receiver, count):
+    deadline = time.monotonic() + 5.0
+    while len(receiver.messages) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return receiver.messages
+
+
+def test_small_messages_are_coalesced_into_datagrams(receiver):
+    messages = [f"message {i}".encode() for i in range(1000)]
+    before = app.METRICS.packets_sent
+    with app.Sender(receiver.address, 1000) as sender:
+        with sender.open_messages(flush_delay=0.05) as stream:
+            for message in messages:
+                stream.send(message)
+        assert stream.close()
+    assert wait_for_messages(receiver, len(messages)) == messages
+    # about 80 messages fit into datagram of 1000 bytes
+    assert app.METRICS.packets_sent - before < 50
+
+
+def test_every_message_is_sent_right_away_without_flush_delay(receiver):
+    with app.Sender(receiver.address, 1000) as sender:
+        stream = sender.open_messages(flush_delay=0)
+        stream.send("first")
+        assert wait_for_messages(receiver, 1) == [b"first"]
+        stream.send(b"")
+        stream.send("third")
+        assert stream.close()
+    assert wait_for_messages(receiver, 3) == [b"first", b"", b"third"]
+
+
+def test_messages_are_delivered_once_and_in_order_through_impaired_path(receiver):
+    proxy = benchmark.ImpairmentProxy(receiver.address, loss=0.1, reorder=0.1, duplicate=0.1, corrupt=0.05, seed=1)
+    stopped = threading.Event()
+    thread = threading.Thread(target=proxy.run, args=(stopped,), daemon=True)
+    thread.start()
+    messages = [os.urandom(i % 300) for i in range(2000)]
+    try:
+        with app.Sender(proxy.address, 1000) as sender:
+            with sender.open_messages(flush_delay=0.001) as stream:
+                for message in messages:
+                    stream.send(message)
+            assert stream.close()
+    finally:
+        stopped.set()
+        thread.join()
+        proxy.close()
+    assert wait_for_messages(receiver, len(messages)) == messages
+    assert proxy.stats["forward_lost"] > 0 and proxy.stats["forward_duplicated"] > 0
+
+
+def test_message_larger_than_datagram_is_refused(receiver):
+    with app.Sender(receiver.address, 1000) as sender:
+        with sender.open_messages() as stream:
+            with pytest.raises(ValueError):
+                stream.send(bytes(1000))
+            stream.send(bytes(1000 - app.MESSAGE_LENGTH.size))
+    assert wait_for_messages(receiver, 1) == [bytes(1000 - app.MESSAGE_LENGTH.size)]
+
+
+def test_other_transfer_waits_until_message_stream_is_closed(receiver):
+    with app.Sender(receiver.address, 1000) as sender:
+        stream = sender.open_messages()
+        stream.send("message of stream")
+        with pytest.raises(ValueError):
+            sender.send_message("message")
+        assert stream.close()
+        assert sender.send_message("message")
+    assert wait_for_messages(receiver, 1) == [b"message of stream"]
+    assert receiver.wait_for(1) == [b"message"]
+
+
+def test_receiver_of_version_1_has_no_message_streams(receiver):
+    with app.Sender(receiver.address, 1000, version=app.LEGACY_VERSION) as sender:
+        with pytest.raises(ValueError):
+            sender.open_messages()
+
+
+def test_stream_fails_when_receiver_stops_responding(monkeypatch):
+    monkeypatch.setattr(app, "GIVE_UP_TIMEOUT", 0.5)
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(("127.0.0.1", 0))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.Connection(client, silent.getsockname(), app.PROTOCOL_VERSION, 1)
+    stream = app.MessageStream(connection, 1000, flush_delay=0)
+    try:
+        stream.send("nobody listens")
+        assert not stream.close()
+        with pytest.raises(ConnectionError):
+            stream.send("again")
+    finally:
+        client.close()
+        silent.close()
+
+
+def test_receiver_yields_messages():
+    receiver = app.Receiver(0, "127.0.0.1")
+    messages = receiver.messages()
+    received = []
+
+    def collect():
+        for _, message in messages:
+            received.append(message)
+            if len(received) == 3:
+                break
+
+    thread = threading.Thread(target=collect, daemon=True)
+    thread.start()
+    try:
+        with app.Sender(receiver.address, 1000) as sender:
+            with sender.open_messages() as stream:
+                for message in ("one", "two", "three"):
+                    stream.send(message)
+        thread.join(5)
+    finally:
+        # receiver is stopped once iteration ends
+        messages.close()
+        receiver.close()
+    assert received == [b"one", b"two", b"three"]
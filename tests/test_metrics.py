@@ -0,0 +1,111 @@
+"""
+Metrics exported as JSON lines and in text format of Prometheus
+"""
+import json
+import os
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+
+import app
+
+
+def test_histogram_counts_values_in_buckets():
+    histogram = app.Histogram((0.01, 0.1, 1.0))
+    for value in (0.005, 0.05, 0.05, 0.5, 5.0):
+        histogram.observe(value)
+    assert histogram.cumulative() == [(0.01, 1), (0.1, 3), (1.0, 4), (float("inf"), 5)]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.99) == float("inf")
+    assert histogram.sum == pytest.approx(5.605)
+    assert app.Histogram().quantile(0.5) is None
+
+
+def test_snapshot_is_json():
+    metrics = app.Metrics()
+    metrics.retransmits = 3
+    metrics.rtt.observe(0.002)
+    snapshot = json.loads(metrics.to_json())
+    assert snapshot["retransmits"] == 3 and snapshot["crc_failures"] == 0
+    assert snapshot["rtt_seconds"]["count"] == 1
+    assert set(name for name, _ in app.Metrics.COUNTERS) <= set(snapshot)
+
+
+def test_prometheus_text_format():
+    metrics = app.Metrics()
+    metrics.packets_sent = 7
+    metrics.batch_latency.observe(0.002)
+    lines = metrics.to_prometheus().splitlines()
+    assert "# TYPE komunikator_packets_sent_total counter" in lines
+    assert "komunikator_packets_sent_total 7" in lines
+    assert 'komunikator_batch_latency_seconds_bucket{le="+Inf"} 1' in lines
+    assert "komunikator_batch_latency_seconds_count 1" in lines
+    # every metric has its HELP and TYPE
+    types = [line.split(" ")[2] for line in lines if line.startswith("# TYPE")]
+    helps = [line.split(" ")[2] for line in lines if line.startswith("# HELP")]
+    assert types == helps
+    for line in lines:
+        if not line.startswith("#"):
+            assert any(line.startswith(name) for name in types)
+
+
+def test_transfer_updates_counters(receiver):
+    before = app.METRICS.snapshot()
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    assert app.transfer(connection, 1000, os.urandom(50000), 0)
+    receiver.wait_for(1)
+    after = app.METRICS.snapshot()
+    assert after["packets_sent"] - before["packets_sent"] >= 50
+    assert after["bytes_sent"] - before["bytes_sent"] >= 50000
+    assert after["packets_received"] - before["packets_received"] >= 50
+    assert after["transfers_completed"] - before["transfers_completed"] == 1
+    assert after["rtt_seconds"]["count"] > before["rtt_seconds"]["count"]
+    assert after["goodput_bytes_per_second"] > 0
+    client.close()
+
+
+def test_keep_alive_is_counted_not_logged(receiver, capsys):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    capsys.readouterr()
+    before = app.METRICS.keep_alives_received
+    app.send_keep_alive(connection)
+    assert app.transfer(connection, 1000, b"message", 0)
+    receiver.wait_for(1)
+    assert app.METRICS.keep_alives_received == before + 1
+    assert "kept alive" not in capsys.readouterr().out
+    client.close()
+
+
+def test_metrics_log_writes_json_lines(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    log = app.MetricsLog(str(path), interval=0.01)
+    log.close()
+    lines = path.read_text().splitlines()
+    assert len(lines) >= 1
+    for line in lines:
+        assert "retransmits" in json.loads(line)
+
+
+def test_metrics_endpoint_serves_prometheus():
+    endpoint = app.MetricsEndpoint(0, "127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{endpoint.address[1]}"
+        with urllib.request.urlopen(url + "/metrics", timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "komunikator_packets_sent_total" in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + "/other", timeout=5)
+    finally:
+        endpoint.close()
+
+
+def test_send_command_writes_metrics_log(receiver, tmp_path):
+    path = tmp_path / "send.jsonl"
+    assert app.main(["send", receiver.address[0], str(receiver.address[1]), "-m", "hello",
+                     "--metrics-log", str(path)]) == 0
+    receiver.wait_for(1)
+    assert json.loads(path.read_text().splitlines()[-1])["packets_sent"] >= 1
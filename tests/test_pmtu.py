@@ -0,0 +1,80 @@
+"""
+Path MTU discovery with probes of decreasing size confirmed by server
+"""
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+import app
+import benchmark
+
+linux = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="path MTU is probed only on Linux")
+
+
+@pytest.fixture
+def client():
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield client
+    client.close()
+
+
+def narrow_path(upstream, largest):
+    """
+    Relays datagrams to server, datagrams larger than largest are lost as if they did not fit through path
+    """
+    relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    relay.bind(("127.0.0.1", 0))
+    relay.settimeout(2)
+
+    def run():
+        client = None
+        try:
+            while True:
+                data, address = relay.recvfrom(65535)
+                if address == upstream:
+                    relay.sendto(data, client)
+                elif len(data) <= largest:
+                    client = address
+                    relay.sendto(data, upstream)
+        except OSError:
+            relay.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return relay.getsockname()
+
+
+@linux
+def test_route_mtu_of_loopback():
+    assert app.route_mtu(("127.0.0.1", 9)) >= 1500
+
+
+@linux
+def test_loopback_allows_jumbo_datagrams(receiver, client):
+    assert app.discover_datagram_size(client, receiver.address) == app.PROBE_SIZES[0]
+
+
+@linux
+def test_discovery_falls_back_to_smaller_probe(receiver, client):
+    assert app.discover_datagram_size(client, narrow_path(receiver.address, 1472)) == 1472
+
+
+def test_unanswered_probes_keep_default_size(client):
+    assert app.discover_datagram_size(client, ("127.0.0.1", 9)) == app.MAX_DATAGRAM
+
+
+def test_fragments_fill_discovered_datagram(monkeypatch, capsys):
+    original = app.transfer
+
+    def transfer(connection, *args):
+        # receiver of benchmark is reached through path that allows jumbo frames
+        connection.datagram_size = 8972
+        return original(connection, *args)
+
+    monkeypatch.setattr(app, "transfer", transfer)
+    benchmark.run_transfer(9000, app.PROTOCOL_VERSION, message=os.urandom(50000))
+    # receiver picks 4 bytes long crc32 or crc32c
+    largest = 8972 - app.FRAGMENT_HEADER.size - app.CRC32.size
+    assert f"Fragments of maximum size of {largest} are going to be sent." in capsys.readouterr().out
@@ -0,0 +1,116 @@
+"""
+Transfers of large files interrupted by loss of connection continue where they stopped
+"""
+import os
+import socket
+import threading
+
+import pytest
+
+import app
+
+
+class Cutter:
+    """
+    Relays datagrams between client and receiver and drops every data fragment from given index on,
+    until it's switched back on, like connection that got lost in the middle of transfer
+    """
+
+    def __init__(self, upstream, limit):
+        self.upstream = upstream
+        self.limit = limit
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.client = None
+        self.stopped = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            if address == self.upstream:
+                self.sock.sendto(data, self.client)
+                continue
+            self.client = address
+            if self.limit is not None and data[0] == app.DATA and \
+                    app.parser(data, app.PROTOCOL_VERSION)['order'] >= self.limit:
+                continue
+            self.sock.sendto(data, self.upstream)
+
+    def close(self):
+        self.stopped.set()
+
+
+class FakeSession:
+    def log(self, text):
+        pass
+
+
+@pytest.fixture
+def large_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "RESUME_SIZE", 100000)
+    path = tmp_path / "source.bin"
+    path.write_bytes(os.urandom(300000))
+    return path
+
+
+def test_journal_keeps_written_fragments(tmp_path):
+    path = str(tmp_path / "file.journal")
+    journal = app.Journal(path, (300000, 1000, 300, 1), 300)
+    journal.open()
+    for index in (0, 1, 9, 299):
+        journal.add(index)
+    journal.close()
+    loaded = app.Journal(path, (300000, 1000, 300, 1), 300)
+    assert loaded.load()
+    received = loaded.received()
+    assert [index for index in range(300) if received[index]] == [0, 1, 9, 299]
+    # journal of file that changed on client is not used
+    assert not app.Journal(path, (300000, 1000, 300, 2), 300).load()
+
+
+def test_interrupted_transfer_is_resumed(receiver, large_file, monkeypatch, capsys):
+    monkeypatch.setattr(app, "GIVE_UP_TIMEOUT", 1)
+    relay = Cutter(receiver.address, 100)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, relay.address)
+    assert not app.transfer(connection, 1000, None, str(large_file))
+    assert os.path.exists("source.bin.journal")
+    capsys.readouterr()
+
+    # client connects again from the same address, receiver keeps partial file of its former session
+    relay.limit = None
+    connection = app.handshake(client, relay.address)
+    assert app.transfer(connection, 1000, None, str(large_file))
+    assert "Receiver already has 100 of 300 fragments" in capsys.readouterr().out
+    receiver.wait_for(1)
+    assert open("source.bin", "rb").read() == large_file.read_bytes()
+    assert not os.path.exists("source.bin.journal")
+    relay.close()
+    client.close()
+
+
+def test_changed_file_is_sent_whole(receiver, large_file, monkeypatch, capsys):
+    monkeypatch.setattr(app, "GIVE_UP_TIMEOUT", 1)
+    relay = Cutter(receiver.address, 100)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    assert not app.transfer(app.handshake(client, relay.address), 1000, None, str(large_file))
+    large_file.write_bytes(os.urandom(300000))
+    relay.limit = None
+    assert app.transfer(app.handshake(client, relay.address), 1000, None, str(large_file))
+    assert "Receiver already has" not in capsys.readouterr().out
+    receiver.wait_for(1)
+    assert open("source.bin", "rb").read() == large_file.read_bytes()
+    relay.close()
+    client.close()
+
+
+def test_identity_of_resumed_file_is_required():
+    header = app.FRAGMENT_HEADER.pack(app.HEADER, app.RESUME_FLAG, 3, 1, 1, 300, 1000, 300000) + b"abc"
+    with pytest.raises(ValueError):
+        app.Stream(FakeSession(), 1, header)
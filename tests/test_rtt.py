@@ -0,0 +1,104 @@
+"""
+Retransmission and ack timers derived from measured round trip time
+"""
+import os
+import socket
+import threading
+
+import pytest
+
+import app
+
+
+class ReplyDropper:
+    """
+    Relays datagrams between client and receiver and drops the first reply of receiver of given type
+    """
+
+    def __init__(self, upstream, typ):
+        self.upstream = upstream
+        self.typ = typ
+        self.dropped = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.client = None
+        self.stopped = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            if address != self.upstream:
+                self.client = address
+                self.sock.sendto(data, self.upstream)
+            elif data[0] == self.typ and not self.dropped:
+                self.dropped += 1
+            else:
+                self.sock.sendto(data, self.client)
+
+    def close(self):
+        self.stopped.set()
+
+
+def test_first_sample_sets_timeout():
+    estimator = app.RttEstimator()
+    assert estimator.timeout() == app.INITIAL_RTO
+    estimator.on_rtt(0.1)
+    assert (estimator.srtt, estimator.rttvar) == (0.1, 0.05)
+    assert estimator.timeout() == pytest.approx(0.3)
+
+
+def test_samples_are_smoothed():
+    estimator = app.RttEstimator()
+    estimator.on_rtt(0.1)
+    estimator.on_rtt(0.2)
+    assert estimator.srtt == pytest.approx(0.1125)
+    assert estimator.rttvar == pytest.approx(0.0625)
+    assert estimator.timeout() == pytest.approx(0.1125 + 4 * 0.0625)
+
+
+def test_timeout_is_clamped():
+    estimator = app.RttEstimator()
+    estimator.on_rtt(0.0001)
+    assert estimator.timeout() == app.MIN_RTO
+    estimator = app.RttEstimator()
+    estimator.on_rtt(100)
+    assert estimator.timeout() == app.MAX_RTO
+
+
+def test_timer_backs_off_exponentially():
+    estimator = app.RttEstimator()
+    estimator.on_rtt(0.1)
+    assert [estimator.timeout(backoff) for backoff in range(3)] == pytest.approx([0.3, 0.6, 1.2])
+    assert estimator.timeout(100) == app.MAX_RTO
+
+
+def test_handshake_and_transfer_measure_round_trip_time(receiver):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    # loopback answers much faster than the initial timeout
+    assert connection.rtt.srtt is not None and connection.rtt.timeout() < app.INITIAL_RTO
+    assert app.transfer(connection, 1000, os.urandom(50000), 0)
+    receiver.wait_for(1)
+    session, = receiver.server.sessions.values()
+    assert session.rtt.srtt is not None and session.rtt.timeout() < app.INITIAL_RTO
+    client.close()
+
+
+def test_lost_reply_of_legacy_batch_is_sent_again(receiver, capsys):
+    relay = ReplyDropper(receiver.address, app.ACK)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, relay.address, app.LEGACY_VERSION)
+    assert connection.version == app.LEGACY_VERSION
+    message = os.urandom(30000)
+    assert app.transfer(connection, 1000, message, 0)
+    assert receiver.wait_for(1) == [message]
+    assert relay.dropped == 1
+    assert "Reply of batch was lost, it's sent again." in capsys.readouterr().out
+    relay.close()
+    client.close()
@@ -0,0 +1,204 @@
+"""
+Secure sessions, whose fragments are encrypted and authenticated by ChaCha20-Poly1305 with pre-shared key
+"""
+import collections
+import os
+import socket
+import threading
+
+import pytest
+
+import app
+import benchmark
+from conftest import Receiver
+
+pytestmark = pytest.mark.skipif(app.ChaCha20Poly1305 is None, reason="secure sessions need cryptography package")
+
+KEY = b"shared secret"
+
+
+@pytest.fixture
+def secure_receiver(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    receiver = Receiver(app.psk_key(KEY))
+    yield receiver
+    receiver.close()
+
+
+class Recorder:
+    """
+    Relays datagrams between client and receiver and records those of both directions
+    """
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.forward = []
+        self.backward = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.client = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            if address != self.upstream:
+                self.client = address
+                self.forward.append(data)
+                self.sock.sendto(data, self.upstream)
+            else:
+                self.backward.append(data)
+                self.sock.sendto(data, self.client)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sock.close()
+
+
+def test_message_and_file_are_sent_in_secure_session(secure_receiver, tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.bin").write_bytes(os.urandom(100000))
+    with app.Sender(secure_receiver.address, 1000, psk=KEY, fec=(app.FEC_GROUP, app.FEC_PARITY)) as sender:
+        assert isinstance(sender.connection.checksum, app.Aead)
+        assert sender.send_message("secret message")
+        assert sender.send_file(str(source / "file.bin"))
+    received = secure_receiver.wait_for(2)
+    assert received[0] == b"secret message"
+    assert (tmp_path / "file.bin").read_bytes() == (source / "file.bin").read_bytes()
+
+
+def test_data_and_filename_are_not_sent_in_plaintext(secure_receiver, tmp_path):
+    recorder = Recorder(secure_receiver.address)
+    message = b"plaintext that must not be seen " * 100
+    try:
+        with app.Sender(recorder.address, 1000, psk=KEY) as sender:
+            assert sender.send_message(message)
+        assert secure_receiver.wait_for(1) == [message]
+    finally:
+        recorder.close()
+    assert not any(b"plaintext" in data for data in recorder.forward)
+
+
+def test_client_with_key_refuses_plain_receiver(receiver):
+    with pytest.raises(ConnectionError):
+        app.Sender(receiver.address, psk=KEY)
+
+
+@pytest.mark.parametrize("key", [None, b"other secret"])
+def test_client_without_the_key_is_not_served(secure_receiver, monkeypatch, key):
+    monkeypatch.setattr(app, "HANDSHAKE_ATTEMPTS", 1)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        assert app.handshake(client, secure_receiver.address, key=app.psk_key(key) if key else None) is None
+    finally:
+        client.close()
+    assert not secure_receiver.server.sessions
+
+
+def test_tampered_fragment_is_dropped():
+    client_key, receiver_key = os.urandom(32), os.urandom(32)
+    client = app.Aead(client_key, receiver_key)
+    receiver = app.Aead(receiver_key, client_key, client=False)
+    fragment = app.make_fragment(b"payload", 1000, 5, 3, checksum=client)
+    assert bytes(app.PacketCodec.decode(memoryview(fragment), receiver)[6]) == b"payload"
+    # header is authenticated as associated data, data and tag are authenticated by tag
+    for position in (0, 15, 19, len(fragment) - 10, len(fragment) - 1):
+        tampered = bytearray(fragment)
+        tampered[position] ^= 0x01
+        assert not app.PacketCodec.decode(memoryview(tampered), receiver)[-1]
+    # datagram larger than any fragment does not fit into buffer of decrypted data
+    assert receiver.open(memoryview(fragment + bytes(app.PROBE_SIZES[0]))) is None
+
+
+def test_fragments_never_share_nonce(secure_receiver, tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "file.bin").write_bytes(os.urandom(200000))
+    # lost fragments are sent again, parity and digest fragments are sent too
+    proxy = benchmark.ImpairmentProxy(secure_receiver.address, loss=0.1, seed=1)
+    stopped = threading.Event()
+    thread = threading.Thread(target=proxy.run, args=(stopped,), daemon=True)
+    thread.start()
+    recorder = Recorder(proxy.address)
+    try:
+        with app.Sender(recorder.address, 1000, psk=KEY, fec=(app.FEC_GROUP, app.FEC_PARITY)) as sender:
+            assert sender.send_message(os.urandom(50000))
+            assert sender.send_file(str(source / "file.bin"))
+        secure_receiver.wait_for(2)
+    finally:
+        recorder.close()
+        stopped.set()
+        thread.join()
+        proxy.close()
+    # fragment of client sent again with the same nonce is the same encrypted fragment, since encryption
+    # with the same key, nonce, header and data gives the same result
+    sealed = collections.defaultdict(set)
+    for data in recorder.forward:
+        if data[0] in (app.DATA, app.PARITY, app.DIGEST, app.HEADER):
+            sealed[app.Aead.client_nonce(data[:app.FRAGMENT_HEADER.size])].add(data)
+    types = {data[0] for datagrams in sealed.values() for data in datagrams}
+    assert types == {app.DATA, app.PARITY, app.DIGEST, app.HEADER}
+    assert all(len(datagrams) == 1 for datagrams in sealed.values())
+    assert len(recorder.forward) > len(sealed)
+    # every reply of receiver has counter of its own
+    counters = [app.Aead.receiver_nonce(data[:app.FRAGMENT_HEADER.size]) for data in recorder.backward
+                if data[0] not in (app.INIT, app.PROBE)]
+    assert counters and len(counters) == len(set(counters))
+
+
+def test_message_datagrams_never_share_nonce(secure_receiver):
+    proxy = benchmark.ImpairmentProxy(secure_receiver.address, loss=0.1, seed=1)
+    stopped = threading.Event()
+    thread = threading.Thread(target=proxy.run, args=(stopped,), daemon=True)
+    thread.start()
+    recorder = Recorder(proxy.address)
+    messages = [os.urandom(100) for _ in range(1000)]
+    try:
+        with app.Sender(recorder.address, 1000, psk=KEY) as sender:
+            with sender.open_messages(flush_delay=0.001) as stream:
+                for message in messages:
+                    stream.send(message)
+            assert stream.close()
+    finally:
+        recorder.close()
+        stopped.set()
+        thread.join()
+        proxy.close()
+    assert secure_receiver.messages == messages
+    # datagram of messages sent again is the same encrypted datagram, those with new messages have index of their own
+    sealed = collections.defaultdict(set)
+    for data in recorder.forward:
+        if data[0] == app.MESSAGES:
+            sealed[app.Aead.client_nonce(data[:app.FRAGMENT_HEADER.size])].add(data)
+    assert all(len(datagrams) == 1 for datagrams in sealed.values())
+    assert len(sealed) >= len(messages) // 9
+    counters = [app.Aead.receiver_nonce(data[:app.FRAGMENT_HEADER.size]) for data in recorder.backward
+                if data[0] not in (app.INIT, app.PROBE)]
+    assert counters and len(counters) == len(set(counters))
+
+
+def test_size_of_data_leaves_room_for_tag():
+    connection = app.Connection(None, None, app.PROTOCOL_VERSION, 1)
+    connection.checksum = app.Aead(os.urandom(32), os.urandom(32))
+    assert app.data_size(connection, 0) == app.MAX_DATAGRAM - app.FRAGMENT_HEADER.size - app.AEAD_TAG
+    assert app.data_size(connection, 5000) == app.MAX_DATAGRAM - app.FRAGMENT_HEADER.size - app.AEAD_TAG
+    assert app.data_size(connection, 500) == 500
+
+
+def test_psk_file(tmp_path):
+    path = tmp_path / "psk"
+    path.write_bytes(b"secret\n")
+    arguments = app.make_argument_parser().parse_args(["serve", "0", "--psk-file", str(path)])
+    assert app.read_psk(arguments) == b"secret"
+    path.write_bytes(b"\n")
+    with pytest.raises(ValueError):
+        app.read_psk(arguments)
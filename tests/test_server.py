@@ -0,0 +1,62 @@
+"""
+Server that receives transfers of many clients at once in one selector loop
+"""
+import os
+import socket
+import threading
+
+import pytest
+
+import app
+
+
+def send(address, message, version=app.PROTOCOL_VERSION):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        connection = app.handshake(client, address, version)
+        return connection is not None and app.transfer(connection, 1000, message, 0)
+    finally:
+        client.close()
+
+
+def test_clients_are_served_at_the_same_time(receiver):
+    messages = [os.urandom(100000) for _ in range(4)]
+    results = [None] * len(messages)
+
+    def client(i):
+        results[i] = send(receiver.address, messages[i])
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(len(messages))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(results)
+    assert sorted(receiver.wait_for(len(messages))) == sorted(messages)
+
+
+def test_sessions_get_different_ids(receiver):
+    clients = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(2)]
+    sessions = {app.handshake(client, receiver.address).session for client in clients}
+    assert len(sessions) == 2 and 0 not in sessions
+    for client in clients:
+        client.close()
+
+
+@pytest.mark.parametrize("datagram", [
+    lambda connection: b"\x01",
+    lambda connection: b"\x01\x00\x01",
+    lambda connection: bytes([app.DATA]),
+    # filename that is not valid utf-8
+    lambda connection: connection.checksum.seal_datagram(
+        app.FRAGMENT_HEADER.pack(app.HEADER, 0, 3, connection.session, 1, 1, 1000, 3) + b"\xff\xfe\xfd"),
+])
+def test_malformed_datagram_does_not_stop_server(receiver, datagram):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, receiver.address)
+    # malformed datagram comes from client that already has session, so that it's dispatched to it
+    client.sendto(datagram(connection), receiver.address)
+    client.close()
+    message = os.urandom(20000)
+    assert send(receiver.address, message)
+    assert receiver.wait_for(1) == [message]
@@ -0,0 +1,124 @@
+"""
+Selective repeat of protocol version 2 and batches of version 1 over loopback
+"""
+import os
+import socket
+import threading
+
+import pytest
+
+import app
+import benchmark
+
+
+class AckCorrupter:
+    """
+    Relays datagrams between client and receiver and flips a bit in every third reply of receiver
+    """
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.client = None
+        self.replies = 0
+        self.stopped = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            if address != self.upstream:
+                self.client = address
+                self.sock.sendto(data, self.upstream)
+                continue
+            self.replies += 1
+            if self.replies % 3 == 0:
+                data = bytearray(data)
+                data[self.replies % len(data)] ^= 0x10
+            self.sock.sendto(bytes(data), self.client)
+
+    def close(self):
+        self.stopped.set()
+
+
+@pytest.mark.parametrize("version", [app.LEGACY_VERSION, app.PROTOCOL_VERSION])
+def test_corrupted_fragments_are_sent_again(monkeypatch, version):
+    monkeypatch.setattr(app, "ALTERED", True)
+    benchmark.run_transfer(500, version, message=os.urandom(50000))
+
+
+def test_missing_fragment_is_sent_again_after_its_timer(monkeypatch):
+    monkeypatch.setattr(app, "MISSING", True)
+    benchmark.run_transfer(1000, app.PROTOCOL_VERSION, message=os.urandom(20000))
+
+
+def test_sack_reports_fragments_after_gap():
+    received = bytearray(16)
+    for i in (0, 1, 4, 11):
+        received[i] = 1
+    ack = app.make_sack(2, received, 11)
+    parsed = app.parser(ack, app.PROTOCOL_VERSION)
+    assert parsed['type'] == app.SACK and parsed['order'] == 2
+    # bit 0 stands for fragment 3
+    assert parsed['data'] == bytes([0b01000000, 0b10000000])
+
+
+@pytest.mark.parametrize("flag", [app.CHECKSUMS['crc16'], app.CHECKSUMS['crc32']])
+def test_corrupted_ack_is_dropped(flag):
+    checksum = app.Checksum(flag)
+    ack = app.make_sack(3, bytearray([1, 1, 1, 0, 0, 1]), 5)
+    sealed = checksum.seal_datagram(ack)
+    assert checksum.open_datagram(memoryview(sealed)) == ack
+    for i in range(len(sealed)):
+        corrupted = bytearray(sealed)
+        corrupted[i] ^= 0x01
+        assert checksum.open_datagram(memoryview(corrupted)) is None
+    assert checksum.open_datagram(memoryview(sealed[:4])) is None
+
+
+def test_transfer_through_path_that_corrupts_acks(monkeypatch):
+    # every fragment is acknowledged, so that corrupted acks do not leave the window waiting for timers
+    monkeypatch.setattr(app, "ACK_EVERY", 1)
+    message = os.urandom(200000)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    relay = AckCorrupter(sock.getsockname())
+    result = {}
+
+    # server keeps acknowledging fragments sent again after the transfer, in case its last acks got corrupted
+    server = app.Server(sock, lambda address, typ, filename, data: result.update(data=data))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    connection = app.handshake(client, relay.address)
+    assert app.transfer(connection, 1000, message, 0)
+    server.stop()
+    thread.join()
+    assert relay.replies > 3
+    relay.close()
+    client.close()
+    sock.close()
+    assert result['data'] == message
+
+
+def test_legacy_receiver_echoes_initial_fragment():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def echo():
+        data, address = receiver.recvfrom(2048)
+        receiver.sendto(data, address)
+
+    threading.Thread(target=echo, daemon=True).start()
+    assert app.handshake(client, receiver.getsockname()).version == app.LEGACY_VERSION
+    assert app.negotiate_version(app.make_handshake()) == app.PROTOCOL_VERSION
+    assert app.negotiate_version(app.initial_fragment) == app.LEGACY_VERSION
+    client.close()
+    receiver.close()
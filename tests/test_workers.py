@@ -0,0 +1,78 @@
+"""
+Worker processes that receive on the same port with SO_REUSEPORT, receive buffer and locks of received files
+"""
+import errno
+import os
+import socket
+import threading
+
+import pytest
+
+import app
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT"), reason="system does not support SO_REUSEPORT")
+
+
+def test_receive_buffer_is_set():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    granted = app.set_receive_buffer(sock, 65536)
+    assert granted == sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) and granted >= 65536
+    sock.close()
+
+
+def test_file_is_locked_while_it_is_received(tmp_path):
+    path = str(tmp_path / "file.bin")
+    sink = app.FileSink(path, 10)
+    with pytest.raises(OSError) as error:
+        app.FileSink(path, 10)
+    assert error.value.errno == errno.EBUSY
+    sink.write(0, b"0123456789")
+    assert sink.finish() == path
+    # lock is released with the file
+    app.FileSink(path, 10).abort()
+    assert open(path, "rb").read() == b"0123456789"
+
+
+def test_workers_receive_files_of_all_clients(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    receiver = app.Receiver(0, "127.0.0.1", on_complete=lambda *arguments: None, workers=3, rcvbuf=1 << 20)
+    before = app.METRICS.transfers_completed
+    thread = threading.Thread(target=receiver.serve, kwargs=dict(forever=True), daemon=True)
+    thread.start()
+    files = {f"file{i}.bin": os.urandom(100000) for i in range(6)}
+    source = tmp_path / "source"
+    source.mkdir()
+    clients = []
+    try:
+        for name, data in files.items():
+            (source / name).write_bytes(data)
+            client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            clients.append(client)
+            # every client has address of its own, so kernel spreads clients over workers
+            assert app.transfer(app.handshake(client, receiver.address), 1000, None, str(source / name))
+    finally:
+        receiver.stop()
+        thread.join(10)
+        receiver.close()
+        for client in clients:
+            client.close()
+    for name, data in files.items():
+        assert (tmp_path / name).read_bytes() == data
+    # metrics published by other workers are added up once they stop
+    assert app.METRICS.transfers_completed - before == len(files)
+
+
+def test_metrics_of_workers_are_combined():
+    metrics = app.Metrics()
+    shared = [0.0] * (2 * metrics.size())
+    metrics.share(shared, 0)
+    metrics.packets_received = 3
+    other = app.Metrics()
+    other.share(shared, 1)
+    other.packets_received = 4
+    other.rtt.observe(0.01)
+    other.publish()
+    combined = metrics.combined()
+    assert combined.packets_received == 7 and combined.rtt.count == 1
+    metrics.unshare()
+    assert metrics.packets_received == 7 and metrics.combined() is metrics